@@ -0,0 +1,94 @@
+"""
+Benchmark for onsets.py: how many seconds of audio it processes per
+second, and the most memory it uses while doing so.
+
+To run:
+
+python bench_onsets.py [--minutes 10]
+
+A synthetic song of clicks over noise is written to a temp file first.
+"""
+
+# Copyright 2016-2020 by John Bauer
+# Distributed under the Apache License 2.0
+
+# TO THE EXTENT PERMITTED BY LAW, THE SOFTWARE IS PROVIDED "AS IS",
+# WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT
+# LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE, TITLE AND NON-INFRINGEMENT. IN NO EVENT SHALL
+# THE COPYRIGHT HOLDERS OR ANYONE DISTRIBUTING THE SOFTWARE BE LIABLE
+# FOR ANY DAMAGES OR OTHER LIABILITY, WHETHER IN CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE
+# OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import argparse
+import contextlib
+import os
+import tempfile
+import tracemalloc
+import wave
+from timeit import default_timer
+
+import onsets
+
+def write_click_song(filename, minutes, bpm=150.0, rate=44100, chunk_seconds=10):
+    """
+    Writes a stereo 16 bit wav with a click every beat, a chunk at a time
+    """
+    numpy = onsets.numpy
+    rng = numpy.random.RandomState(1234)
+    click_length = int(0.03 * rate)
+    click = (12000 * numpy.exp(-numpy.arange(click_length) / (0.005 * rate)) *
+             numpy.sin(2 * numpy.pi * 1000 * numpy.arange(click_length) / rate))
+    samples_per_beat = 60.0 / bpm * rate
+    total = int(minutes * 60 * rate)
+    chunk = chunk_seconds * rate
+    with contextlib.closing(wave.open(filename, "wb")) as wav:
+        wav.setnchannels(2)
+        wav.setsampwidth(2)
+        wav.setframerate(rate)
+        for start in range(0, total, chunk):
+            length = min(chunk, total - start)
+            samples = rng.normal(0, 300, length)
+            first_beat = int(numpy.ceil(start / samples_per_beat))
+            beat = first_beat
+            while beat * samples_per_beat < start + length:
+                offset = int(beat * samples_per_beat) - start
+                end = min(length, offset + click_length)
+                samples[offset:end] += click[:end - offset]
+                beat = beat + 1
+            samples = numpy.clip(samples, -32768, 32767).astype('<i2')
+            wav.writeframes(numpy.repeat(samples, 2).tobytes())
+
+def bench_onsets(minutes, block_seconds):
+    fd, filename = tempfile.mkstemp(suffix=".wav")
+    os.close(fd)
+    try:
+        write_click_song(filename, minutes)
+        tracemalloc.start()
+        start = default_timer()
+        envelope = onsets.onset_envelope(filename, block_seconds=block_seconds)
+        times = onsets.pick_onsets(envelope)
+        elapsed = default_timer() - start
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    finally:
+        os.remove(filename)
+    audio_seconds = minutes * 60.0
+    print("%.1f minutes of audio, %.0f second blocks" % (minutes, block_seconds))
+    print("%d onsets in %.2f seconds: %.0f seconds of audio per second" %
+          (len(times), elapsed, audio_seconds / elapsed))
+    print("peak memory %.1f MB" % (peak / 1e6))
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Benchmark onsets.py')
+    parser.add_argument('--minutes', type=float, default=10.0,
+                        help="Length of the synthetic song")
+    parser.add_argument('--block_seconds', type=float, default=10.0,
+                        help="Seconds of audio read at a time")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    onsets.require_numpy()
+    bench_onsets(args.minutes, args.block_seconds)
@@ -0,0 +1,114 @@
+"""
+Benchmarks for the slower pieces of remap_bpm.
+
+To run:
+
+python bench_remap_bpm.py
+
+Each benchmark builds a synthetic chart, so no simfiles are needed.
+"""
+
+# Copyright 2016-2020 by John Bauer
+# Distributed under the Apache License 2.0
+
+# TO THE EXTENT PERMITTED BY LAW, THE SOFTWARE IS PROVIDED "AS IS",
+# WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT
+# LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE, TITLE AND NON-INFRINGEMENT. IN NO EVENT SHALL
+# THE COPYRIGHT HOLDERS OR ANYONE DISTRIBUTING THE SOFTWARE BE LIABLE
+# FOR ANY DAMAGES OR OTHER LIABILITY, WHETHER IN CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE
+# OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import argparse
+import contextlib
+import io
+from timeit import default_timer
+
+import remap_bpm
+
+def hold_chart(num_measures, snap, hold_rows, gap_rows, width=4):
+    """
+    Builds a list of measures of packed rows where every panel is almost always
+    holding: a head, a tail hold_rows later, then gap_rows of nothing.
+    Every other hold is half as long.  Panels are staggered so most
+    rows have a head or tail on them.
+    """
+    head = remap_bpm.NOTE_HOLD
+    tail = remap_bpm.NOTE_TAIL
+    rows = [0] * (num_measures * snap)
+    for panel in range(width):
+        start = panel * (hold_rows + gap_rows) // width
+        count = 0
+        while start + hold_rows < len(rows):
+            length = hold_rows if count % 2 == 0 else hold_rows // 2
+            rows[start] = remap_bpm.set_row_note(rows[start], panel, head)
+            rows[start + length] = remap_bpm.set_row_note(rows[start + length], panel, tail)
+            start = start + length + gap_rows
+            count = count + 1
+    return [rows[i:i+snap] for i in range(0, len(rows), snap)]
+
+def rescan_remove_small_holds(new_measures, remove_small_holds):
+    """
+    The previous implementation: walk forward from every head until
+    the tail or the threshold.  Kept here for comparison.
+    """
+    for measure_idx, measure in enumerate(new_measures):
+        for beat_idx, beat in enumerate(measure):
+            for foot_idx in range(remap_bpm.MAX_PANELS):
+                foot = remap_bpm.row_note(beat, foot_idx)
+                if foot != remap_bpm.NOTE_HOLD and foot != remap_bpm.NOTE_ROLL:
+                    continue
+                hold_length = 0
+                next_beat_idx = beat_idx
+                next_measure_idx = measure_idx
+                while next_measure_idx < len(new_measures):
+                    hold_length = hold_length + 4.0 / len(new_measures[next_measure_idx])
+                    if hold_length > remove_small_holds:
+                        break
+                    next_row = new_measures[next_measure_idx][next_beat_idx]
+                    if remap_bpm.row_note(next_row, foot_idx) == remap_bpm.NOTE_TAIL:
+                        beat = remap_bpm.set_row_note(beat, foot_idx, remap_bpm.NOTE_TAP)
+                        new_measures[measure_idx][beat_idx] = beat
+                        new_measures[next_measure_idx][next_beat_idx] = remap_bpm.set_row_note(next_row, foot_idx, remap_bpm.NOTE_EMPTY)
+                        break
+                    next_beat_idx = next_beat_idx + 1
+                    if next_beat_idx >= len(new_measures[next_measure_idx]):
+                        next_beat_idx = 0
+                        next_measure_idx = next_measure_idx + 1
+
+def time_call(function, *args):
+    start = default_timer()
+    # the real thing prints a line per hold it removes
+    with contextlib.redirect_stdout(io.StringIO()):
+        function(*args)
+    return default_timer() - start
+
+def bench_small_holds(measure_counts, snap, threshold):
+    print("remove_small_holds_from_stepchart, snap %d, threshold %.1f beats" % (snap, threshold))
+    print("measures   sweep (s)   rescan (s)")
+    # holds just longer than the threshold are the worst case for
+    # the rescan, since every head walks all the way to the threshold
+    hold_rows = int(threshold * snap / 4) + 1
+    for num_measures in measure_counts:
+        measures = hold_chart(num_measures, snap, hold_rows, gap_rows=snap // 16)
+        rows = [row for measure in measures for row in measure]
+        notes = dict((i, row) for i, row in enumerate(rows) if row)
+        sweep = time_call(remap_bpm.remove_small_holds_from_stepchart,
+                          notes, snap, threshold, "dance-single", "Bench")
+        rescan = time_call(rescan_remove_small_holds, measures, threshold)
+        rows = [row for measure in measures for row in measure]
+        assert notes == dict((i, rows[i]) for i in notes)
+        print("%8d  %10.3f  %11.3f" % (num_measures, sweep, rescan))
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Benchmark remap_bpm')
+    parser.add_argument('--snap', default=192, type=int,
+                        help="Rows per measure in the synthetic charts")
+    parser.add_argument('--threshold', default=4.0, type=float,
+                        help="Value of --remove_small_holds to benchmark")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    bench_small_holds([25, 50, 100, 200], args.snap, args.threshold)
@@ -9,13 +9,27 @@ To run:
 
 python bpms.py notes.txt estimate [beats]
 
-notes.txt: a list of offsets in the song
-estimate: a bpm to try to match
-beats: the starting beat for the first offset.  optional
+notes.txt: a list of offsets in the song, an .sm or .ssc file to
+  use the notes of all of its charts, or a .wav of the song to find
+  the notes with onsets.py
+estimate: a bpm to try to match, or auto to guess one with estimate_bpm.
+  Not used for a simfile, whose notes already have beats
+beats: the starting beat for the first offset.  optional.  Not used
+  for a simfile
 
 Output:
 
 offset, bpms which can be copy/pasted into the .sm file
+
+It can also be used from python.  time_song takes any iterable of
+times, such as a list, a numpy array, or read_times of an open file,
+and returns a Timing:
+
+  with open("notes.txt") as fin:
+      timing = bpms.time_song(bpms.read_times(fin))
+  print(bpms.timing_text(timing.offset, timing.bpms))
+
+or time_simfile to retime a simfile from its own charts.
 """
 
 # Copyright 2016 by John Bauer
@@ -30,58 +44,536 @@ offset, bpms which can be copy/pasted into the .sm file
 # OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE
 # OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 
-import sys
+import argparse
+import math
+from collections import namedtuple
 
-if __name__ == "__main__":
-    if len(sys.argv) < 3:
-        print("%s filename bpm [offset-beat]" % sys.argv[0])
-        sys.exit(0)
-    filename = sys.argv[1]
-    bpm = float(sys.argv[2])
-    start_beat = float(sys.argv[3]) if len(sys.argv) > 3 else 0.0
-    lines = [line.strip() for line in open(filename).readlines()]
-    lines = [line.split("#")[0] for line in lines]
-    times = [float(line) for line in lines if line]
-
-    print("// BPMS THAT GO THROUGH THE GIVEN TIMES")
-
-    current_beat = start_beat
-    beats = [current_beat]
-    for index, (start, end) in enumerate(zip(times[:-1], times[1:])):
-        interval = round((end - start) / (60. / bpm) * 2) / 2.0
-        tempo = 60. / (end - start) * interval
-        if index == 0:
-            print("#OFFSET:%.4f;" % (-times[0] + (60. / tempo) * current_beat))
-            print("#BPMS:")
-        continuation = "," if index < len(times) - 2 else ";"
-        display_beat = current_beat if index > 0 else 0
-        # comment = " # %d" % start
-        comment = ""
-        print("%.1f=%.4f%s%s" % (display_beat, tempo, continuation, comment))
-        current_beat = current_beat + interval
-        beats.append(current_beat)
+import fitting
+import onsets
+import remap_bpm
+
+try:
+    import numpy
+except ImportError:
+    # everything works without numpy, just slower
+    numpy = None
+
+# An OFFSET and list of (beat, bpm) for a song, along with the largest
+# and RMS difference between the times that timing gives the notes and
+# the actual times
+Timing = namedtuple("Timing", "offset bpms max_error rms_error")
+
+# The gaps between notes are rounded to this fraction of a beat, which
+# is fine enough for 16ths (3/12) and triplets (4/12)
+BEAT_SUBDIVISION = 12
+
+def read_times(lines):
+    """
+    Reads one time per line from any iterable of lines, such as an
+    open file, one line at a time.  Blank lines and anything after
+    a # are skipped.
+    """
+    for line in lines:
+        line = line.split("#")[0].strip()
+        if line:
+            yield float(line)
+
+# Lengths, in beats, that the gap between two notes is likely to be,
+# along with how much a match counts.  Whole beats count the most so
+# that 8th notes at one tempo don't look like quarter notes at
+# double the tempo.
+BEAT_MULTIPLES = ((0.25, 0.25), (1 / 3.0, 0.25), (0.5, 0.5), (2 / 3.0, 0.25),
+                  (0.75, 0.25), (1.0, 1.0), (1.5, 0.5), (2.0, 1.0),
+                  (3.0, 1.0), (4.0, 1.0))
+
+def interval_histogram(times, max_interval, bin_width, sigma):
+    """
+    Histogram of the gaps between every pair of notes up to
+    max_interval apart, not just neighboring notes, smoothed with a
+    gaussian of width sigma seconds.
+    """
+    num_bins = int(max_interval / bin_width) + 2
+    counts = [0] * num_bins
+    start = 0
+    for end, time in enumerate(times):
+        while time - times[start] > max_interval:
+            start = start + 1
+        for other in times[start:end]:
+            counts[int((time - other) / bin_width + 0.5)] += 1
+
+    radius = int(3 * sigma / bin_width) + 1
+    kernel = [math.exp(-0.5 * (x * bin_width / sigma) ** 2) for x in range(-radius, radius + 1)]
+    histogram = [0.0] * num_bins
+    for i, count in enumerate(counts):
+        if not count:
+            continue
+        for j, weight in enumerate(kernel):
+            k = i + j - radius
+            if 0 <= k < num_bins:
+                histogram[k] += count * weight
+    return histogram
+
+def histogram_value(histogram, interval, bin_width):
+    position = interval / bin_width
+    i = int(position)
+    if i + 1 >= len(histogram):
+        return 0.0
+    fraction = position - i
+    return histogram[i] * (1 - fraction) + histogram[i + 1] * fraction
+
+def comb_score(histogram, bpm, bin_width):
+    """
+    How many of the gaps between notes are a likely number of beats
+    at this bpm, weighted by BEAT_MULTIPLES.
+    """
+    seconds_per_beat = 60.0 / bpm
+    return sum(weight * histogram_value(histogram, multiple * seconds_per_beat, bin_width)
+               for multiple, weight in BEAT_MULTIPLES)
+
+def assign_beats(times, bpm, start_beat=0.0, subdivision=BEAT_SUBDIVISION):
+    """
+    Gives each time a beat by rounding the gap since the previous time
+    to the nearest 1/subdivision of a beat at the estimated bpm.
+    """
+    seconds_per_beat = 60.0 / bpm
+    beats = [start_beat]
+    for start, end in zip(times[:-1], times[1:]):
+        interval = round((end - start) / seconds_per_beat * subdivision) / float(subdivision)
+        beats.append(beats[-1] + interval)
+    return beats
+
+def prefix_sums(beats, times):
+    """
+    Running totals of x, y, xx, xy and yy for beats x and times y, so
+    the least squares fit of any range of notes takes constant time.
+    """
+    sums = [(0.0, 0.0, 0.0, 0.0, 0.0)]
+    for x, y in zip(beats, times):
+        last = sums[-1]
+        sums.append((last[0] + x, last[1] + y, last[2] + x * x,
+                     last[3] + x * y, last[4] + y * y))
+    return sums
+
+def range_fit(sums, start, end):
+    """
+    Least squares fit of times = A * beats + B for notes start..end-1.
+
+    Returns (A, B, squared error), or None if the notes are all on
+    the same beat.
+    """
+    N = end - start
+    sum_x, sum_y, sum_xx, sum_xy, sum_yy = [b - a for a, b in zip(sums[start], sums[end])]
+    denominator = N * sum_xx - sum_x * sum_x
+    if denominator <= 1e-9 * N * N:
+        return None
+    A = (N * sum_xy - sum_x * sum_y) / denominator
+    B = (sum_y - A * sum_x) / N
+    error = sum_yy - A * sum_xy - B * sum_y
+    return A, B, max(error, 0.0)
+
+def segment_notes(beats, times, tolerance=0.01):
+    """
+    Splits the notes into runs which each fit a straight line, that
+    is a constant BPM, with an RMS error of at most tolerance seconds.
+
+    Each run starts where the last one ended and is made as long as
+    it will go.  Its end is found by doubling its length until it no
+    longer fits and then bisecting, so this is O(n log n) with the
+    prefix sums making each fit constant time.  The RMS error of a
+    run doesn't only go up as it gets longer, so this can stop short
+    of the longest run that fits, and the number of runs is usually
+    but not always the fewest possible.  The boundaries are then
+    moved to where they fit best, which can leave a run slightly
+    over tolerance; timing_errors gives the actual errors.
+
+    Notes on the same beat as the start of a run, such as an onset
+    found twice, stay in that run, and notes at the end which are all
+    on one beat are joined to the run before them.
+
+    Returns a list of (start, end, A, B), where notes start..end-1
+    fit times = A * beats + B.
+    """
+    num_notes = len(times)
+    if num_notes < 2:
+        raise ValueError("Need at least two times to find BPMs")
+    sums = prefix_sums(beats, times)
+    limit = tolerance * tolerance
+
+    def fits(start, end):
+        fit = range_fit(sums, start, end)
+        return fit is not None and fit[2] <= limit * (end - start)
+
+    bounds = [0]
+    start = 0
+    while start < num_notes:
+        # the shortest run with a fit, which has notes on two beats
+        end = start + 2
+        while end <= num_notes and range_fit(sums, start, end) is None:
+            end = end + 1
+        if end > num_notes:
+            # the rest of the notes are on one beat.  the runs are
+            # joined together below
+            bounds.append(num_notes)
+            break
+        step = 1
+        while end + step <= num_notes and fits(start, end + step):
+            end = end + step
+            step = step * 2
+        low, high = end, min(end + step, num_notes + 1)
+        while high - low > 1:
+            middle = (low + high) // 2
+            if fits(start, middle):
+                low = middle
+            else:
+                high = middle
+        end = low
+        # a single note can't be a run on its own
+        if end == num_notes - 1:
+            end = end - 1 if end - start > 2 else num_notes
+        bounds.append(end)
+        start = end
+
+    # Each run reaches as far as it can, so it can take a few notes
+    # from the next tempo.  Move each boundary to where the runs on
+    # either side of it fit best together, keeping the number of runs.
+    def run_error(start, end):
+        fit = range_fit(sums, start, end)
+        return fit[2] if fit is not None else float("inf")
+    for repeat in range(2):
+        for i in range(1, len(bounds) - 1):
+            first, last = bounds[i - 1], bounds[i + 1]
+            # both runs need at least two notes
+            choices = range(first + 2, last - 1)
+            if len(choices) == 0:
+                continue
+            bounds[i] = min(choices, key=lambda x: run_error(first, x) + run_error(x, last))
+
+    segments = []
+    start = 0
+    for end in bounds[1:]:
+        fit = range_fit(sums, start, end)
+        if fit is None:
+            # the notes are all on one beat, so they can't have a BPM
+            # of their own.  join them to the next run
+            continue
+        A, B, _ = fit
+        segments.append((start, end, A, B))
+        start = end
+    if start < num_notes:
+        # or to the previous run, if they are at the end
+        if not segments:
+            raise ValueError("All of the notes are on the same beat")
+        start = segments.pop()[0]
+        A, B, _ = range_fit(sums, start, num_notes)
+        segments.append((start, num_notes, A, B))
+    return segments
+
+def segments_to_bpms(beats, times, segments):
+    """
+    Turns the runs from segment_notes into an OFFSET and BPMS.
+
+    Each BPM change goes where the timing so far crosses the fitted
+    line of the next run, but no earlier than the last note of the
+    previous run and no later than the first note of the next.  The
+    next run's BPM is then refit through that point, so if the
+    change had to be moved, the error doesn't carry on into the
+    rest of the song.
+
+    Returns (offset, [(beat, bpm), ...])
+    """
+    start, end, A, B = segments[0]
+    offset = -B
+    bpms = [(0.0, 60.0 / A)]
+    # the timing so far is the line through (anchor_beat, anchor_time)
+    anchor_beat, anchor_time = 0.0, B
+    for start, end, fit_A, fit_B in segments[1:]:
+        low, high = beats[start - 1], beats[start]
+        if fit_A == A:
+            beat = (low + high) / 2.0
+        else:
+            beat = (fit_B - anchor_time + A * anchor_beat) / (A - fit_A)
+        beat = min(max(beat, low), high)
+        time = anchor_time + A * (beat - anchor_beat)
+
+        sum_xx = sum((x - beat) ** 2 for x in beats[start:end])
+        sum_xy = sum((x - beat) * (y - time) for x, y in zip(beats[start:end], times[start:end]))
+        A = sum_xy / sum_xx if sum_xx > 0 and sum_xy > 0 else fit_A
+        anchor_beat, anchor_time = beat, time
+        bpms.append((beat, 60.0 / A))
+    return offset, bpms
+
+def timing_text(offset, bpms):
+    return ("#OFFSET:%.4f;\n#BPMS:" % offset +
+            ",\n".join("%.3f=%.4f" % x for x in bpms) + ";")
+
+def timing_errors(beats, times, offset, bpms):
+    """
+    Projected minus actual time of each note with this OFFSET and
+    BPMS, rounded the way timing_text writes them.
+    """
+    offset = float("%.4f" % offset)
+    bpms = [(float("%.3f" % beat), float("%.4f" % bpm)) for beat, bpm in bpms]
+    projected = remap_bpm.TimingTable(offset, bpms, []).times(beats)
+    return [x - y for x, y in zip(projected, times)]
+
+def make_timing(beats, times, offset, bpms):
+    errors = timing_errors(beats, times, offset, bpms)
+    stats = fitting.residual_stats(errors)
+    return Timing(offset, bpms, stats.max_error, stats.rms_error)
+
+def interval_timing(beats, times):
+    """
+    A BPM change at every note, so the timing goes through every time
+    exactly.  Notes on the same beat give a BPM of 0, in which case
+    the errors are None.
+
+    Notes at the same time as the note before them, such as an onset
+    found twice, would need an infinite BPM, so only the first of them
+    gets a BPM change.
+    """
+    notes = [(beats[0], times[0])]
+    for beat, time in zip(beats[1:], times[1:]):
+        if time > notes[-1][1]:
+            notes.append((beat, time))
+    if len(notes) < 2:
+        raise ValueError("Need notes at two different times to find BPMs")
+    bpms = []
+    for index in range(len(notes) - 1):
+        (start_beat, start_time), (end_beat, end_time) = notes[index], notes[index + 1]
+        tempo = 60. / (end_time - start_time) * (end_beat - start_beat)
+        bpms.append((start_beat if index > 0 else 0.0, tempo))
+    offset = -times[0] + (60. / bpms[0][1]) * beats[0] if bpms[0][1] else -times[0]
+    if all(x[1] > 0 for x in bpms):
+        return make_timing(beats, times, offset, bpms)
+    return Timing(offset, bpms, None, None)
+
+def constant_timing(beats, times, robust=False):
+    """
+    One BPM, fit to the notes with least squares.  If robust, notes
+    far off the line are ignored, as in fitting.robust_fit_line.
+    """
+    if robust:
+        A, B, weights = fitting.robust_fit_line(beats, times)
+    else:
+        A, B = fitting.fit_line(beats, times)
+    return make_timing(beats, times, -B, [(0.0, 60.0 / A)])
+
+def segmented_timing(beats, times, tolerance=0.01):
+    """
+    A BPM for each run of notes which fits within tolerance, as found by segment_notes
+    """
+    offset, bpms = segments_to_bpms(beats, times, segment_notes(beats, times, tolerance))
+    return make_timing(beats, times, offset, bpms)
+
+def time_song(times, bpm=None, start_beat=0.0, tolerance=0.01):
+    """
+    Finds the timing of a song from any iterable of note times.
+
+    If bpm is None, it is guessed with estimate_bpm, which raises
+    ValueError if there is no good guess.  Each note is
+    given a beat with assign_beats, and the returned Timing has a BPM
+    for each run of notes which fits within tolerance.
+    """
+    times = sorted(float(x) for x in times)
+    if bpm is None:
+        bpm = estimate_bpm(times)[0][0]
+    beats = assign_beats(times, bpm, start_beat)
+    return segmented_timing(beats, times, tolerance)
+
+SIMFILE_EXTENSIONS = (".sm", ".ssc")
+
+def is_simfile(filename):
+    return filename.lower().endswith(SIMFILE_EXTENSIONS)
+
+def time_simfile(filename, tolerance=0.01):
+    """
+    Finds the timing of a simfile from the notes of all of its charts,
+    with remap_bpm.simfile_onsets.  The charts already give the beat
+    of every note, so the notes keep their beats and only the times
+    are fit.
+    """
+    beats, times = remap_bpm.simfile_onsets(remap_bpm.read_simfile(filename))
+    return segmented_timing(list(beats), list(times), tolerance)
+
+def phase_coherence(times, bpm):
+    """
+    How well the notes line up with a beat grid at this bpm, from 0
+    to 1.
+
+    Each note is a unit vector pointing at its phase within the beat,
+    and the length of their average is 1 if every note is on the beat.
+    8ths cancel out at the beat but line up at twice the beat, 16ths
+    at four times and triplets at three times, so this averages the
+    lengths for one to four times the beat.
+    """
+    frequency = 2 * math.pi * bpm / 60.0
+    if numpy is not None and isinstance(times, numpy.ndarray):
+        phase = numpy.exp(1j * frequency * times)
+        phase2 = phase * phase
+        return float(abs(phase.sum()) + abs(phase2.sum()) +
+                     abs((phase2 * phase).sum()) + abs((phase2 * phase2).sum())) / (4 * len(times))
+    cos = math.cos
+    sin = math.sin
+    sum1 = sum2 = sum3 = sum4 = 0j
+    for time in times:
+        phase = complex(cos(frequency * time), sin(frequency * time))
+        phase2 = phase * phase
+        sum1 += phase
+        sum2 += phase2
+        sum3 += phase2 * phase
+        sum4 += phase2 * phase2
+    return (abs(sum1) + abs(sum2) + abs(sum3) + abs(sum4)) / (4 * len(times))
+
+GOLDEN_RATIO = (math.sqrt(5) - 1) / 2
+
+def refine_bpm(times, bpm, radius, tolerance=0.002):
+    """
+    Golden section search for the bpm with the best phase_coherence
+    within radius of bpm.
+
+    Over a whole song the peak is narrow, so radius should be about
+    the spacing of the grid the bpm came from.
+    """
+    low, high = bpm - radius, bpm + radius
+    a = high - GOLDEN_RATIO * (high - low)
+    b = low + GOLDEN_RATIO * (high - low)
+    score_a = phase_coherence(times, a)
+    score_b = phase_coherence(times, b)
+    while high - low > tolerance:
+        if score_a > score_b:
+            high, b, score_b = b, a, score_a
+            a = high - GOLDEN_RATIO * (high - low)
+            score_a = phase_coherence(times, a)
+        else:
+            low, a, score_a = a, b, score_b
+            b = low + GOLDEN_RATIO * (high - low)
+            score_b = phase_coherence(times, b)
+    return (low + high) / 2
+
+def estimate_bpm(times, min_bpm=80.0, max_bpm=240.0, step=0.25,
+                 num_candidates=5, bin_width=0.002, sigma=0.008):
+    """
+    Guesses the bpm of a list of note times, in seconds.
+
+    Candidates from min_bpm to max_bpm, every step bpm, are scored by
+    comb_score against a histogram of the gaps between notes.  The
+    best local maxima are refined with refine_bpm, which looks at the
+    whole song rather than the gaps, and then rescored by both.
+
+    Returns a list of up to num_candidates (bpm, confidence), best
+    first.  The confidence is each candidate's share of the total
+    score of the candidates, so a clear winner is close to 1.  Double
+    and half of the right tempo often show up as runners up.
+
+    Raises ValueError if the notes are too far apart for any bpm from
+    min_bpm to max_bpm to fit them.
+    """
+    times = sorted(times)
+    if len(times) < 2:
+        raise ValueError("Need at least two times to estimate a bpm")
+    max_interval = max(x[0] for x in BEAT_MULTIPLES) * 60.0 / min_bpm
+    histogram = interval_histogram(times, max_interval, bin_width, sigma)
+
+    num_steps = int((max_bpm - min_bpm) / step) + 1
+    grid = [min_bpm + i * step for i in range(num_steps)]
+    scores = [comb_score(histogram, bpm, bin_width) for bpm in grid]
+    peaks = [i for i in range(num_steps)
+             if scores[i] > 0 and
+             (i == 0 or scores[i] >= scores[i - 1]) and
+             (i == num_steps - 1 or scores[i] > scores[i + 1])]
+    peaks.sort(key=lambda i: -scores[i])
+
+    if numpy is not None:
+        times = numpy.array(times)
+    candidates = []
+    for i in peaks[:num_candidates + 2]:
+        bpm = refine_bpm(times, grid[i], step)
+        if any(abs(bpm - x[0]) < step for x in candidates):
+            continue
+        score = comb_score(histogram, bpm, bin_width) * phase_coherence(times, bpm)
+        candidates.append((bpm, score))
+    if not candidates:
+        raise ValueError("No bpm from %g to %g fits the gaps between the notes.  "
+                         "Are the notes too far apart?" % (min_bpm, max_bpm))
+    candidates.sort(key=lambda x: -x[1])
+    candidates = candidates[:num_candidates]
+    total = sum(x[1] for x in candidates)
+    return [(bpm, score / total) for bpm, score in candidates]
+
+
+def print_timing(title, timing):
+    print("// %s" % title)
+    print(timing_text(timing.offset, timing.bpms))
+    if timing.max_error is not None:
+        print("// max error %.4f, rms error %.4f" % (timing.max_error, timing.rms_error))
+
+def parse_args(args=None):
+    parser = argparse.ArgumentParser(description='Find the OFFSET and BPMS which match a list of times')
+    parser.add_argument('filename',
+                        help="File with one time, in seconds, per line, or a simfile or .wav to take the notes from")
+    parser.add_argument('bpm',
+                        help="A bpm to try to match, or auto to estimate one.  Not used for a simfile")
+    parser.add_argument('start_beat', nargs='?', type=float, default=None,
+                        help="The beat of the first time.  Default 0.  Not used for a simfile")
+    parser.add_argument('--tolerance', type=float, default=0.01,
+                        help="RMS error, in seconds, allowed for each run of notes with one BPM")
+    return parser.parse_args(args)
+
+def main(args=None):
+    args = parse_args(args)
+    if is_simfile(args.filename):
+        # the charts give the beats, so there is nothing to estimate
+        beats, times = remap_bpm.simfile_onsets(remap_bpm.read_simfile(args.filename))
+        beats, times = list(beats), list(times)
+    else:
+        if onsets.is_audio(args.filename):
+            times = [float(x) for x in onsets.audio_onsets(args.filename)]
+        else:
+            with open(args.filename) as fin:
+                times = list(read_times(fin))
+
+        if args.bpm == "auto":
+            try:
+                candidates = estimate_bpm(times)
+            except ValueError as e:
+                print("// Unable to estimate a bpm: %s" % e)
+                return
+            print("// ESTIMATED BPMS AND CONFIDENCE")
+            for candidate in candidates:
+                print("// %.3f %.3f" % candidate)
+            print()
+            bpm = candidates[0][0]
+        else:
+            bpm = float(args.bpm)
+
+        start_beat = args.start_beat if args.start_beat is not None else 0.0
+        beats = assign_beats(times, bpm, start_beat)
+    print_timing("BPMS THAT GO THROUGH THE GIVEN TIMES", interval_timing(beats, times))
 
     # Now, perform LSR on the given times and the closest
     # approximating beats.  That will give us an idea of whether or
     # not the changes in the first half are necessary.
-    sum_x = sum(beats)
-    sum_y = sum(times)
-    sum_xx = sum(x * x for x in beats)
-    sum_xy = sum(x * y for (x, y) in zip(beats, times))
-    N = len(beats)
-
-    A = (N * sum_xy - sum_x * sum_y) / (N * sum_xx - sum_x * sum_x)
-    B = (sum_y * sum_xx - sum_x * sum_xy) / (N * sum_xx - sum_x * sum_x)
-
-    print()
     print()
-    print("// OFFSET, BPM DETERMINED BY LSR")
-    print("#OFFSET:%.4f;" % -B)
-    print("#BPMS:0.000=%.4f;" % (60.0 / A))
+    print_timing("OFFSET, BPM DETERMINED BY LSR", constant_timing(beats, times))
 
     print()
     print("// Errors between the fixed BPM and the times given")
     print("actual / projected / error")
-    projected_times = [B + A * x for x in beats]
-    for x, y in zip(projected_times, times):
-        print("%.3f %.3f %.3f" % (y, x, x - y))
+    A, B = fitting.fit_line(beats, times)
+    errors = fitting.residuals(beats, times, A, B)
+    print("\n".join(["%.3f %.3f %.3f" % (y, y + e, e) for y, e in zip(times, errors)]))
+
+    # The same, but ignoring notes which are far off the line
+    print()
+    print_timing("OFFSET, BPM DETERMINED BY ROBUST LSR", constant_timing(beats, times, robust=True))
+
+    print()
+    title = "BPMS FOR RUNS WITH AN RMS ERROR UNDER %.3f" % args.tolerance
+    try:
+        print_timing(title, segmented_timing(beats, times, args.tolerance))
+    except ValueError as e:
+        print("// %s" % title)
+        print("// %s" % e)
+
+if __name__ == "__main__":
+    main()
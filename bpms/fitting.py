@@ -0,0 +1,166 @@
+"""
+Least squares fitting of note times against beats.
+
+A line times = A * beats + B is a constant BPM of 60 / A with an
+OFFSET of -B.  Besides the plain fit, there are two ways to fit while
+ignoring mis-tapped notes: robust_fit_line, which gradually weights
+down notes far from the line, and ransac_fit_line, which looks for the
+line most notes agree with.
+
+numpy is used if it is installed, which is much faster on long lists
+of times.  Everything works without it.
+"""
+
+# Copyright 2016-2020 by John Bauer
+# Distributed under the Apache License 2.0
+
+# TO THE EXTENT PERMITTED BY LAW, THE SOFTWARE IS PROVIDED "AS IS",
+# WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT
+# LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE, TITLE AND NON-INFRINGEMENT. IN NO EVENT SHALL
+# THE COPYRIGHT HOLDERS OR ANYONE DISTRIBUTING THE SOFTWARE BE LIABLE
+# FOR ANY DAMAGES OR OTHER LIABILITY, WHETHER IN CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE
+# OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import math
+import random
+from collections import namedtuple
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+ResidualStats = namedtuple("ResidualStats", "max_error rms_error mean_error")
+
+def weighted_sums(beats, times, weights=None):
+    """
+    Returns the sums of w, wx, wy, wxx and wxy for beats x and times y
+    """
+    if numpy is not None:
+        x = numpy.asarray(beats, dtype=float)
+        y = numpy.asarray(times, dtype=float)
+        w = numpy.ones(len(x)) if weights is None else numpy.asarray(weights, dtype=float)
+        wx = w * x
+        return (float(w.sum()), float(wx.sum()), float(w.dot(y)),
+                float(wx.dot(x)), float(wx.dot(y)))
+    if weights is None:
+        weights = [1.0] * len(beats)
+    sum_w = sum_x = sum_y = sum_xx = sum_xy = 0.0
+    for w, x, y in zip(weights, beats, times):
+        wx = w * x
+        sum_w += w
+        sum_x += wx
+        sum_y += w * y
+        sum_xx += wx * x
+        sum_xy += wx * y
+    return sum_w, sum_x, sum_y, sum_xx, sum_xy
+
+def fit_line(beats, times, weights=None):
+    """
+    Weighted least squares fit of times = A * beats + B.  Returns (A, B)
+
+    Raises ValueError if the (weighted) notes are all on one beat.
+    """
+    sum_w, sum_x, sum_y, sum_xx, sum_xy = weighted_sums(beats, times, weights)
+    denominator = sum_w * sum_xx - sum_x * sum_x
+    if sum_w <= 0 or abs(denominator) <= 1e-12 * sum_w * sum_w:
+        raise ValueError("Cannot fit a line to notes which are all on one beat")
+    A = (sum_w * sum_xy - sum_x * sum_y) / denominator
+    B = (sum_y - A * sum_x) / sum_w
+    return A, B
+
+def residuals(beats, times, A, B):
+    """
+    Projected minus actual time of each note.  A numpy array if numpy
+    is installed, otherwise a list.
+    """
+    if numpy is not None:
+        return A * numpy.asarray(beats, dtype=float) + B - numpy.asarray(times, dtype=float)
+    return [A * x + B - y for x, y in zip(beats, times)]
+
+def residual_stats(errors):
+    """
+    Largest absolute error, RMS error and mean error of a list of residuals
+    """
+    if len(errors) == 0:
+        raise ValueError("No residuals")
+    if numpy is not None:
+        errors = numpy.asarray(errors, dtype=float)
+        return ResidualStats(float(abs(errors).max()),
+                             float(math.sqrt(errors.dot(errors) / len(errors))),
+                             float(errors.mean()))
+    return ResidualStats(max(abs(x) for x in errors),
+                         math.sqrt(sum(x * x for x in errors) / len(errors)),
+                         sum(errors) / len(errors))
+
+def bisquare_weights(errors, threshold):
+    """
+    Tukey's biweight: 1 for a perfect fit, falling to 0 at threshold
+    """
+    if numpy is not None:
+        scaled = numpy.asarray(errors, dtype=float) / threshold
+        return numpy.where(abs(scaled) < 1, (1 - scaled * scaled) ** 2, 0.0)
+    return [(1 - (x / threshold) ** 2) ** 2 if abs(x) < threshold else 0.0
+            for x in errors]
+
+def robust_fit_line(beats, times, threshold=0.03, iterations=20, tolerance=1e-9):
+    """
+    Iteratively reweighted least squares.
+
+    Starts from the plain fit, then refits with each note weighted by
+    how far it is from the current line.  Notes more than threshold
+    seconds off get no weight at all, so a few mis-taps don't pull
+    the line towards them.
+
+    Returns (A, B, weights)
+    """
+    A, B = fit_line(beats, times)
+    weights = None
+    for iteration in range(iterations):
+        weights = bisquare_weights(residuals(beats, times, A, B), threshold)
+        try:
+            new_A, new_B = fit_line(beats, times, weights)
+        except ValueError:
+            # everything got weighted out.  the last line is the best we have
+            break
+        converged = abs(new_A - A) < tolerance and abs(new_B - B) < tolerance
+        A, B = new_A, new_B
+        if converged:
+            break
+    return A, B, weights
+
+def ransac_fit_line(beats, times, threshold=0.02, iterations=200, seed=None):
+    """
+    Fits lines through random pairs of notes and keeps the one with the
+    most notes within threshold seconds of it.  Those notes are then
+    refit with least squares.
+
+    Returns (A, B, inliers), where inliers is a list of bools.
+    """
+    if len(beats) < 2:
+        raise ValueError("Need at least two notes to fit a line")
+    rng = random.Random(seed)
+    best = None
+    for iteration in range(iterations):
+        i, j = rng.sample(range(len(beats)), 2)
+        if beats[i] == beats[j]:
+            continue
+        A = (times[j] - times[i]) / (beats[j] - beats[i])
+        B = times[i] - A * beats[i]
+        count = sum(1 for x in residuals(beats, times, A, B) if abs(x) <= threshold)
+        if best is None or count > best[0]:
+            best = (count, A, B)
+    if best is None:
+        return fit_line(beats, times) + ([True] * len(beats),)
+
+    count, A, B = best
+    inliers = [abs(x) <= threshold for x in residuals(beats, times, A, B)]
+    inlier_beats = [x for x, keep in zip(beats, inliers) if keep]
+    inlier_times = [x for x, keep in zip(times, inliers) if keep]
+    try:
+        A, B = fit_line(inlier_beats, inlier_times)
+    except ValueError:
+        pass
+    return A, B, inliers
@@ -0,0 +1,396 @@
+"""
+Keeps a searchable index of the simfiles in a directory, such as the
+packs downloaded and extracted by scrape_category.
+
+Only the header of each simfile is read: the title, artist, offset,
+bpms, stops, and the mode, difficulty and meter of each chart.  The
+note rows are skipped as the file is read, so they are never collected
+into strings.  Files are read in a pool of processes.
+
+The index is an sqlite database.  Each file is stored with its mtime
+and size, and only files which were added or changed since the last
+run are read again.  Files which are gone are removed.
+
+To run:
+
+python index_simfiles.py --input_dir packs --index packs.db --jobs 4
+
+updates the index and prints a summary.  Search it with, for example,
+
+python index_simfiles.py --index packs.db --bpm_changes --min_meter 10
+"""
+
+# Copyright 2016-2020 by John Bauer
+# Distributed under the Apache License 2.0
+
+# TO THE EXTENT PERMITTED BY LAW, THE SOFTWARE IS PROVIDED "AS IS",
+# WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT
+# LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE, TITLE AND NON-INFRINGEMENT. IN NO EVENT SHALL
+# THE COPYRIGHT HOLDERS OR ANYONE DISTRIBUTING THE SOFTWARE BE LIABLE
+# FOR ANY DAMAGES OR OTHER LIABILITY, WHETHER IN CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE
+# OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import argparse
+import io
+import os
+import re
+import sqlite3
+from collections import namedtuple
+from timeit import default_timer
+
+import remap_bpm
+
+try:
+    from concurrent.futures import ProcessPoolExecutor
+except ImportError:
+    # python 2 without the futures backport.  --jobs does nothing
+    ProcessPoolExecutor = None
+
+SIMFILE_EXTENSIONS = (".sm", ".ssc")
+
+# In an .sm file, the mode, description, difficulty, meter and radar
+# values come before the rows of each #NOTES.  An .ssc chart has its
+# own tags for those instead.
+SM_CHART_FIELDS = 5
+NOTES_KEY = re.compile("#NOTES2?:", re.IGNORECASE)
+
+# bump when the tables change.  an index with another version is rebuilt
+SCHEMA_VERSION = 1
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS songs (path TEXT PRIMARY KEY,
+                                  mtime REAL,
+                                  size INTEGER,
+                                  title TEXT,
+                                  artist TEXT,
+                                  offset REAL,
+                                  bpms TEXT,
+                                  min_bpm REAL,
+                                  max_bpm REAL,
+                                  bpm_changes INTEGER,
+                                  stops INTEGER,
+                                  error TEXT);
+CREATE TABLE IF NOT EXISTS charts (path TEXT,
+                                   position INTEGER,
+                                   mode TEXT,
+                                   difficulty TEXT,
+                                   meter INTEGER,
+                                   description TEXT);
+CREATE INDEX IF NOT EXISTS charts_path ON charts (path);
+CREATE INDEX IF NOT EXISTS charts_meter ON charts (meter);
+CREATE INDEX IF NOT EXISTS songs_bpm_changes ON songs (bpm_changes);
+"""
+
+SongHeader = namedtuple("SongHeader", "title artist offset bpms min_bpm max_bpm bpm_changes stops charts")
+ChartHeader = namedtuple("ChartHeader", "mode difficulty meter description")
+# what one file of the walk turned into.  header is None if error is set
+IndexEntry = namedtuple("IndexEntry", "path mtime size header error")
+IndexResult = namedtuple("IndexResult", "added updated unchanged removed errors seconds")
+
+def skip_note_rows(lines, fields):
+    """
+    Passes the lines of a simfile through to iter_simfile, leaving out
+    the rows of each #NOTES.
+
+    fields is how many colon separated fields of a #NOTES come before
+    the rows: SM_CHART_FIELDS for .sm, 0 for .ssc.  Those fields are
+    kept, so an .sm chart still has its meter, with empty note data.
+    """
+    in_value = False
+    # colons left before the rows of the current #NOTES, None outside one
+    colons = None
+    lines = iter(lines)
+    for line in lines:
+        if colons == 0:
+            # in the rows, which are most of the file.  only look at
+            # lines which could end them
+            while ";" not in line:
+                line = next(lines, None)
+                if line is None:
+                    return
+        comment = line.find("//")
+        if comment >= 0:
+            line = line[:comment]
+        kept = []
+        position = 0
+        while position < len(line):
+            if in_value:
+                end = line.find(";", position)
+                if end < 0:
+                    kept.append(line[position:])
+                    break
+                kept.append(line[position:end+1])
+                position = end + 1
+                in_value = False
+            elif colons is None:
+                start = line.find("#", position)
+                if start < 0:
+                    break
+                match = NOTES_KEY.match(line, start)
+                if match:
+                    colons = fields
+                    position = match.end()
+                else:
+                    in_value = True
+                    position = start + 1
+                kept.append(line[start:position])
+            else:
+                end = line.find(";", position)
+                colon = line.find(":", position) if colons > 0 else -1
+                if colon >= 0 and (end < 0 or colon < end):
+                    kept.append(line[position:colon+1])
+                    position = colon + 1
+                    colons = colons - 1
+                elif end < 0:
+                    if colons > 0:
+                        kept.append(line[position:])
+                    break
+                else:
+                    if colons > 0:
+                        kept.append(line[position:end])
+                    kept.append(";")
+                    position = end + 1
+                    colons = None
+        if kept or colons != 0:
+            yield "".join(kept)
+
+def bpm_changes(bpms):
+    """
+    How many times the BPM changes to a different value
+    """
+    return sum(1 for x, y in zip(bpms, bpms[1:]) if x[1] != y[1])
+
+def parse_meter(meter):
+    try:
+        return int(meter)
+    except ValueError:
+        return None
+
+def read_header(filename):
+    """
+    Reads a SongHeader from an .sm or .ssc file without collecting its notes
+    """
+    ssc = filename.lower().endswith(".ssc")
+    with io.open(filename, encoding="utf-8", errors="replace") as fin:
+        lines = skip_note_rows(fin, 0 if ssc else SM_CHART_FIELDS)
+        simfile = remap_bpm.Simfile(list(remap_bpm.iter_simfile(lines)))
+
+    charts = []
+    if ssc:
+        header, chart_pairs = remap_bpm.ssc_charts(simfile.pairs)
+        for pairs in chart_pairs:
+            tags = dict((key.lower(), value.strip()) for key, value in pairs)
+            charts.append(ChartHeader(tags.get("stepstype", ""),
+                                      tags.get("difficulty", ""),
+                                      parse_meter(tags.get("meter", "")),
+                                      tags.get("description", "")))
+    else:
+        for chart in simfile.charts():
+            charts.append(ChartHeader(chart.mode, chart.difficulty,
+                                      parse_meter(chart.meter), chart.description))
+
+    bpm_values = [x[1] for x in simfile.bpms]
+    return SongHeader(simfile.get("title", "", header_only=True),
+                      simfile.get("artist", "", header_only=True),
+                      simfile.offset,
+                      "".join(simfile.get("bpms", header_only=True).split()),
+                      min(bpm_values), max(bpm_values),
+                      bpm_changes(simfile.bpms),
+                      len(simfile.stops),
+                      charts)
+
+def walk_simfiles(input_dir):
+    """
+    Yields (path, filename, mtime, size) for every simfile under
+    input_dir.  path is relative to input_dir and uses /, as in
+    remap_bpm.find_simfiles.
+    """
+    for root, dirs, files in os.walk(input_dir):
+        dirs.sort()
+        for name in sorted(files):
+            if not name.lower().endswith(SIMFILE_EXTENSIONS):
+                continue
+            filename = os.path.join(root, name)
+            stat = os.stat(filename)
+            path = os.path.relpath(filename, input_dir).replace(os.sep, "/")
+            yield path, filename, stat.st_mtime, stat.st_size
+
+def _read_index_entry(task):
+    """
+    Reads the header of one file.  Errors are returned rather than
+    raised so that one broken simfile doesn't stop the rest.
+    """
+    path, filename, mtime, size = task
+    try:
+        return IndexEntry(path, mtime, size, read_header(filename), None)
+    except (IOError, OSError, RuntimeError, ValueError) as e:
+        return IndexEntry(path, mtime, size, None, "%s: %s" % (type(e).__name__, e))
+
+def open_index(filename):
+    """
+    Opens the index, creating the tables if needed.  An index written
+    with a different SCHEMA_VERSION is emptied first.
+    """
+    connection = sqlite3.connect(filename)
+    version = connection.execute("PRAGMA user_version").fetchone()[0]
+    if version != SCHEMA_VERSION:
+        connection.execute("DROP TABLE IF EXISTS songs")
+        connection.execute("DROP TABLE IF EXISTS charts")
+        connection.execute("PRAGMA user_version = %d" % SCHEMA_VERSION)
+    connection.executescript(SCHEMA)
+    connection.commit()
+    return connection
+
+def store_entry(connection, entry):
+    connection.execute("DELETE FROM charts WHERE path = ?", (entry.path,))
+    header = entry.header
+    if header is None:
+        connection.execute("INSERT OR REPLACE INTO songs (path, mtime, size, error) "
+                           "VALUES (?, ?, ?, ?)",
+                           (entry.path, entry.mtime, entry.size, entry.error))
+        return
+    connection.execute("INSERT OR REPLACE INTO songs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, NULL)",
+                       (entry.path, entry.mtime, entry.size, header.title, header.artist,
+                        header.offset, header.bpms, header.min_bpm, header.max_bpm,
+                        header.bpm_changes, header.stops))
+    connection.executemany("INSERT INTO charts VALUES (?, ?, ?, ?, ?, ?)",
+                           [(entry.path, i) + tuple(chart) for i, chart in enumerate(header.charts)])
+
+def update_index(connection, input_dir, jobs=1):
+    """
+    Brings the index up to date with the simfiles under input_dir.
+
+    Files whose mtime and size match the index are skipped.  The rest
+    are read in a pool of jobs processes.  Returns an IndexResult with
+    the number of files in each state.
+    """
+    start = default_timer()
+    known = dict((path, (mtime, size)) for path, mtime, size in
+                 connection.execute("SELECT path, mtime, size FROM songs"))
+    tasks = []
+    unchanged = 0
+    added = 0
+    seen = set()
+    for task in walk_simfiles(input_dir):
+        path, filename, mtime, size = task
+        seen.add(path)
+        if known.get(path) == (mtime, size):
+            unchanged = unchanged + 1
+            continue
+        if path not in known:
+            added = added + 1
+        tasks.append(task)
+
+    if jobs > 1 and len(tasks) > 1 and ProcessPoolExecutor is not None:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            entries = list(executor.map(_read_index_entry, tasks, chunksize=16))
+    else:
+        entries = [_read_index_entry(task) for task in tasks]
+
+    removed = [path for path in known if path not in seen]
+    with connection:
+        for entry in entries:
+            store_entry(connection, entry)
+        for path in removed:
+            connection.execute("DELETE FROM songs WHERE path = ?", (path,))
+            connection.execute("DELETE FROM charts WHERE path = ?", (path,))
+    errors = sum(1 for x in entries if x.error)
+    return IndexResult(added, len(tasks) - added, unchanged, len(removed), errors,
+                       default_timer() - start)
+
+def find_songs(connection, bpm_changes=False, stops=False, min_bpm=None, max_bpm=None,
+               min_meter=None, max_meter=None, mode=None, text=None):
+    """
+    Returns the songs in the index which match all of the given
+    conditions, as (path, title, artist, bpms) sorted by path.
+
+    The song's BPM must stay between min_bpm and max_bpm.  The meter
+    and mode conditions must be met by the same chart.
+    text is searched for in the title and the artist.
+    """
+    conditions = ["error IS NULL"]
+    values = []
+    if bpm_changes:
+        conditions.append("bpm_changes > 0")
+    if stops:
+        conditions.append("stops > 0")
+    if min_bpm is not None:
+        conditions.append("min_bpm >= ?")
+        values.append(min_bpm)
+    if max_bpm is not None:
+        conditions.append("max_bpm <= ?")
+        values.append(max_bpm)
+    if text:
+        conditions.append("(title LIKE ? OR artist LIKE ?)")
+        values.extend(["%" + text + "%"] * 2)
+
+    chart_conditions = []
+    if min_meter is not None:
+        chart_conditions.append("meter >= ?")
+        values.append(min_meter)
+    if max_meter is not None:
+        chart_conditions.append("meter <= ?")
+        values.append(max_meter)
+    if mode:
+        chart_conditions.append("mode = ?")
+        values.append(mode)
+    if chart_conditions:
+        conditions.append("path IN (SELECT path FROM charts WHERE %s)" %
+                          " AND ".join(chart_conditions))
+
+    query = ("SELECT path, title, artist, bpms FROM songs WHERE %s ORDER BY path" %
+             " AND ".join(conditions))
+    return connection.execute(query, values).fetchall()
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Index the simfiles in a directory')
+    parser.add_argument('--index', required=True,
+                        help="sqlite file to keep the index in")
+    parser.add_argument('--input_dir', default=None,
+                        help="Bring the index up to date with the simfiles in this directory")
+    parser.add_argument('--jobs', type=int, default=1,
+                        help="Read the simfiles in this many processes at once")
+    parser.add_argument('--errors', default=False, action='store_true',
+                        help="List the files which couldn't be read")
+    parser.add_argument('--bpm_changes', default=False, action='store_true',
+                        help="Find songs where the BPM changes")
+    parser.add_argument('--stops', default=False, action='store_true',
+                        help="Find songs with stops")
+    parser.add_argument('--min_bpm', type=float, default=None,
+                        help="Find songs which never go below this BPM")
+    parser.add_argument('--max_bpm', type=float, default=None,
+                        help="Find songs which never go above this BPM")
+    parser.add_argument('--min_meter', type=int, default=None,
+                        help="Find songs with a chart of at least this meter")
+    parser.add_argument('--max_meter', type=int, default=None,
+                        help="Find songs with a chart of at most this meter")
+    parser.add_argument('--mode', default=None,
+                        help="Find songs with a chart of this mode, such as dance-single")
+    parser.add_argument('--text', default=None,
+                        help="Find songs with this in the title or artist")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    connection = open_index(args.index)
+    if args.input_dir:
+        result = update_index(connection, args.input_dir, args.jobs)
+        print("Indexed %s in %.2fs: %d added, %d updated, %d unchanged, %d removed, %d errors" %
+              (args.input_dir, result.seconds, result.added, result.updated,
+               result.unchanged, result.removed, result.errors))
+    if args.errors:
+        for path, error in connection.execute("SELECT path, error FROM songs "
+                                              "WHERE error IS NOT NULL ORDER BY path"):
+            print("%s: %s" % (path, error))
+    searching = (args.bpm_changes or args.stops or args.mode or args.text or
+                 any(x is not None for x in (args.min_bpm, args.max_bpm,
+                                             args.min_meter, args.max_meter)))
+    if searching or not (args.input_dir or args.errors):
+        start = default_timer()
+        songs = find_songs(connection, args.bpm_changes, args.stops, args.min_bpm, args.max_bpm,
+                           args.min_meter, args.max_meter, args.mode, args.text)
+        for path, title, artist, bpms in songs:
+            print("%s  %s - %s  [%s]" % (path, title, artist, bpms))
+        print("%d songs (%.1f ms)" % (len(songs), (default_timer() - start) * 1000))
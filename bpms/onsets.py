@@ -0,0 +1,298 @@
+"""
+Finds the times of notes in a song's audio, for bpms.py.
+
+The audio is read a block at a time, so a long song doesn't have to
+fit in memory.  Each block is cut into overlapping frames and the
+spectrum of every frame is computed at once with numpy.  The onset
+envelope is the spectral flux: how much louder each frequency got
+since the previous frame, summed over all frequencies.  Peaks in the
+envelope are the onsets.
+
+find_offset lines up a simfile's notes with the audio by cross
+correlating them, which gives the OFFSET that syncs the simfile.
+
+Only .wav files can be read for now.  numpy is required.
+
+To run:
+
+python onsets.py song.wav
+
+which prints one onset time per line, ready for bpms.py, or
+
+python onsets.py song.wav --simfile song.sm [--itg]
+
+which prints the OFFSET which syncs song.sm to song.wav.
+"""
+
+# Copyright 2016-2020 by John Bauer
+# Distributed under the Apache License 2.0
+
+# TO THE EXTENT PERMITTED BY LAW, THE SOFTWARE IS PROVIDED "AS IS",
+# WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT
+# LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE, TITLE AND NON-INFRINGEMENT. IN NO EVENT SHALL
+# THE COPYRIGHT HOLDERS OR ANYONE DISTRIBUTING THE SOFTWARE BE LIABLE
+# FOR ANY DAMAGES OR OTHER LIABILITY, WHETHER IN CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE
+# OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import argparse
+import contextlib
+import wave
+from collections import namedtuple
+
+import remap_bpm
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# values[i] is the spectral flux for an onset at start + i / rate seconds
+OnsetEnvelope = namedtuple("OnsetEnvelope", "values rate start")
+
+AUDIO_EXTENSIONS = (".wav",)
+
+# Packs synced for In The Groove cabinets have an #OFFSET this much
+# larger than a null sync, to make up for the cabinets' lag
+ITG_BIAS = 0.009
+
+def require_numpy():
+    if numpy is None:
+        raise ImportError("Finding onsets in audio needs numpy.  Try pip install numpy")
+
+def is_audio(filename):
+    return filename.lower().endswith(AUDIO_EXTENSIONS)
+
+def pcm_to_mono(data, channels, sample_width):
+    """
+    Converts raw little endian PCM to mono floats from -1 to 1
+    """
+    if sample_width == 1:
+        # 8 bit wav is unsigned
+        samples = numpy.frombuffer(data, dtype=numpy.uint8).astype(numpy.float32) - 128
+        scale = 128.0
+    elif sample_width == 2:
+        samples = numpy.frombuffer(data, dtype='<i2').astype(numpy.float32)
+        scale = 32768.0
+    elif sample_width == 3:
+        raw = numpy.frombuffer(data, dtype=numpy.uint8).reshape(-1, 3).astype(numpy.int32)
+        samples = (raw[:, 0] | (raw[:, 1] << 8) | (raw[:, 2] << 16))
+        samples = numpy.where(samples >= 1 << 23, samples - (1 << 24), samples).astype(numpy.float32)
+        scale = float(1 << 23)
+    elif sample_width == 4:
+        samples = numpy.frombuffer(data, dtype='<i4').astype(numpy.float32)
+        scale = float(1 << 31)
+    else:
+        raise ValueError("Unsupported sample width %d" % sample_width)
+    return samples.reshape(-1, channels).mean(axis=1) / scale
+
+def read_wav_blocks(filename, block_seconds=10.0):
+    """
+    Yields the sample rate, then blocks of about block_seconds of mono
+    samples as numpy arrays.
+    """
+    require_numpy()
+    with contextlib.closing(wave.open(filename, "rb")) as wav:
+        channels = wav.getnchannels()
+        sample_width = wav.getsampwidth()
+        rate = wav.getframerate()
+        yield rate
+        block_frames = max(1, int(block_seconds * rate))
+        while True:
+            data = wav.readframes(block_frames)
+            if not data:
+                break
+            yield pcm_to_mono(data, channels, sample_width)
+
+def frame_view(samples, frame_size, hop):
+    """
+    The overlapping frames of samples as rows of a 2d array, without copying
+    """
+    num_frames = (len(samples) - frame_size) // hop + 1
+    stride = samples.strides[0]
+    return numpy.lib.stride_tricks.as_strided(samples, shape=(num_frames, frame_size),
+                                              strides=(hop * stride, stride),
+                                              writeable=False)
+
+def spectral_flux(blocks, rate, frame_size=2048, hop=512, compression=100.0):
+    """
+    Computes the onset envelope of a stream of sample blocks.
+
+    Only the samples which didn't fill a frame and the last frame's
+    spectrum are kept from one block to the next, so the memory used
+    depends on the block size, not the length of the song.
+
+    Magnitudes are log compressed so quiet notes count as well as
+    loud ones.
+    """
+    window = numpy.hanning(frame_size).astype(numpy.float32)
+    leftover = numpy.zeros(0, dtype=numpy.float32)
+    previous = None
+    flux = []
+    for block in blocks:
+        samples = numpy.concatenate((leftover, block))
+        if len(samples) < frame_size:
+            leftover = samples
+            continue
+        frames = frame_view(samples, frame_size, hop)
+        spectrum = numpy.log1p(compression * numpy.abs(numpy.fft.rfft(frames * window, axis=1)))
+        if previous is None:
+            previous = spectrum[:1]
+        increase = numpy.diff(numpy.concatenate((previous, spectrum)), axis=0)
+        flux.append(numpy.maximum(increase, 0).sum(axis=1))
+        previous = spectrum[-1:]
+        leftover = samples[len(frames) * hop:]
+    values = numpy.concatenate(flux) if flux else numpy.zeros(0)
+    # The window rises fastest 3/4 of the way through the frame, so a
+    # sound starting there adds the most to a frame's flux.  Timing
+    # frames by their centers would put onsets early.
+    return OnsetEnvelope(values, float(rate) / hop, frame_size * 0.75 / rate)
+
+def onset_envelope(filename, frame_size=2048, hop=512, block_seconds=10.0):
+    """
+    The OnsetEnvelope of an audio file
+    """
+    if not is_audio(filename):
+        raise ValueError("Can only read %s files, not %s" % (", ".join(AUDIO_EXTENSIONS), filename))
+    blocks = read_wav_blocks(filename, block_seconds)
+    rate = next(blocks)
+    return spectral_flux(blocks, rate, frame_size, hop)
+
+def moving_average(values, width):
+    """
+    Average of the width values around each value.  Near the ends, only
+    the values which exist are averaged.
+    """
+    kernel = numpy.ones(width)
+    counts = numpy.convolve(numpy.ones(len(values)), kernel, mode="same")
+    return numpy.convolve(values, kernel, mode="same") / counts
+
+def pick_onsets(envelope, delta=0.1, window=0.1, min_gap=0.03):
+    """
+    Returns the times of the peaks in an OnsetEnvelope.
+
+    A frame is an onset if it is the largest within min_gap seconds
+    on either side, and more than delta above the average of the
+    envelope within window seconds.  The envelope is scaled so its
+    largest value is 1 first, so delta doesn't depend on volume.
+    """
+    require_numpy()
+    values = envelope.values
+    if len(values) == 0:
+        return numpy.zeros(0)
+    values = values / max(values.max(), 1e-12)
+
+    average = moving_average(values, max(1, int(2 * window * envelope.rate) + 1))
+    gap = max(1, int(min_gap * envelope.rate))
+    padded = numpy.concatenate((numpy.full(gap, -1.0), values, numpy.full(gap, -1.0)))
+    neighborhood = frame_view(padded, 2 * gap + 1, 1).max(axis=1)
+    peaks = numpy.nonzero((values >= neighborhood) & (values > average + delta))[0]
+    if len(peaks) > 1:
+        # a flat topped peak has several frames equal to the max
+        peaks = peaks[numpy.concatenate(([True], numpy.diff(peaks) > gap))]
+    return envelope.start + peaks / envelope.rate
+
+def audio_onsets(filename, delta=0.1, frame_size=2048, hop=512):
+    """
+    The onset times of an audio file, in seconds
+    """
+    return pick_onsets(onset_envelope(filename, frame_size, hop), delta)
+
+def impulse_train(times, envelope):
+    """
+    An array the length of the envelope's values with a 1 for each
+    time, split between the two nearest frames.
+    """
+    train = numpy.zeros(len(envelope.values))
+    positions = (numpy.asarray(times, dtype=float) - envelope.start) * envelope.rate
+    frames = numpy.floor(positions).astype(int)
+    fractions = positions - frames
+    for offset, weights in ((0, 1 - fractions), (1, fractions)):
+        index = frames + offset
+        inside = (index >= 0) & (index < len(train))
+        numpy.add.at(train, index[inside], weights[inside])
+    return train
+
+def find_shift(note_times, envelope, max_shift=1.0, peak_width=0.05):
+    """
+    Finds how much later the onsets in the audio are than note_times.
+
+    Every shift is tried at once by cross correlating the notes with
+    the envelope using FFTs, O(n log n) in the length of the song.
+
+    The confidence compares the best shift to the best one more than
+    peak_width seconds away from it: 0 if they are equally good, 1 if
+    nothing else lines up at all.
+
+    Returns (shift in seconds, confidence)
+    """
+    require_numpy()
+    values = envelope.values - envelope.values.mean()
+    train = impulse_train(note_times, envelope)
+    size = 1
+    while size < 2 * len(values):
+        size = size * 2
+    # correlation[k] is how well the notes match the envelope k frames later
+    correlation = numpy.fft.irfft(numpy.fft.rfft(values, size) *
+                                  numpy.conj(numpy.fft.rfft(train, size)), size)
+    max_lag = min(int(max_shift * envelope.rate), len(values) - 1)
+    lags = numpy.arange(-max_lag, max_lag + 1)
+    scores = correlation[lags % size]
+
+    best = int(numpy.argmax(scores))
+    lag = float(lags[best])
+    if 0 < best < len(scores) - 1:
+        # fit a parabola through the peak for a shift between frames
+        left, middle, right = scores[best - 1], scores[best], scores[best + 1]
+        curvature = left - 2 * middle + right
+        if curvature < 0:
+            lag = lag + 0.5 * (left - right) / curvature
+
+    width = max(1, int(peak_width * envelope.rate))
+    others = numpy.abs(lags - lags[best]) > width
+    if scores[best] <= 0:
+        confidence = 0.0
+    elif not others.any():
+        confidence = 1.0
+    else:
+        confidence = float(min(max(1 - max(scores[others].max(), 0) / scores[best], 0.0), 1.0))
+    return float(lag / envelope.rate), confidence
+
+def find_offset(simfile, filename, bias=0.0, max_shift=1.0):
+    """
+    Returns the OFFSET which lines the notes of a simfile up with the
+    audio in filename, and the confidence from find_shift.
+
+    bias is added to the OFFSET which syncs the notes exactly, such
+    as ITG_BIAS for the +9ms sync of ITG packs.
+    """
+    beats, times = remap_bpm.simfile_onsets(simfile)
+    shift, confidence = find_shift(times, onset_envelope(filename), max_shift)
+    # a larger offset makes the notes come earlier
+    return simfile.offset - shift + bias, confidence
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Find the times of notes in a song')
+    parser.add_argument('filename',
+                        help="Audio file of the song.  Only .wav is supported")
+    parser.add_argument('--delta', type=float, default=0.1,
+                        help="How far above the local average, from 0 to 1, a peak has to be to count")
+    parser.add_argument('--simfile', default=None,
+                        help="Find the OFFSET which syncs this simfile to the audio instead")
+    parser.add_argument('--itg', default=False, action='store_true',
+                        help="With --simfile, add %d ms to the OFFSET, as in the +9ms sync of ITG packs" % (ITG_BIAS * 1000))
+    parser.add_argument('--max_shift', type=float, default=1.0,
+                        help="With --simfile, the most in seconds the notes can be moved")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.simfile:
+        offset, confidence = find_offset(remap_bpm.read_simfile(args.simfile), args.filename,
+                                         ITG_BIAS if args.itg else 0.0, args.max_shift)
+        print("#OFFSET:%.4f;" % offset)
+        print("// confidence %.3f" % confidence)
+    else:
+        for time in audio_onsets(args.filename, args.delta):
+            print("%.4f" % time)
@@ -15,15 +15,27 @@ Remaps the song's BPM to a new BPM.
 
 This often has the side effect of removing a lot of gimmicks.
 
-Only works on .sm files for now.  Reading .ssc or .dwi is not supported.
+Only works on .sm files for now.  .ssc files can be read, including
+the timing of each chart, but not remapped.  .dwi is not supported.
 
 TODO: we could also reverse it and add gimmicks
 """
 
 import argparse
+import bisect
 import copy
-import math
+import hashlib
+import json
+import locale
+import os
 import re
+import shutil
+import sys
+import tempfile
+from array import array
+from collections import namedtuple, OrderedDict
+from fractions import Fraction
+from timeit import default_timer
 
 # 2/3 compatibility
 try:
@@ -31,6 +43,18 @@ try:
 except NameError:
     xrange = range
 
+try:
+    from concurrent.futures import ProcessPoolExecutor
+except ImportError:
+    # python 2 without the futures backport.  --jobs does nothing
+    ProcessPoolExecutor = None
+
+try:
+    replace_file = os.replace
+except AttributeError:
+    # python 2.  os.rename won't overwrite on Windows, but is atomic elsewhere
+    replace_file = os.rename
+
 def numbered_list(value, key_name):
     """
     Converts a numbered list of the form X1=Y1, X2=Y2, ...
@@ -50,29 +74,329 @@ def numbered_list(value, key_name):
         pairs.append(tuple(pieces))
     return pairs
 
+class TimingTable(object):
+    """
+    Precomputed timing for a set of OFFSET, BPMS and STOPS.
+
+    BPM changes are sorted and the time (not counting stops) at the
+    start of each BPM segment is computed once, along with a running
+    total of the stop lengths.  Converting a beat to a time is then a
+    bisect into each table instead of a walk over every BPM and stop.
+
+    As with StepMania, the first BPM is assumed to start at beat 0,
+    and a stop at a beat applies to notes after that beat but not to
+    notes on it.
+
+    For converting times back to beats, there is a second table of
+    segments sorted by the time they start.  Each segment either
+    moves at a fixed seconds per beat or, for a stop, stays on the
+    same beat.  That only makes sense if time always moves forward,
+    so negative BPMs and negative stops can be converted to times but
+    not back to beats.
+    """
+    def __init__(self, offset, bpms, stops):
+        self.offset = offset
+        bpms = sorted(bpms)
+        stops = sorted(stops)
+        # identifies this timing, for example in a ChartCache key
+        self.key = repr((offset, bpms, stops))
+
+        # first bpm covers everything from beat 0, no matter where
+        # the file says it starts
+        self.bpm_beats = [0.0] + [x[0] for x in bpms[1:]]
+        self.seconds_per_beat = [60.0 / x[1] for x in bpms]
+        self.bpm_times = [-offset]
+        for i in xrange(1, len(self.bpm_beats)):
+            length = self.bpm_beats[i] - self.bpm_beats[i-1]
+            self.bpm_times.append(self.bpm_times[-1] + length * self.seconds_per_beat[i-1])
+
+        self.stop_beats = [x[0] for x in stops]
+        # stop_totals[i] is the total length of the first i stops
+        self.stop_totals = [0.0]
+        for stop in stops:
+            self.stop_totals.append(self.stop_totals[-1] + stop[1])
+
+        self.monotonic = (all(x[1] > 0 for x in bpms) and
+                          all(x[1] >= 0 for x in stops))
+
+        # with one BPM and no stops, beats and times are a straight
+        # line, so remapping can be done exactly.  repr gives back
+        # the number as written in the simfile, such as 0.009
+        if len(bpms) == 1 and bpms[0][1] > 0 and all(x[1] == 0 for x in stops):
+            self.linear = (Fraction(repr(float(offset))), Fraction(repr(float(bpms[0][1]))))
+        else:
+            self.linear = None
+        self._build_segments()
+
+    def _build_segments(self):
+        """
+        Builds the time sorted table used by beat() and beats()
+
+        A stop at beat B becomes a segment which stays at B for the
+        length of the stop, followed by a segment moving at whatever
+        BPM is in effect after B.
+        """
+        self.segment_times = [-self.offset]
+        self.segment_beats = [0.0]
+        self.segment_spb = [self.seconds_per_beat[0]]
+
+        breakpoints = sorted(set([x for x in self.bpm_beats[1:] if x > 0] +
+                                 [x for x in self.stop_beats if x >= 0]))
+        for beat in breakpoints:
+            time = self.time(beat)
+            stop_length = (self.stop_totals[bisect.bisect_right(self.stop_beats, beat)] -
+                           self.stop_totals[bisect.bisect_left(self.stop_beats, beat)])
+            if stop_length != 0.0:
+                self.segment_times.append(time)
+                self.segment_beats.append(beat)
+                self.segment_spb.append(0.0)
+            bpm_idx = bisect.bisect_right(self.bpm_beats, beat) - 1
+            self.segment_times.append(time + stop_length)
+            self.segment_beats.append(beat)
+            self.segment_spb.append(self.seconds_per_beat[bpm_idx])
+
+    def _check_monotonic(self):
+        if not self.monotonic:
+            raise RuntimeError("Cannot convert times to beats when there are negative BPMs or STOPS")
+
+    def _segment_beat(self, segment, time):
+        spb = self.segment_spb[segment]
+        if spb == 0.0:
+            return self.segment_beats[segment]
+        return self.segment_beats[segment] + (time - self.segment_times[segment]) / spb
+
+    def beat(self, time):
+        """
+        Converts a time to a beat.
+
+        A time during a stop converts to the beat of the stop.
+        """
+        self._check_monotonic()
+        if time <= -self.offset:
+            return (time + self.offset) / self.seconds_per_beat[0]
+        segment = bisect.bisect_right(self.segment_times, time) - 1
+        return self._segment_beat(segment, time)
+
+    def beats(self, times):
+        """
+        Converts a whole sequence of times to beats in one call.
+
+        Works the same way as times(), with one sorted sweep over the
+        segment table.  Returns an array of beats in the same order as
+        the times.
+        """
+        self._check_monotonic()
+        times = times if isinstance(times, (list, array)) else list(times)
+        results = array('d', [0.0]) * len(times)
+        order = sorted(xrange(len(times)), key=times.__getitem__)
+        segment = 0
+        num_segments = len(self.segment_times)
+        for idx in order:
+            time = times[idx]
+            if time <= -self.offset:
+                results[idx] = (time + self.offset) / self.seconds_per_beat[0]
+                continue
+            while segment + 1 < num_segments and self.segment_times[segment + 1] <= time:
+                segment = segment + 1
+            results[idx] = self._segment_beat(segment, time)
+        return results
+
+    def time(self, beat):
+        """
+        Converts a beat to a time.
+        """
+        if beat <= 0:
+            return -self.offset + beat * self.seconds_per_beat[0]
+        segment = bisect.bisect_right(self.bpm_beats, beat) - 1
+        time = (self.bpm_times[segment] +
+                (beat - self.bpm_beats[segment]) * self.seconds_per_beat[segment])
+        # stops strictly before this beat
+        return time + self.stop_totals[bisect.bisect_left(self.stop_beats, beat)]
+
+    def times(self, beats):
+        """
+        Converts a whole sequence of beats to times in one call.
+
+        The beats are visited in sorted order so the BPM and stop
+        tables are each walked once, rather than searched per beat.
+        Returns an array of times in the same order as the beats.
+        """
+        beats = beats if isinstance(beats, (list, array)) else list(beats)
+        results = array('d', [0.0]) * len(beats)
+        order = sorted(xrange(len(beats)), key=beats.__getitem__)
+        segment = 0
+        num_segments = len(self.bpm_beats)
+        stop_idx = 0
+        num_stops = len(self.stop_beats)
+        for idx in order:
+            beat = beats[idx]
+            if beat <= 0:
+                results[idx] = -self.offset + beat * self.seconds_per_beat[0]
+                continue
+            while segment + 1 < num_segments and self.bpm_beats[segment + 1] <= beat:
+                segment = segment + 1
+            while stop_idx < num_stops and self.stop_beats[stop_idx] < beat:
+                stop_idx = stop_idx + 1
+            results[idx] = (self.bpm_times[segment] +
+                            (beat - self.bpm_beats[segment]) * self.seconds_per_beat[segment] +
+                            self.stop_totals[stop_idx])
+        return results
+
+
+class Chart(object):
+    """
+    One #NOTES chart of an .sm file.
+
+    Only the text is kept until the chart is used.  The header fields
+    (mode, difficulty, etc) are split out the first time one of them
+    is needed, and the measures are only read into arrays when the
+    notes are asked for.
+    """
+    def __init__(self, text):
+        self.text = text
+        self._pieces = None
+        self._ticks = None
+        self._notes = None
+
+    @property
+    def pieces(self):
+        """
+        The six colon separated fields of the chart, stripped
+        """
+        if self._pieces is None:
+            self._pieces = [x.strip() for x in self.text.split(":")]
+            if len(self._pieces) < 6:
+                raise RuntimeError("Chart has %d fields instead of 6" % len(self._pieces))
+        return self._pieces
+
+    @property
+    def mode(self):
+        return self.pieces[0]
+
+    @property
+    def description(self):
+        return self.pieces[1]
+
+    @property
+    def difficulty(self):
+        return self.pieces[2]
+
+    @property
+    def meter(self):
+        return self.pieces[3]
+
+    @property
+    def ticks(self):
+        """
+        The ticks, packed rows and width of the chart, as returned by chart_ticks
+        """
+        if self._ticks is None:
+            self._ticks = chart_ticks(self.pieces[5])
+        return self._ticks
+
+    @property
+    def notes(self):
+        """
+        The beats, packed rows and width of the chart, as returned by chart_notes
+        """
+        if self._notes is None:
+            ticks, rows, width = self.ticks
+            self._notes = (ticks_to_beats(ticks), rows, width)
+        return self._notes
+
+
 class Simfile(object):
     def __init__(self, pairs):
         """
         Keeps track of a list of key/value pairs for the simfile.
         Also keeps offset/stops/bpms separately to make processing easier.
+
+        The order of the pairs is kept, and tags can also be looked up
+        by name, ignoring case, with get() and indices().  Charts are
+        only parsed when asked for with chart().
         """
-        # TODO: make this an ordered dictionary
         self.pairs = pairs
+        # lowercase key -> positions of that key in pairs, in order
+        self.index = OrderedDict()
+        # position of the first #NOTEDATA, where the charts of an .ssc start
+        self.header_end = len(pairs)
+        for i, pair in enumerate(pairs):
+            key = pair[0].lower()
+            self.index.setdefault(key, []).append(i)
+            if key == "notedata" and self.header_end == len(pairs):
+                self.header_end = i
+        # position -> Chart for the charts which have been used
+        self._charts = {}
 
-        self.offset = 0.0
-        self.stops = []
-        self.bpms = None
-
-        for pair in pairs:
-            if pair[0].lower() == "offset":
-                self.offset = float(pair[1])
-            if pair[0].lower() == "bpms":
-                self.bpms = numbered_list(pair[1], "BPMS")
-            if pair[0].lower() == "stops":
-                self.stops = numbered_list(pair[1], "STOPS")
+        # the rest of an .ssc file after header_end is charts, which
+        # may have their own timing.  see chart_timing
+        offset = self.get("offset", header_only=True)
+        self.offset = float(offset) if offset is not None else 0.0
+        bpms = self.get("bpms", header_only=True)
+        self.bpms = numbered_list(bpms, "BPMS") if bpms is not None else None
+        stops = self.get("stops", header_only=True)
+        self.stops = numbered_list(stops, "STOPS") if stops is not None else []
 
         if not self.bpms:   # None or empty
             raise RuntimeError("Simfile doesn't have a BPM")
+        self.timing = TimingTable(self.offset, self.bpms, self.stops)
+
+    def indices(self, key):
+        """
+        Returns the positions in pairs of every pair with this key, ignoring case.
+        """
+        return self.index.get(key.lower(), [])
+
+    def get(self, key, default=None, header_only=False):
+        """
+        Returns the value of the last pair with this key, ignoring case.
+
+        If header_only is set, pairs in the charts of an .ssc file are
+        not considered.
+        """
+        positions = self.indices(key)
+        if header_only:
+            positions = [x for x in positions if x < self.header_end]
+        if not positions:
+            return default
+        return self.pairs[positions[-1]][1]
+
+    def replace(self, position, value, key=None):
+        """
+        Replaces the value of the pair at position, and optionally
+        renames its key.  The key must be the same tag, ignoring case.
+        """
+        old_key = self.pairs[position][0]
+        if key is None:
+            key = old_key
+        elif key.lower() != old_key.lower():
+            raise RuntimeError("Cannot replace %s with %s" % (old_key, key))
+        self.pairs[position] = (key, value)
+        self._charts.pop(position, None)
+
+    def set(self, key, value):
+        """
+        Replaces the value of every pair with this key.  Pairs which
+        are not already in the simfile are not added.
+        """
+        for position in self.indices(key):
+            self.replace(position, value, key)
+
+    def chart(self, position):
+        """
+        Returns the Chart for the #NOTES pair at position.
+        """
+        chart = self._charts.get(position)
+        if chart is None:
+            chart = Chart(self.pairs[position][1])
+            self._charts[position] = chart
+        return chart
+
+    def charts(self):
+        """
+        Returns the Chart for each #NOTES pair, in order.
+        """
+        return [self.chart(x) for x in self.indices("notes")]
 
     def update_bpms(self, offset, bpms, stops):
         """
@@ -81,248 +405,981 @@ class Simfile(object):
         """
         if offset is not None:
             self.offset = float(offset)
+            self.set("OFFSET", offset)
         if bpms is not None:
             self.bpms = numbered_list(bpms, "BPMS")
-            for i in xrange(len(self.pairs)):
-                if self.pairs[i][0].lower() == "bpms":
-                    self.pairs[i] = ("BPMS", bpms)
+            self.set("BPMS", bpms)
         self.stops = numbered_list(stops, "STOPS")
-        for i in xrange(len(self.pairs)):
-            if self.pairs[i][0].lower() == "stops":
-                self.pairs[i] = ("STOPS", stops)
-            elif offset is not None and self.pairs[i][0].lower() == "offset":
-                self.pairs[i] = ("OFFSET", offset)
+        self.set("STOPS", stops)
+        self.timing = TimingTable(self.offset, self.bpms, self.stops)
 
     def beat(self, time):
         """
         Converts a time to a beat
         """
-        if time == -self.offset:
-            return 0.0
-        if time < -self.offset:
-            return (time + self.offset) / (60. / self.bpms[0][1])
-        # has to be a positive beat at this point.
-        # need to account for bpm changes and stops
-        # TODO: account for changes & stops
-        for previous, current in zip(self.bpms[:-1], self.bpms[1:]):
-            raise RuntimeError("TODO")
-        if len(self.stops) > 0:
-            raise RuntimeError("TODO")
-        return (time + self.offset) / (60. / self.bpms[0][1])
+        return self.timing.beat(time)
+
+    def beats(self, times):
+        """
+        Converts a sequence of times to an array of beats.
+        """
+        return self.timing.beats(times)
 
     def time(self, beat):
         """
         Converts a beat to a time.
         """
-        if beat == 0:
-            return -self.offset
-        if beat < 0:
-            return -self.offset + beat * 60. / self.bpms[0][1]
-        if beat > 0:
-            time = -self.offset
-            current_beat = 0
-            # TODO: test bpm changes
-            for previous, current in zip(self.bpms[:-1], self.bpms[1:]):
-                if current[0] > beat:
-                    time = time + (beat - current_beat) * (60.0 / previous[1])
-                    current_beat = beat
-                    break
-                else:
-                    time = time + (current[0] - current_beat) * (60.0 / previous[1])
-                    current_beat = current[0]
-            # any leftover time comes from the last bpm
-            # (which may be the only bpm)
-            if current_beat < beat:
-                bpm = self.bpms[-1]
-                time = time + (beat - current_beat) * (60.0 / bpm[1])
-            # TODO: test stops
-            for stop in self.stops:
-                if stop[0] < beat:
-                    time = time + stop[1]
-            return time
-
-all_zeros = re.compile("^0+$")
+        return self.timing.time(beat)
+
+    def times(self, beats):
+        """
+        Converts a sequence of beats to an array of times.
+        """
+        return self.timing.times(beats)
+
 POSITIVE_FLOAT = re.compile("^[0-9]+([.][0-9]+)?$")
 
-def combine_steps(A, B, mode, chart, m_num, s_num):
-    if len(A) != len(B):
-        raise RuntimeError("Step of unexpected length: (%s %s %d %d)" % (mode, chart, m_num, s_num))
-    if all_zeros.match(A):
+# Rows of a chart are packed into ints, with PANEL_BITS bits for each
+# panel and the first panel in the lowest bits.  An empty row is 0,
+# so testing for an empty row is just a truth test.  The rows are only
+# turned back into text such as "0010" when writing the chart.
+NOTE_CHARS = "01234MLFK"
+NOTE_CODES = dict((x, i) for i, x in enumerate(NOTE_CHARS))
+NOTE_EMPTY = NOTE_CODES['0']
+NOTE_TAP = NOTE_CODES['1']
+NOTE_HOLD = NOTE_CODES['2']
+NOTE_TAIL = NOTE_CODES['3']
+NOTE_ROLL = NOTE_CODES['4']
+
+PANEL_BITS = 4
+PANEL_MASK = (1 << PANEL_BITS) - 1
+MAX_PANELS = 16
+# the lowest bit of each panel
+PANEL_LOW_BITS = int("1" * MAX_PANELS, 16)
+
+_encoded_rows = {}
+
+def encode_row(text):
+    """
+    Converts a row such as "0010" to its packed form.
+
+    Rows repeat a lot in a chart, so the results are memoized.
+    """
+    row = _encoded_rows.get(text)
+    if row is not None:
+        return row
+    if len(text) > MAX_PANELS:
+        raise RuntimeError("Rows of more than %d panels are not supported: %s" % (MAX_PANELS, text))
+    row = 0
+    for panel, note in enumerate(text):
+        code = NOTE_CODES.get(note)
+        if code is None:
+            raise RuntimeError("Unknown note %s in row %s" % (note, text))
+        row = row | (code << (panel * PANEL_BITS))
+    _encoded_rows[text] = row
+    return row
+
+def decode_row(row, width):
+    """
+    Converts a packed row back to text with the given number of panels.
+    """
+    return "".join(NOTE_CHARS[(row >> (panel * PANEL_BITS)) & PANEL_MASK]
+                   for panel in xrange(width))
+
+def row_note(row, panel):
+    return (row >> (panel * PANEL_BITS)) & PANEL_MASK
+
+def set_row_note(row, panel, code):
+    """
+    Returns the row with the given panel replaced by the note code.
+    """
+    shift = panel * PANEL_BITS
+    return (row & ~(PANEL_MASK << shift)) | (code << shift)
+
+def occupied_panels(row):
+    """
+    Returns the row with the lowest bit of each non-empty panel set.
+    """
+    row = row | (row >> 1)
+    row = row | (row >> 2)
+    return row & PANEL_LOW_BITS
+
+def combine_steps(A, B, width, mode, chart, m_num, s_num):
+    if not A:
         return B
-    if all_zeros.match(B):
+    if not B:
         return A
-    step = []
-    for i, j in zip(A, B):
-        if i == '0':
-            step.append(j)
-        elif j == '0':
-            step.append(i)
-        elif i == '2' and j == '3':
-            print("Warning: turned a very short hold into a tap at %s %s (%d %d)" % (mode, chart, m_num, s_num))
-            step.append('1')
-        else:
-            # TODO: If there is an end hold followed immediately but a
-            # start hold, we can separate them by the "snap"
-            # However, that might require a bit of a redoing
-            raise RuntimeError("Cannot combine steps %s %s of %s %s in (%d %d)" % (A, B, mode, chart, m_num, s_num))
-    step = "".join(step)
-    print("Warning: combined steps %s, %s of %s %s to get %s at (%d %d)" % (A, B, mode, chart, step, m_num, s_num))
+    if not occupied_panels(A) & occupied_panels(B):
+        step = A | B
+    else:
+        step = 0
+        for panel in xrange(width):
+            i = row_note(A, panel)
+            j = row_note(B, panel)
+            if i == NOTE_EMPTY or j == NOTE_EMPTY:
+                step = set_row_note(step, panel, i | j)
+            elif i == NOTE_HOLD and j == NOTE_TAIL:
+                print("Warning: turned a very short hold into a tap at %s %s (%d %d)" % (mode, chart, m_num, s_num))
+                step = set_row_note(step, panel, NOTE_TAP)
+            else:
+                # TODO: If there is an end hold followed immediately but a
+                # start hold, we can separate them by the "snap"
+                # However, that might require a bit of a redoing
+                raise RuntimeError("Cannot combine steps %s %s of %s %s in (%d %d)" % (decode_row(A, width), decode_row(B, width), mode, chart, m_num, s_num))
+    print("Warning: combined steps %s, %s of %s %s to get %s at (%d %d)" % (decode_row(A, width), decode_row(B, width), mode, chart, decode_row(step, width), m_num, s_num))
     return step
 
-def remove_small_holds_from_stepchart(new_measures, remove_small_holds, mode, chart):
+def remove_small_holds_from_stepchart(notes, snap, remove_small_holds, mode, chart):
+    """
+    Turns holds and rolls shorter than remove_small_holds beats into taps.
+
+    notes is a map from row number, counted in 1/snap of a measure
+    from the start of the chart, to the packed row at that position.
+
+    Makes a single pass over the rows, remembering where the open hold
+    on each panel started, so each row is looked at once no matter
+    how long the holds are.  The rows are edited in place.
+
+    A hold counts as short if the beats from its head to the end of
+    the row with its tail are no more than remove_small_holds.
+    """
     if remove_small_holds <= 0.0:
         return
-    for measure_idx, measure in enumerate(new_measures):
-        for beat_idx, beat in enumerate(measure):
-            for foot_idx, foot in enumerate(beat):
-                if foot != '2' and foot != '4':
-                    # holds are 2, rolls are 4
+    row_length = 4.0 / snap
+    # panel -> (row number, beat) for the head of each open hold
+    open_holds = {}
+    for row_num in sorted(notes.keys()):
+        row = notes[row_num]
+        beat = row_num * row_length
+        panels = occupied_panels(row)
+        while panels:
+            lowest = panels & -panels
+            panels = panels ^ lowest
+            foot_idx = (lowest.bit_length() - 1) // PANEL_BITS
+            foot = row_note(row, foot_idx)
+            if foot == NOTE_HOLD or foot == NOTE_ROLL:
+                open_holds[foot_idx] = (row_num, beat)
+            elif foot == NOTE_TAIL and foot_idx in open_holds:
+                head_row_num, head_beat = open_holds.pop(foot_idx)
+                if beat + row_length - head_beat > remove_small_holds:
                     continue
-                hold_length = 0
-                next_beat_idx = beat_idx
-                next_measure_idx = measure_idx
-                while next_measure_idx < len(new_measures):
-                    hold_length = hold_length + 4.0 / len(new_measures[next_measure_idx])
-                    if hold_length > remove_small_holds:
-                        # have eaten enough time that we no longer
-                        # consider this a small hold
-                        break
-                    if new_measures[next_measure_idx][next_beat_idx][foot_idx] == '3':
-                        # found the end, and the hold is shorter than the threshold
-                        print("Found a short hold in %s, %s.  Turning a hold at %d, %d, %d to a tap" %
-                              (mode, chart, measure_idx, beat_idx, foot_idx))
-                        new_step = new_measures[measure_idx][beat_idx]
-                        new_step = new_step[:foot_idx] + "1" + new_step[foot_idx+1:]
-                        new_measures[measure_idx][beat_idx] = new_step
-                        new_step = new_measures[next_measure_idx][next_beat_idx]
-                        new_step = new_step[:foot_idx] + "0" + new_step[foot_idx+1:]
-                        new_measures[next_measure_idx][next_beat_idx] = new_step
-                        break
-                    next_beat_idx = next_beat_idx + 1
-                    if next_beat_idx >= len(new_measures[next_measure_idx]):
-                        next_beat_idx = 0
-                        next_measure_idx = next_measure_idx + 1
+                measure_idx, beat_idx = divmod(head_row_num, snap)
+                print("Found a short hold in %s, %s.  Turning a hold at %d, %d, %d to a tap" %
+                      (mode, chart, measure_idx, beat_idx, foot_idx))
+                notes[head_row_num] = set_row_note(notes[head_row_num], foot_idx, NOTE_TAP)
+                row = set_row_note(row, foot_idx, NOTE_EMPTY)
+                notes[row_num] = row
 
 
-def fix_stepchart(old_simfile, new_simfile, old_chart, snap, remove_small_holds):
-    chart_pieces = [x.strip() for x in old_chart.split(":")]
-    measures = [x.strip() for x in chart_pieces[5].strip().split(",")]
-    interesting_steps = []
-    for m_num, measure in enumerate(measures):
-        steps = [x.strip() for x in measure.split("\n")]
+# Every row of every measure division StepMania writes lands on a
+# whole number of ticks.  This is the LCM of MEASURE_DIVISIONS
+TICKS_PER_MEASURE = 192
+TICKS_PER_BEAT = TICKS_PER_MEASURE // 4
+
+def chart_ticks(note_data):
+    """
+    Reads the measures of a chart into parallel arrays.
+
+    Returns the tick of each non-empty row, counted from the start of
+    the chart, an array of the packed rows themselves, both in chart
+    order, and the number of panels in each row.
+
+    Ticks are exact.  They are an array of ints unless the chart has a
+    measure with an unusual number of rows, such as 20, in which case
+    they are a list with Fractions for the rows between ticks.
+    """
+    ticks = array('q')
+    rows = array('Q')
+    width = None
+    for m_num, measure in enumerate(note_data.strip().split(",")):
+        steps = measure.strip().split("\n")
+        num_steps = len(steps)
         for s_num, step in enumerate(steps):
             step = step.strip()
-            if all_zeros.match(step):
+            row = encode_row(step)
+            if not row:
                 continue
-            old_beat = m_num * 4 + s_num * 4.0 / len(steps)
-            old_time = old_simfile.time(old_beat)
-            interesting_steps.append( (old_time, step) )
+            if width is None:
+                width = len(step)
+            elif len(step) != width:
+                raise RuntimeError("Step of unexpected length: %s in measure %d" % (step, m_num))
+            tick, remainder = divmod(s_num * TICKS_PER_MEASURE, num_steps)
+            if remainder:
+                if not isinstance(ticks, list):
+                    # only copied once, the first time a row is between ticks
+                    ticks = list(ticks)
+                tick = Fraction(s_num * TICKS_PER_MEASURE, num_steps)
+            ticks.append(m_num * TICKS_PER_MEASURE + tick)
+            rows.append(row)
+    return ticks, rows, width
+
+def ticks_to_beats(ticks):
+    return array('d', [float(tick) / TICKS_PER_BEAT for tick in ticks])
+
+def chart_notes(note_data):
+    """
+    The same as chart_ticks, but with the beat of each row as a float
+    """
+    ticks, rows, width = chart_ticks(note_data)
+    return ticks_to_beats(ticks), rows, width
+
+def snap_beats(beats, snap):
+    """
+    Rounds each beat to the nearest 1/snap of a measure.
+
+    Returns an array of row numbers counted from the start of the
+    chart, so row // snap is the measure and row % snap is the row
+    within that measure.
+    """
+    scale = snap / 4.0
+    return array('l', [int(round(beat * scale)) for beat in beats])
+
+def round_ratio(numerator, denominator):
+    """
+    numerator / denominator rounded to the nearest int, with ties
+    going to the even int as round() does.  denominator must be positive.
+    """
+    quotient, remainder = divmod(numerator, denominator)
+    if 2 * remainder > denominator or (2 * remainder == denominator and quotient % 2 == 1):
+        quotient = quotient + 1
+    return quotient
 
-    new_steps = [(new_simfile.beat(x[0]), x[1]) for x in interesting_steps]
-    new_steps = [(round(x[0] * snap / 4.0) * 4.0 / snap, x[1]) for x in new_steps]
+def linear_rows(ticks, old_timing, new_timing, snap):
+    """
+    If both timings have a single BPM and no stops, a tick maps to a
+    new row by a multiply and an add.  This does that in exact integer
+    arithmetic, so rows don't end up one off from float error.
 
-    if len(new_steps) == 0:
+    Returns an array of row numbers as in snap_beats, or None if
+    either timing changes tempo.
+    """
+    if old_timing.linear is None or new_timing.linear is None:
+        return None
+    old_offset, old_bpm = old_timing.linear
+    new_offset, new_bpm = new_timing.linear
+    # new beat = (old beat * 60 / old bpm - old offset + new offset) * new bpm / 60
+    # new row = new beat * snap / 4
+    row_scale = Fraction(new_bpm * snap, 4)
+    scale = row_scale / (old_bpm * TICKS_PER_BEAT)
+    shift = (new_offset - old_offset) * row_scale / 60
+    denominator = scale.denominator * shift.denominator
+    a = scale.numerator * shift.denominator
+    b = shift.numerator * scale.denominator
+
+    rows = array('l')
+    for tick in ticks:
+        if isinstance(tick, Fraction):
+            row = tick * scale + shift
+            rows.append(round_ratio(row.numerator, row.denominator))
+        else:
+            rows.append(round_ratio(tick * a + b, denominator))
+    return rows
+
+# Row counts StepMania understands for a measure, smallest first
+MEASURE_DIVISIONS = (4, 8, 12, 16, 24, 32, 48, 64, 192)
+
+def measure_division(positions, snap):
+    """
+    Returns the fewest rows a measure can have and still hold notes
+    at each of the given positions, which are in 1/snap of a measure.
+
+    If no standard division works, which can happen for an unusual
+    snap, the snap itself is used.
+    """
+    for division in MEASURE_DIVISIONS:
+        if all((pos * division) % snap == 0 for pos in positions):
+            return division
+    return snap
+
+def sparse_measures_text(notes, snap, width):
+    """
+    Writes out the occupied rows of a chart, given as a map from row
+    number to packed row, as the note data of an .sm chart.
+
+    Each measure uses the smallest division which fits its notes, and
+    empty measures are four blank rows.  A chart can't start before
+    beat 0, so notes on negative rows are a RuntimeError.
+    """
+    by_measure = {}
+    for row_num, row in notes.items():
+        if not row:
+            continue
+        m_num, pos = divmod(row_num, snap)
+        by_measure.setdefault(m_num, []).append((pos, row))
+    if not by_measure:
         raise RuntimeError("Empty steps")
+    if min(by_measure) < 0:
+        early = sorted(x for x in notes if x < 0 and notes[x])
+        raise RuntimeError("%d rows of notes would be before beat 0, the first at beat %.3f.  "
+                           "Does the new timing start after the first notes?" %
+                           (len(early), early[0] * 4.0 / snap))
+    blank = decode_row(0, width)
+    measure_text = []
+    for m_num in xrange(max(by_measure.keys()) + 1):
+        rows = by_measure.get(m_num, [])
+        division = measure_division([pos for pos, _ in rows], snap)
+        measure = [blank] * division
+        for pos, row in rows:
+            measure[pos * division // snap] = decode_row(row, width)
+        measure_text.append("\n".join(measure))
+    return "\n,\n".join(measure_text)
+
+def fix_stepchart(old_simfile, new_simfile, old_chart, snap, remove_small_holds):
+    """
+    Remaps one chart, given as a Chart or as the text of a #NOTES
+    value, from the old timing to the new timing.
 
-    blank = "0" * len(new_steps[0][1])
-    # TODO: check that all steps are the same length?
+    Only the timing of old_simfile and new_simfile is used, so their
+    TimingTables can be passed instead.
 
-    num_measures = int(math.floor(new_steps[-1][0] / 4.0) + 1)
-    new_measures = [[] for _ in xrange(num_measures)]
-    for measure in new_measures:
-        for i in xrange(snap):
-            measure.append(blank)
+    If neither timing changes tempo, rows are remapped exactly with
+    linear_rows.  Otherwise each row goes through its time in seconds
+    as a float and is snapped back to the nearest row.
 
-    # TODO: could simplify empty measures
+    Returns the text of the new chart.
+    """
+    if not isinstance(old_chart, Chart):
+        old_chart = Chart(old_chart)
+    chart_pieces = list(old_chart.pieces)
+    old_ticks, steps, width = old_chart.ticks
+    if len(steps) == 0:
+        raise RuntimeError("Empty steps")
 
-    for step in new_steps:
-        m_num = int(math.floor(step[0] / 4.0))
-        s_num = int(round((step[0] - m_num * 4.0) * snap / 4))
-        new_measures[m_num][s_num] = combine_steps(new_measures[m_num][s_num], step[1], chart_pieces[0], chart_pieces[2], m_num, s_num)
+    old_timing = getattr(old_simfile, "timing", old_simfile)
+    new_timing = getattr(new_simfile, "timing", new_simfile)
+    new_rows = linear_rows(old_ticks, old_timing, new_timing, snap)
+    if new_rows is None:
+        new_beats = new_timing.beats(old_timing.times(ticks_to_beats(old_ticks)))
+        new_rows = snap_beats(new_beats, snap)
 
-    remove_small_holds_from_stepchart(new_measures, remove_small_holds, chart_pieces[0], chart_pieces[2])
+    # only the rows with notes on them are kept
+    notes = {}
+    for row_num, step in zip(new_rows, steps):
+        current = notes.get(row_num)
+        if not current:
+            notes[row_num] = step
+        else:
+            # only notes which land on the same row need combining
+            m_num, s_num = divmod(row_num, snap)
+            notes[row_num] = combine_steps(current, step, width, chart_pieces[0], chart_pieces[2], m_num, s_num)
 
-    measure_text = ["\n".join(x) for x in new_measures]
-    chart_text = "\n,\n".join(measure_text)
-    chart_pieces[5] = chart_text
+    remove_small_holds_from_stepchart(notes, snap, remove_small_holds, chart_pieces[0], chart_pieces[2])
+
+    chart_pieces[5] = sparse_measures_text(notes, snap, width)
     return ":\n".join(chart_pieces)
-    
 
-def fix_notes(old_simfile, new_simfile, snap, remove_small_holds):
-    for i in xrange(len(new_simfile.pairs)):
-        if new_simfile.pairs[i][0].lower() == "notes":
-            new_chart = fix_stepchart(old_simfile, new_simfile, new_simfile.pairs[i][1],
-                                      snap, remove_small_holds)
-            new_simfile.pairs[i] = (new_simfile.pairs[i][0], new_chart)
 
-def read_simfile(filename):
-    pairs = []
-    lines = open(filename).readlines()
+# Arguments shared by every chart remapped in a worker process.  They
+# are sent once when the worker starts rather than with each chart.
+_chart_worker_args = None
+
+def _init_chart_worker(old_timing, new_timing, snap, remove_small_holds):
+    global _chart_worker_args
+    _chart_worker_args = (old_timing, new_timing, snap, remove_small_holds)
+
+def _fix_stepchart_in_worker(chart_text):
+    old_timing, new_timing, snap, remove_small_holds = _chart_worker_args
+    return fix_stepchart(old_timing, new_timing, chart_text, snap, remove_small_holds)
+
+class ChartCache(object):
+    """
+    A directory of remapped charts, so rerunning over a pack after
+    changing one song only remaps the charts that changed.
+
+    Each entry is keyed by a hash of everything that goes into
+    fix_stepchart: the chart text, the old and new timing, snap and
+    remove_small_holds.  Reading an entry touches its mtime, and
+    trim() deletes the least recently used entries past max_entries.
+
+    Several processes can share a directory.  An entry deleted by
+    another process's trim() is just a miss.
+    """
+    # change this if fix_stepchart starts giving different results,
+    # so that old entries are no longer used
+    VERSION = 2
+
+    def __init__(self, directory, max_entries=10000):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        if not os.path.exists(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                if not os.path.isdir(directory):
+                    raise
+
+    def key(self, chart_text, old_timing, new_timing, snap, remove_small_holds):
+        digest = hashlib.sha1()
+        digest.update(repr((self.VERSION, old_timing.key, new_timing.key,
+                            snap, remove_small_holds)).encode("utf-8"))
+        digest.update(b"\n")
+        digest.update(chart_text.encode("utf-8"))
+        return digest.hexdigest()
+
+    def filename(self, key):
+        return os.path.join(self.directory, key + ".chart")
+
+    def get(self, key):
+        """
+        Returns the cached chart text, or None if key isn't cached.
+        """
+        filename = self.filename(key)
+        try:
+            with open(filename, "rb") as fin:
+                chart_text = fin.read().decode("utf-8")
+            os.utime(filename, None)
+        except (IOError, OSError):
+            self.misses = self.misses + 1
+            return None
+        self.hits = self.hits + 1
+        return chart_text
+
+    def put(self, key, chart_text):
+        fd, temp_filename = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as fout:
+                fout.write(chart_text.encode("utf-8"))
+            replace_file(temp_filename, self.filename(key))
+        except:
+            try:
+                os.remove(temp_filename)
+            except OSError:
+                pass
+            raise
+
+    def trim(self):
+        """
+        Deletes the least recently used entries until there are at
+        most max_entries left.
+        """
+        entries = []
+        for filename in os.listdir(self.directory):
+            if not filename.endswith(".chart"):
+                continue
+            filename = os.path.join(self.directory, filename)
+            try:
+                entries.append((os.path.getmtime(filename), filename))
+            except OSError:
+                pass
+        if len(entries) <= self.max_entries:
+            return
+        entries.sort()
+        for mtime, filename in entries[:len(entries) - self.max_entries]:
+            try:
+                os.remove(filename)
+            except OSError:
+                pass
+
+    def summary(self):
+        return cache_summary(self.hits, self.misses)
+
+def cache_summary(hits, misses):
+    total = hits + misses
+    return ("Chart cache: %d hits, %d misses (%.0f%% hit rate)" %
+            (hits, misses, 100.0 * hits / total if total else 0.0))
+
+
+def fix_notes(old_simfile, new_simfile, snap, remove_small_holds, jobs=1, cache=None):
+    """
+    Remaps every #NOTES chart in new_simfile.
+
+    The charts don't depend on each other, so if jobs > 1 they are
+    remapped in a pool of that many processes.  The results are put
+    back in the original order, so the output is the same either way.
+
+    If a ChartCache is given, charts found in it aren't remapped
+    again, and the newly remapped charts are added to it.
+    """
+    indices = new_simfile.indices("notes")
+    new_charts = {}
+    keys = {}
+    if cache is not None:
+        for i in indices:
+            keys[i] = cache.key(new_simfile.pairs[i][1], old_simfile.timing,
+                                new_simfile.timing, snap, remove_small_holds)
+            new_chart = cache.get(keys[i])
+            if new_chart is not None:
+                new_charts[i] = new_chart
+    remaining = [i for i in indices if i not in new_charts]
+
+    if jobs > 1 and len(remaining) > 1 and ProcessPoolExecutor is not None:
+        chart_texts = [new_simfile.pairs[i][1] for i in remaining]
+        initargs = (old_simfile.timing, new_simfile.timing, snap, remove_small_holds)
+        with ProcessPoolExecutor(max_workers=min(jobs, len(remaining)),
+                                 initializer=_init_chart_worker,
+                                 initargs=initargs) as executor:
+            remapped = list(executor.map(_fix_stepchart_in_worker, chart_texts))
+    else:
+        remapped = [fix_stepchart(old_simfile, new_simfile, new_simfile.chart(i),
+                                  snap, remove_small_holds)
+                    for i in remaining]
+    for i, new_chart in zip(remaining, remapped):
+        new_charts[i] = new_chart
+        if cache is not None:
+            cache.put(keys[i], new_chart)
+    if cache is not None and remaining:
+        cache.trim()
+
+    for i in indices:
+        new_simfile.replace(i, new_charts[i])
+
+def iter_simfile(fin):
+    """
+    Reads the #KEY:VALUE; pairs of an .sm or .ssc file one at a time.
+
+    fin can be an open file or any other iterable of lines, so the
+    file is read in buffered chunks rather than all at once.  Comments
+    are dropped and each line of a value is stripped.  The lines of a
+    value are collected in a list and joined once the ; is found.
+    """
     key = None
-    value = None
-    for i in xrange(len(lines)):
-        line = lines[i]
+    pieces = None
+    for line in fin:
         comment = line.find("//")
         if comment >= 0:
             line = line[:comment]
         line = line.strip()
-        if key is None:
-            key_start = line.find("#")
-            if key_start < 0:
-                # still not in a key, so no need to save the text
-                continue
-            key_start = key_start + 1
-            key_end = line[key_start:].find(":") + key_start
-            if key_end < 0:
-                raise RuntimeError("Key spanned multiple lines")
-            if key_start == key_end:
-                raise RuntimeError("Empty key #:")
-            key = line[key_start:key_end]
-            line = line[key_end+1:]
-        # now we are in a key.  save text and keep going
-        if value is None:
-            value = ""
-        value_end = line.find(";")
-        if value_end >= 0:
-            value = value + line[:value_end]
-            pairs.append( (key, value) )
+        # a single line can have the end of one value and the start
+        # of the next, such as #TITLE:foo;#ARTIST:bar;
+        while True:
+            if key is None:
+                key_start = line.find("#")
+                if key_start < 0:
+                    # still not in a key, so no need to save the text
+                    break
+                key_end = line.find(":", key_start)
+                if key_end < 0:
+                    raise RuntimeError("Key spanned multiple lines")
+                if key_end == key_start + 1:
+                    raise RuntimeError("Empty key #:")
+                key = line[key_start+1:key_end]
+                line = line[key_end+1:]
+                pieces = []
+            # now we are in a key.  save text and keep going
+            value_end = line.find(";")
+            if value_end < 0:
+                pieces.append(line)
+                break
+            pieces.append(line[:value_end])
+            yield (key, "\n".join(pieces))
             key = None
-            value = None
+            pieces = None
+            line = line[value_end+1:].strip()
+
+def read_simfile(filename):
+    with open(filename) as fin:
+        return Simfile(list(iter_simfile(fin)))
+
+def ssc_charts(pairs):
+    """
+    Splits the pairs of an .ssc file into the pairs for the song
+    itself and a list of pairs for each #NOTEDATA chart.
+
+    For an .sm file, all of the pairs belong to the song.
+    """
+    header = []
+    charts = []
+    for pair in pairs:
+        if pair[0].lower() == "notedata":
+            charts.append([])
+        if charts:
+            charts[-1].append(pair)
         else:
-            value = value + "\n" + line
-    return Simfile(pairs)
-
-def fix_bg_changes(old_simfile, new_simfile):
-    index = None
-    for i in xrange(len(new_simfile.pairs)):
-        if new_simfile.pairs[i][0].lower() == "bgchanges":
-            index = i
-            break
-    if index is None:
-        # no bgchanges to fix
-        return
+            header.append(pair)
+    return header, charts
+
+def chart_timing(simfile, chart_pairs):
+    """
+    Returns a TimingTable for an .ssc chart.
+
+    Charts can have their own OFFSET, BPMS and STOPS.  Any of those
+    not given by the chart come from the song.
+    """
+    offset = simfile.offset
+    bpms = simfile.bpms
+    stops = simfile.stops
+    for key, value in chart_pairs:
+        key = key.lower()
+        if key == "offset":
+            offset = float(value)
+        elif key == "bpms":
+            bpms = numbered_list(value, "BPMS")
+        elif key == "stops":
+            stops = numbered_list(value, "STOPS")
+    return TimingTable(offset, bpms, stops)
 
-    changes = new_simfile.pairs[index][1].split(",")
-    changes = [x for x in changes if x]
-    new_changes = []
-    for change in changes:
-        beat, effect = change.strip().split("=", 1)
-        time = old_simfile.time(float(beat))
-        new_beat = new_simfile.beat(time)
-        new_changes.append("%0.3f=%s" % (new_beat, effect))
-    new_simfile.pairs[index] = (new_simfile.pairs[index][0], ",\n".join(new_changes))
-
-def write_simfile(filename, simfile):
-    fout = open(filename, "w")
-    for i in simfile.pairs:
-        fout.write("#%s:%s;\n" % (i[0], i[1]))
+# Tags which are a list of beat=value=... entries.  The number is the
+# field, if any, with a length in beats, which is remapped as well.
+# #ATTACKS are in seconds, so they stay with the music as they are.
+BEAT_TAGS = OrderedDict([("bgchanges", None),
+                         ("bgchanges2", None),
+                         ("fgchanges", None),
+                         ("tickcounts", None),
+                         ("combos", None),
+                         ("labels", None),
+                         ("scrolls", None),
+                         ("speeds", 2),
+                         ("fakes", 1)])
+
+# Timing gimmicks which the old TimingTable doesn't follow.  The new
+# BPMS and STOPS replace them.
+DROPPED_TIMING_TAGS = ("delays", "warps")
+
+def has_beat_length(tag, fields):
+    length_field = BEAT_TAGS[tag]
+    if length_field is None or len(fields) <= length_field:
+        return False
+    if tag == "speeds" and len(fields) > 3 and fields[3].strip() != "0":
+        # this speed change lasts a number of seconds, not beats
+        return False
+    return True
+
+# Notes which are stepped on, as opposed to tails, mines, fakes, etc
+ONSET_CODES = frozenset([NOTE_TAP, NOTE_HOLD, NOTE_ROLL, NOTE_CODES['L']])
+
+def row_has_onset(row):
+    while row:
+        if row & PANEL_MASK in ONSET_CODES:
+            return True
+        row = row >> PANEL_BITS
+    return False
+
+def simfile_onsets(simfile):
+    """
+    Returns the beats and times of every row which has a note to step
+    on, in any chart, in order of time and with no repeats.
+
+    Charts which share a timing have their ticks merged first, so each
+    row is converted to a time once, in a single batch.  .ssc charts
+    with their own timing are converted with that timing.
+    """
+    header, ssc = ssc_charts(simfile.pairs)
+    if ssc:
+        charts = [(chart_timing(simfile, chart_pairs), value)
+                  for chart_pairs in ssc
+                  for key, value in chart_pairs if key.lower() == "notes"]
+    else:
+        charts = [(simfile.timing, simfile.chart(i).pieces[5]) for i in simfile.indices("notes")]
+
+    ticks_by_timing = OrderedDict()
+    for timing, note_data in charts:
+        timing_ticks = ticks_by_timing.setdefault(timing.key, (timing, set()))[1]
+        ticks, rows, width = chart_ticks(note_data)
+        timing_ticks.update(tick for tick, row in zip(ticks, rows) if row_has_onset(row))
+
+    onsets = set()
+    for timing, ticks in ticks_by_timing.values():
+        beats = ticks_to_beats(sorted(ticks))
+        onsets.update(zip(timing.times(beats), beats))
+    onsets = sorted(onsets)
+    return array('d', [x[1] for x in onsets]), array('d', [x[0] for x in onsets])
+
+def fix_beat_tags(old_simfile, new_simfile):
+    """
+    Moves every entry of the BEAT_TAGS to its new beat.
+
+    The beats of all the entries, and the ends of any lengths, are
+    collected first, so the whole file takes one batch of times() and
+    beats() calls.  #DELAYS and #WARPS are cleared with a warning.
+    """
+    pending = []
+    beats = []
+    for tag in BEAT_TAGS:
+        for index in new_simfile.indices(tag):
+            changes = [x.strip().split("=") for x in new_simfile.pairs[index][1].split(",")
+                       if x.strip()]
+            if not changes:
+                continue
+            lengths = []
+            for fields in changes:
+                beat = float(fields[0])
+                beats.append(beat)
+                lengths.append(has_beat_length(tag, fields))
+                if lengths[-1]:
+                    beats.append(beat + float(fields[BEAT_TAGS[tag]]))
+            pending.append((tag, index, changes, lengths))
+
+    if pending:
+        new_beats = new_simfile.beats(old_simfile.times(beats))
+        position = 0
+        for tag, index, changes, lengths in pending:
+            for fields, has_length in zip(changes, lengths):
+                start = new_beats[position]
+                position = position + 1
+                fields[0] = "%0.3f" % start
+                if has_length:
+                    fields[BEAT_TAGS[tag]] = "%0.3f" % (new_beats[position] - start)
+                    position = position + 1
+            new_simfile.replace(index, ",\n".join(["=".join(x) for x in changes]))
+
+    for tag in DROPPED_TIMING_TAGS:
+        for index in new_simfile.indices(tag):
+            if new_simfile.pairs[index][1].strip():
+                print("Warning: #%s is not remapped.  Clearing it" % tag.upper())
+                new_simfile.replace(index, "")
+
+def simfile_text(simfile):
+    return "".join(["#%s:%s;\n" % (key, value) for key, value in simfile.pairs])
+
+def file_hash(filename, chunk_size=1 << 16):
+    """
+    Returns the sha1 of a file, reading it a chunk at a time.
+    """
+    digest = hashlib.sha1()
+    with open(filename, "rb") as fin:
+        while True:
+            chunk = fin.read(chunk_size)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def write_simfile(filename, simfile, fsync=False):
+    """
+    Writes the simfile in one piece to a temp file next to filename,
+    then renames it over filename.  A crash partway through leaves
+    the old file, if any, instead of a truncated one.
+
+    If filename already has exactly this content, it is left alone so
+    its mtime doesn't change and StepMania doesn't rebuild its cache.
+
+    fsync forces the data to disk before the rename, which is slower
+    but safer on network storage.
+
+    Returns True if the file was written, False if it was unchanged.
+    """
+    # same encoding a plain open(filename, "w") would use
+    data = simfile_text(simfile).encode(locale.getpreferredencoding(False))
+    if (os.path.exists(filename) and os.path.getsize(filename) == len(data) and
+        file_hash(filename) == hashlib.sha1(data).hexdigest()):
+        return False
+
+    directory, basename = os.path.split(os.path.abspath(filename))
+    fd, temp_filename = tempfile.mkstemp(dir=directory, prefix="." + basename + ".",
+                                         suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as fout:
+            fout.write(data)
+            if fsync:
+                fout.flush()
+                os.fsync(fout.fileno())
+        # mkstemp makes the file readable only by us
+        if os.path.exists(filename):
+            shutil.copymode(filename, temp_filename)
+        else:
+            umask = os.umask(0)
+            os.umask(umask)
+            os.chmod(temp_filename, 0o666 & ~umask)
+        replace_file(temp_filename, filename)
+    except:
+        try:
+            os.remove(temp_filename)
+        except OSError:
+            pass
+        raise
+    return True
+
+def normalize_bpms(bpms):
+    """
+    A single number is turned into a BPMS list starting at beat 0.
+    """
+    if bpms and POSITIVE_FLOAT.match(bpms):
+        return "0.0=%s" % bpms
+    return bpms
+
+def remap_file(input_filename, output_filename, offset, bpms, stops,
+               snap, remove_small_holds, jobs=1, fsync=False, cache=None):
+    """
+    Reads one simfile, remaps it to the new timing, and writes it out.
+    Charts are looked up in and added to cache, if given.
+
+    Returns False if the output already had the remapped contents.
+    """
+    old_simfile = read_simfile(input_filename)
+    new_simfile = copy.deepcopy(old_simfile)
+    new_simfile.update_bpms(offset, normalize_bpms(bpms), stops)
+    fix_beat_tags(old_simfile, new_simfile)
+    fix_notes(old_simfile, new_simfile, snap, remove_small_holds, jobs, cache)
+    return write_simfile(output_filename, new_simfile, fsync)
+
+
+# Options which can be given per song in a --manifest
+REMAP_OPTIONS = ("bpms", "stops", "offset", "snap", "remove_small_holds")
+
+BatchResult = namedtuple("BatchResult", "path seconds written error cache_hits cache_misses")
+
+def find_simfiles(input_dir):
+    """
+    Returns the paths, relative to input_dir and using /, of every .sm
+    file under input_dir, such as a pack extracted by scrape_category.
+    """
+    paths = []
+    for root, dirs, files in os.walk(input_dir):
+        dirs.sort()
+        for filename in sorted(files):
+            if filename.lower().endswith(".sm"):
+                path = os.path.relpath(os.path.join(root, filename), input_dir)
+                paths.append(path.replace(os.sep, "/"))
+    return paths
+
+def read_manifest(filename):
+    """
+    Reads a JSON manifest of per song options.
+
+    The manifest maps the path of a simfile, or of the directory it is
+    in, relative to the pack directory, to a dict of any of
+    REMAP_OPTIONS.  For example
+
+    {"Some Song": {"bpms": "150", "offset": "0.009"},
+     "Other Song/other.sm": {"bpms": "0=120,64=240", "snap": 192}}
+
+    Numbers are also accepted for bpms, stops and offset, as in
+    {"bpms": 150}, and are turned into text.  An offset of null keeps
+    the existing offset.  Values of the wrong type are reported here,
+    before any song is remapped.
+    """
+    with open(filename) as fin:
+        manifest = json.load(fin)
+    if not isinstance(manifest, dict):
+        raise RuntimeError("The manifest in %s must be a JSON object" % filename)
+    for path, options in manifest.items():
+        if not isinstance(options, dict):
+            raise RuntimeError("The options for %s in %s must be a JSON object, not %r" %
+                               (path, filename, options))
+        unknown = set(options.keys()) - set(REMAP_OPTIONS)
+        if unknown:
+            raise RuntimeError("Unknown options for %s in %s: %s" %
+                               (path, filename, ", ".join(sorted(unknown))))
+        for key, value in options.items():
+            try:
+                options[key] = manifest_value(key, value)
+            except (TypeError, ValueError):
+                raise RuntimeError("Bad value for %s of %s in %s: %r" %
+                                   (key, path, filename, value))
+    return manifest
+
+def manifest_value(key, value):
+    """
+    Checks the type of one option from a manifest and converts it to
+    what remap_file expects.  Raises ValueError or TypeError if it
+    can't be converted.
+    """
+    if key == "offset" and value is None:
+        # keep the existing offset, as remap_file does
+        return None
+    if isinstance(value, bool) or value is None:
+        raise TypeError("%s can't be %r" % (key, value))
+    if key == "snap":
+        if isinstance(value, float) and value != int(value):
+            raise ValueError("snap must be a whole number")
+        return int(value)
+    if key == "remove_small_holds":
+        return float(value)
+    if isinstance(value, (int, float)):
+        # repr keeps every digit of a float on python 2 as well
+        return repr(value)
+    if not isinstance(value, (str, type(u""))):
+        raise TypeError("%s must be text or a number" % key)
+    return value
+
+def song_options(path, manifest, defaults):
+    """
+    Returns the options for one simfile: the defaults, updated with the
+    entry for its directory and then the entry for the file itself.
+    """
+    options = dict(defaults)
+    directory = path.rsplit("/", 1)[0] if "/" in path else ""
+    options.update(manifest.get(directory, {}))
+    options.update(manifest.get(path, {}))
+    return options
+
+def _remap_batch_file(task):
+    """
+    Remaps one file of a batch.  Errors are caught and returned so
+    that one bad simfile doesn't stop the rest of the pack.
+    """
+    path, input_filename, output_filename, options, cache_dir, cache_size = task
+    start = default_timer()
+    cache = ChartCache(cache_dir, cache_size) if cache_dir else None
+    try:
+        output_dir = os.path.dirname(output_filename)
+        if output_dir and not os.path.exists(output_dir):
+            try:
+                os.makedirs(output_dir)
+            except OSError:
+                # another worker may have just made it
+                if not os.path.isdir(output_dir):
+                    raise
+        written = remap_file(input_filename, output_filename, cache=cache, **options)
+        error = None
+    except Exception as e:
+        written = False
+        error = "%s: %s" % (type(e).__name__, e)
+    return BatchResult(path, default_timer() - start, written, error,
+                       cache.hits if cache else 0, cache.misses if cache else 0)
+
+def remap_directory(input_dir, output_dir, manifest, defaults, jobs=1, fsync=False,
+                    cache_dir=None, cache_size=10000):
+    """
+    Remaps every .sm file under input_dir into the same place under
+    output_dir.
+
+    Options for each song come from the manifest, falling back to
+    defaults.  Files are spread over a pool of jobs processes, all
+    sharing the ChartCache in cache_dir if one is given.
+    Returns a BatchResult for each file, with the time it took and
+    the error if it failed.
+    """
+    tasks = []
+    for path in find_simfiles(input_dir):
+        pieces = path.split("/")
+        options = song_options(path, manifest, defaults)
+        options["fsync"] = fsync
+        tasks.append((path,
+                      os.path.join(input_dir, *pieces),
+                      os.path.join(output_dir, *pieces),
+                      options, cache_dir, cache_size))
+    if jobs > 1 and len(tasks) > 1 and ProcessPoolExecutor is not None:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            return list(executor.map(_remap_batch_file, tasks))
+    return [_remap_batch_file(task) for task in tasks]
+
+def print_batch_report(results):
+    print()
+    print("seconds  simfile")
+    for result in results:
+        if result.error:
+            status = "  FAILED"
+        elif not result.written:
+            status = "  unchanged"
+        else:
+            status = ""
+        print("%7.3f  %s%s" % (result.seconds, result.path, status))
+    failures = [x for x in results if x.error]
+    print("Remapped %d of %d simfiles in %.3f seconds of work" %
+          (len(results) - len(failures), len(results),
+           sum(x.seconds for x in results)))
+    hits = sum(x.cache_hits for x in results)
+    misses = sum(x.cache_misses for x in results)
+    if hits or misses:
+        print(cache_summary(hits, misses))
+    for failure in failures:
+        print("Failed: %s: %s" % (failure.path, failure.error))
 
 def parse_args():
     parser = argparse.ArgumentParser(description='Remap BPMs')
-    parser.add_argument('--input', default=None, required=True,
+    parser.add_argument('--input', default=None,
                         help="Which file to read for input")
-    parser.add_argument('--output', default=None, required=True,
+    parser.add_argument('--output', default=None,
                         help="Where to write the translated file")
+    parser.add_argument('--input_dir', default=None,
+                        help="Remap every .sm file in this directory, such as a pack, instead of a single --input")
+    parser.add_argument('--output_dir', default=None,
+                        help="Where to write the translated files for --input_dir.  The directory structure is copied")
+    parser.add_argument('--manifest', default=None,
+                        help="JSON file with options for each song of --input_dir.  Songs not listed use the command line options")
     parser.add_argument('--bpms', default=None,
                         help="BPM to use: use sm format or give a single bpm")
     parser.add_argument('--stops', default="",
@@ -333,20 +1390,47 @@ def parse_args():
                         help="Beat division for snapping the steps")
     parser.add_argument('--remove_small_holds', type=float, default=0.0,
                         help="Remove holds & rolls which take up less than this value in beats.")
+    parser.add_argument('--jobs', type=int, default=1,
+                        help="Remap the charts, or the files of --input_dir, in this many processes at once")
+    parser.add_argument('--fsync', default=False, action='store_true',
+                        help="Flush each output file to disk before moving it into place")
+    parser.add_argument('--cache_dir', default=None,
+                        help="Keep remapped charts in this directory so that later runs only remap charts which changed")
+    parser.add_argument('--cache_size', type=int, default=10000,
+                        help="Most charts to keep in --cache_dir.  The least recently used are removed first")
 
     args = parser.parse_args()
-    if args.bpms and POSITIVE_FLOAT.match(args.bpms):
-        args.bpms = "0.0=%s" % args.bpms
+    if args.input_dir:
+        if args.input or args.output:
+            parser.error("Use either --input_dir or --input, not both")
+        if not args.output_dir:
+            parser.error("--input_dir needs an --output_dir")
+    else:
+        if not args.input or not args.output:
+            parser.error("--input and --output are required")
+        if args.manifest:
+            parser.error("--manifest only works with --input_dir")
+    args.bpms = normalize_bpms(args.bpms)
 
     return args
 
 if __name__ == "__main__":
     args = parse_args()
 
-    old_simfile = read_simfile(args.input)
-    new_simfile = copy.deepcopy(old_simfile)
-    new_simfile.update_bpms(args.offset, args.bpms, args.stops)
-    fix_bg_changes(old_simfile, new_simfile)
-    fix_notes(old_simfile, new_simfile, args.snap, args.remove_small_holds)
-    write_simfile(args.output, new_simfile)
-
+    if args.input_dir:
+        manifest = read_manifest(args.manifest) if args.manifest else {}
+        defaults = dict((x, getattr(args, x)) for x in REMAP_OPTIONS)
+        results = remap_directory(args.input_dir, args.output_dir,
+                                  manifest, defaults, args.jobs, args.fsync,
+                                  args.cache_dir, args.cache_size)
+        print_batch_report(results)
+        if any(x.error for x in results):
+            sys.exit(1)
+    else:
+        cache = ChartCache(args.cache_dir, args.cache_size) if args.cache_dir else None
+        if not remap_file(args.input, args.output, args.offset, args.bpms, args.stops,
+                          args.snap, args.remove_small_holds, args.jobs, args.fsync,
+                          cache):
+            print("%s already up to date" % args.output)
+        if cache is not None:
+            print(cache.summary())
@@ -0,0 +1,217 @@
+import io
+import os
+import random
+import shutil
+import sys
+import tempfile
+import unittest
+from array import array
+
+import bpms
+
+def sample_times(bpm, offset, num_beats, jitter=0.003, seed=1000):
+    """
+    Notes on the beat, 8ths, 16ths and triplets, slightly off time
+    """
+    rng = random.Random(seed)
+    patterns = [[0.0], [0.0, 0.5], [0.0, 0.25, 0.5, 0.75], [0.0, 1 / 3.0, 2 / 3.0], [0.5], []]
+    seconds_per_beat = 60.0 / bpm
+    times = []
+    for beat in range(num_beats):
+        for fraction in rng.choice(patterns):
+            times.append(offset + (beat + fraction) * seconds_per_beat + rng.gauss(0, jitter))
+    return times
+
+
+class TestEstimateBpm(unittest.TestCase):
+    def test_estimate_bpm(self):
+        for bpm in (128.5, 150.0, 173.2):
+            candidates = bpms.estimate_bpm(sample_times(bpm, 0.25, 200))
+            assert abs(candidates[0][0] - bpm) < 0.05
+            assert candidates[0][1] > candidates[1][1]
+            assert abs(sum(x[1] for x in candidates) - 1.0) < 1e-6
+
+    def test_refine_bpm(self):
+        times = sample_times(140.0, 0.0, 300)
+        assert abs(bpms.refine_bpm(times, 140.2, 0.25) - 140.0) < 0.01
+        assert bpms.phase_coherence(times, 140.0) > bpms.phase_coherence(times, 141.0)
+
+    def test_too_few_times(self):
+        self.assertRaises(ValueError, bpms.estimate_bpm, [1.0])
+        # no gap between notes is short enough to be a beat
+        self.assertRaises(ValueError, bpms.estimate_bpm, [1.0, 20.0, 45.0])
+        self.assertRaises(ValueError, bpms.time_song, [1.0, 20.0, 45.0])
+
+
+def tempo_change_notes(sections, offset=0.4, jitter=0.003, seed=1000):
+    """
+    8th notes, with some left out, through sections of (bpm, beats)
+    """
+    rng = random.Random(seed)
+    beats = []
+    times = []
+    beat = 0.0
+    time = offset
+    for bpm, num_beats in sections:
+        for i in range(num_beats * 2):
+            if rng.random() < 0.7:
+                beats.append(beat)
+                times.append(time + rng.gauss(0, jitter))
+            beat = beat + 0.5
+            time = time + 30.0 / bpm
+    return beats, times
+
+
+class TestSegments(unittest.TestCase):
+    def test_range_fit(self):
+        beats = [0.0, 1.0, 2.0, 3.0, 4.0]
+        times = [0.5 + 0.4 * x for x in beats]
+        sums = bpms.prefix_sums(beats, times)
+        A, B, error = bpms.range_fit(sums, 1, 4)
+        assert abs(A - 0.4) < 1e-9 and abs(B - 0.5) < 1e-9 and error < 1e-9
+        assert bpms.range_fit(sums, 2, 3) is None
+
+    def test_segments(self):
+        beats, times = tempo_change_notes([(150, 64), (180, 64), (120, 64)])
+        segments = bpms.segment_notes(beats, times, 0.01)
+        offset, timing = bpms.segments_to_bpms(beats, times, segments)
+        assert abs(offset + 0.4) < 0.005
+        assert len(timing) == 3
+        for (beat, bpm), (expected_beat, expected_bpm) in zip(timing, [(0, 150), (64, 180), (128, 120)]):
+            assert abs(beat - expected_beat) < 0.1
+            assert abs(bpm - expected_bpm) < 0.1
+        errors = bpms.timing_errors(beats, times, offset, timing)
+        assert max(abs(x) for x in errors) < 0.015
+
+        text = bpms.timing_text(offset, timing)
+        assert text.startswith("#OFFSET:-0.4")
+        assert text.count("=") == 3
+
+    def test_constant(self):
+        beats, times = tempo_change_notes([(140, 200)])
+        assert len(bpms.segment_notes(beats, times, 0.01)) == 1
+
+    def test_short_runs(self):
+        # the tempo changes every two or three notes, so the runs are
+        # as short as they can be and the boundaries have no room to move
+        beats = [0.0, 1.0, 2.0, 3.0, 4.0, 5.0, 6.0, 7.0]
+        gaps = [0.5, 0.3, 0.5, 0.2, 0.6, 0.3, 0.45]
+        times = [0.0]
+        for gap in gaps:
+            times.append(times[-1] + gap)
+        segments = bpms.segment_notes(beats, times, 0.001)
+        assert segments[0][0] == 0 and segments[-1][1] == len(beats)
+        for before, after in zip(segments, segments[1:]):
+            assert before[1] == after[0]
+        assert all(end - start >= 2 for start, end, A, B in segments)
+
+    def test_same_beat(self):
+        # notes on the same beat stay in the run they start
+        segments = bpms.segment_notes([0.0, 0.0, 1.0], [0.0, 0.01, 0.5], 0.01)
+        assert [x[:2] for x in segments] == [(0, 3)]
+        beats, times = tempo_change_notes([(150, 32), (180, 32)])
+        beats = [beats[0]] + beats[:40] + [beats[40]] + beats[40:] + [beats[-1]] * 2
+        times = [times[0] - 0.002] + times[:40] + [times[40] + 0.002] + times[40:] + [times[-1] + 0.002] * 2
+        segments = bpms.segment_notes(beats, times, 0.01)
+        assert segments[0][0] == 0 and segments[-1][1] == len(beats)
+        for before, after in zip(segments, segments[1:]):
+            assert before[1] == after[0]
+        offset, timing = bpms.segments_to_bpms(beats, times, segments)
+        assert [round(x[1]) for x in timing] == [150, 180]
+
+        self.assertRaises(ValueError, bpms.segment_notes, [1.0, 1.0, 1.0], [0.0, 0.1, 0.5])
+
+
+class TestTimeSong(unittest.TestCase):
+    def test_read_times(self):
+        lines = io.StringIO(u"# a comment\n0.5\n\n  1.0  # the chorus\n1.25\n")
+        assert list(bpms.read_times(lines)) == [0.5, 1.0, 1.25]
+
+    def test_time_song(self):
+        beats, times = tempo_change_notes([(150, 100)], offset=0.25)
+        # any iterable of times works
+        timing = bpms.time_song(array('d', reversed(times)))
+        assert len(timing.bpms) == 1
+        assert abs(timing.bpms[0][1] - 150.0) < 0.05
+        # the first note is counted as beat 0
+        assert abs(timing.offset + 0.25 + beats[0] * 0.4) < 0.005
+        assert timing.max_error < 0.015
+
+        constant = bpms.constant_timing(beats, times)
+        assert abs(constant.bpms[0][1] - timing.bpms[0][1]) < 0.01
+        through = bpms.interval_timing(beats, times)
+        assert len(through.bpms) == len(times) - 1
+        # only off by the rounding of the written BPMs
+        assert through.max_error < 0.001
+
+        # a note found twice at the same time doesn't divide by zero
+        doubled = bpms.interval_timing([0.0, 1.0, 1.0, 2.0], [0.5, 1.0, 1.0, 1.5])
+        assert [x[1] for x in doubled.bpms] == [120.0, 120.0]
+        self.assertRaises(ValueError, bpms.interval_timing, [0.0, 1.0], [0.5, 0.5])
+
+    def test_time_song_16ths(self):
+        # 8ths, 16ths and triplets each get their own beats
+        for bpm in (128.5, 150.0):
+            times = sample_times(bpm, 0.25, 200)
+            for timing in (bpms.time_song(times), bpms.time_song(times, bpm=bpm)):
+                assert len(timing.bpms) == 1
+                assert abs(timing.bpms[0][1] - bpm) < 0.05
+                assert abs(timing.offset + 0.25) < 0.005
+                assert timing.max_error < 0.015
+
+        stream = [0.25 + 0.1 * x for x in range(200)]
+        timing = bpms.time_song(stream, bpm=150.0)
+        assert timing.bpms == [(0.0, 150.0)]
+        assert abs(timing.offset + 0.25) < 1e-6
+
+    def test_time_simfile(self):
+        directory = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(directory, "song.sm")
+            measures = ",\n".join(["1000\n0100\n0010\n0001"] * 16)
+            with open(filename, "w") as fout:
+                fout.write("#OFFSET:-0.100;\n#BPMS:0.000=140.000;\n#NOTES:dance-single::Hard:5::\n"
+                           "0000\n0000\n0000\n0000\n,\n%s;\n" % measures)
+            timing = bpms.time_simfile(filename)
+            assert abs(timing.offset + 0.1) < 1e-6
+            assert len(timing.bpms) == 1 and abs(timing.bpms[0][1] - 140.0) < 1e-6
+        finally:
+            shutil.rmtree(directory)
+
+    def test_time_simfile_16ths(self):
+        """
+        The beats come from the chart, so 16ths and 8ths, which don't
+        fall on half beats, are timed exactly.
+        """
+        directory = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(directory, "song.sm")
+            sixteenths = "\n".join(["1000", "0100", "0010", "0001"] * 4)
+            eighths = "\n".join(["1000", "0000", "0010", "0000"] * 4)
+            mixed = "\n".join(["1000", "0100", "0010", "0000"] * 4)
+            measures = ",\n".join([sixteenths, eighths, mixed] * 4)
+            with open(filename, "w") as fout:
+                fout.write("#OFFSET:0.050;\n#BPMS:0.000=140.000;\n#NOTES:dance-single::Hard:5::\n"
+                           "%s;\n" % measures)
+            timing = bpms.time_simfile(filename)
+            assert abs(timing.offset - 0.05) < 1e-6
+            assert len(timing.bpms) == 1 and abs(timing.bpms[0][1] - 140.0) < 1e-6
+            assert timing.max_error < 1e-4
+
+            output = io.StringIO() if sys.version_info[0] >= 3 else io.BytesIO()
+            stdout = sys.stdout
+            sys.stdout = output
+            try:
+                bpms.main([filename, "auto"])
+            finally:
+                sys.stdout = stdout
+            text = output.getvalue()
+            assert "ESTIMATED" not in text
+            robust = text.split("ROBUST LSR")[1].split("\n")[2]
+            assert robust.startswith("#BPMS:0.000=140.0000")
+        finally:
+            shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+import random
+import unittest
+
+import fitting
+
+def noisy_line(A, B, num_notes, jitter=0.003, num_outliers=0, seed=1000):
+    rng = random.Random(seed)
+    beats = [x * 0.5 for x in range(num_notes)]
+    times = [A * x + B + rng.gauss(0, jitter) for x in beats]
+    for i in rng.sample(range(num_notes), num_outliers):
+        times[i] = times[i] + rng.choice([-1, 1]) * rng.uniform(0.08, 0.2)
+    return beats, times
+
+
+class TestFitLine(unittest.TestCase):
+    def test_fit_line(self):
+        beats = [0.0, 1.0, 2.0, 4.0]
+        times = [0.25 + 0.4 * x for x in beats]
+        A, B = fitting.fit_line(beats, times)
+        assert abs(A - 0.4) < 1e-9
+        assert abs(B - 0.25) < 1e-9
+
+        # a zero weight note doesn't count
+        times[3] = 10.0
+        A, B = fitting.fit_line(beats, times, [1.0, 1.0, 1.0, 0.0])
+        assert abs(A - 0.4) < 1e-9
+
+        self.assertRaises(ValueError, fitting.fit_line, [1.0, 1.0], [0.5, 0.6])
+
+    def test_residual_stats(self):
+        errors = fitting.residuals([0.0, 1.0, 2.0], [0.0, 0.6, 0.8], 0.5, 0.0)
+        assert [round(x, 6) for x in errors] == [0.0, -0.1, 0.2]
+        stats = fitting.residual_stats(errors)
+        assert abs(stats.max_error - 0.2) < 1e-9
+        assert abs(stats.rms_error - (0.05 / 3) ** 0.5) < 1e-9
+        assert abs(stats.mean_error - 0.1 / 3) < 1e-9
+
+
+class TestRobustFit(unittest.TestCase):
+    def test_robust_fit_line(self):
+        beats, times = noisy_line(0.4, 0.3, 400, num_outliers=20)
+        A, B = fitting.fit_line(beats, times)
+        robust_A, robust_B, weights = fitting.robust_fit_line(beats, times)
+        assert abs(robust_A - 0.4) < abs(A - 0.4) or abs(robust_B - 0.3) < abs(B - 0.3)
+        assert abs(robust_B - 0.3) < 0.002
+        assert abs(60.0 / robust_A - 150.0) < 0.01
+        assert sum(1 for w in weights if w == 0) >= 20
+
+    def test_ransac_fit_line(self):
+        beats, times = noisy_line(0.4, 0.3, 400, num_outliers=40)
+        A, B, inliers = fitting.ransac_fit_line(beats, times, seed=1)
+        assert abs(60.0 / A - 150.0) < 0.01
+        assert abs(B - 0.3) < 0.002
+        assert 350 <= sum(inliers) <= 365
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,134 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import index_simfiles
+import remap_bpm
+
+SM_TEXT = """#TITLE:Steady;
+#ARTIST:Nobody;
+#OFFSET:0.009;
+#BPMS:0.000=150.000;
+#NOTES:
+     dance-single:
+     :
+     Hard:
+     9:
+     0.1,0.2,0.3,0.4,0.5:
+1000
+0100 // a comment; with a semicolon
+,
+0010
+0001
+;#NOTES:
+     dance-double:
+     :
+     Challenge:
+     12:
+     0.1,0.2,0.3,0.4,0.5:
+10000000
+;
+"""
+
+SSC_TEXT = """#VERSION:0.83;
+#TITLE:Changes;  #ARTIST:Somebody; // a comment
+#OFFSET:0.000;
+#BPMS:0.000=120.000,16.000=180.000,32.000=120.000;
+#STOPS:8.000=0.500;
+#NOTEDATA:;
+#STEPSTYPE:dance-single;
+#DIFFICULTY:Hard;
+#METER:11;
+#NOTES:
+1000
+0100
+;
+#NOTEDATA:;
+#STEPSTYPE:dance-single;
+#DIFFICULTY:Easy;
+#METER:3;
+#NOTES:
+1000
+;
+"""
+
+class TestSkipNoteRows(unittest.TestCase):
+    def test_sm(self):
+        lines = SM_TEXT.split("\n")
+        header = list(remap_bpm.iter_simfile(index_simfiles.skip_note_rows(lines, 5)))
+        full = list(remap_bpm.iter_simfile(lines))
+        assert [x[0] for x in header] == [x[0] for x in full]
+        assert header[:4] == full[:4]
+        simfile = remap_bpm.Simfile(header)
+        assert [x.meter for x in simfile.charts()] == ["9", "12"]
+        assert [x.pieces[5] for x in simfile.charts()] == ["", ""]
+
+    def test_ssc(self):
+        lines = SSC_TEXT.split("\n")
+        header = list(remap_bpm.iter_simfile(index_simfiles.skip_note_rows(lines, 0)))
+        full = list(remap_bpm.iter_simfile(lines))
+        assert [x for x in header if x[0] != "NOTES"] == [x for x in full if x[0] != "NOTES"]
+        assert [x[1].strip() for x in header if x[0] == "NOTES"] == ["", ""]
+
+
+class TestIndex(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.songs = os.path.join(self.directory, "songs")
+        self.write("Pack/Steady/steady.sm", SM_TEXT)
+        self.write("Pack/Changes/changes.ssc", SSC_TEXT)
+        self.write("Pack/Broken/broken.sm", "#TITLE:No bpms;\n")
+        self.connection = index_simfiles.open_index(os.path.join(self.directory, "index.db"))
+
+    def tearDown(self):
+        self.connection.close()
+        shutil.rmtree(self.directory)
+
+    def write(self, path, text):
+        filename = os.path.join(self.songs, *path.split("/"))
+        if not os.path.exists(os.path.dirname(filename)):
+            os.makedirs(os.path.dirname(filename))
+        with open(filename, "w") as fout:
+            fout.write(text)
+        return filename
+
+    def test_read_header(self):
+        header = index_simfiles.read_header(os.path.join(self.songs, "Pack", "Changes", "changes.ssc"))
+        assert header.title == "Changes"
+        assert header.bpm_changes == 2
+        assert header.stops == 1
+        assert (header.min_bpm, header.max_bpm) == (120.0, 180.0)
+        assert [(x.difficulty, x.meter) for x in header.charts] == [("Hard", 11), ("Easy", 3)]
+
+    def test_incremental(self):
+        result = index_simfiles.update_index(self.connection, self.songs)
+        assert (result.added, result.updated, result.unchanged, result.removed, result.errors) == (3, 0, 0, 0, 1)
+        result = index_simfiles.update_index(self.connection, self.songs)
+        assert (result.added, result.updated, result.unchanged) == (0, 0, 3)
+
+        # a different size is noticed even if the mtime didn't change
+        self.write("Pack/Steady/steady.sm", SM_TEXT.replace("Steady", "Steadier"))
+        os.remove(os.path.join(self.songs, "Pack", "Broken", "broken.sm"))
+        result = index_simfiles.update_index(self.connection, self.songs)
+        assert (result.added, result.updated, result.unchanged, result.removed) == (0, 1, 1, 1)
+        titles = [x[1] for x in index_simfiles.find_songs(self.connection)]
+        assert titles == ["Changes", "Steadier"]
+        charts = self.connection.execute("SELECT COUNT(*) FROM charts").fetchone()[0]
+        assert charts == 4
+
+    def test_find_songs(self):
+        index_simfiles.update_index(self.connection, self.songs)
+        find = lambda **kwargs: [x[0] for x in index_simfiles.find_songs(self.connection, **kwargs)]
+        assert find() == ["Pack/Changes/changes.ssc", "Pack/Steady/steady.sm"]
+        assert find(bpm_changes=True) == ["Pack/Changes/changes.ssc"]
+        assert find(min_meter=12) == ["Pack/Steady/steady.sm"]
+        assert find(min_meter=10, mode="dance-double") == ["Pack/Steady/steady.sm"]
+        assert find(min_meter=12, mode="dance-single") == []
+        assert find(max_bpm=160) == ["Pack/Steady/steady.sm"]
+        assert find(min_bpm=140) == ["Pack/Steady/steady.sm"]
+        assert find(text="some") == ["Pack/Changes/changes.ssc"]
+
+
+if __name__ == '__main__':
+    unittest.main()
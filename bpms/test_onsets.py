@@ -0,0 +1,111 @@
+import array
+import contextlib
+import math
+import os
+import shutil
+import tempfile
+import unittest
+import wave
+
+import onsets
+import remap_bpm
+
+def write_clicks(filename, times, seconds, rate=22050, channels=2):
+    """
+    Writes a 16 bit wav with a short decaying beep at each time
+    """
+    samples = array.array('h', [0]) * int(seconds * rate)
+    for time in times:
+        start = int(time * rate)
+        for i in range(min(int(0.03 * rate), len(samples) - start)):
+            samples[start + i] = int(12000 * math.exp(-i / (0.005 * rate)) *
+                                     math.sin(2 * math.pi * 1000 * i / rate))
+    frames = array.array('h')
+    for sample in samples:
+        frames.extend([sample] * channels)
+    with contextlib.closing(wave.open(filename, "wb")) as wav:
+        wav.setnchannels(channels)
+        wav.setsampwidth(2)
+        wav.setframerate(rate)
+        wav.writeframes(frames.tobytes())
+
+
+@unittest.skipIf(onsets.numpy is None, "numpy is not installed")
+class TestOnsets(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, "song.wav")
+        self.times = [0.5 + 0.3 * i for i in range(12)] + [4.25, 4.4]
+        write_clicks(self.filename, self.times, 5.0)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_audio_onsets(self):
+        found = onsets.audio_onsets(self.filename, frame_size=1024, hop=256)
+        assert len(found) == len(self.times)
+        for x, y in zip(found, self.times):
+            assert abs(x - y) < 0.015
+
+    def test_blocks(self):
+        # the envelope doesn't depend on how the file is split up
+        whole = onsets.onset_envelope(self.filename, block_seconds=10.0)
+        pieces = onsets.onset_envelope(self.filename, block_seconds=0.07)
+        assert len(whole.values) == len(pieces.values)
+        assert onsets.numpy.allclose(whole.values, pieces.values, atol=1e-3)
+
+    def test_pcm_to_mono(self):
+        data = array.array('h', [100, -100, 16384, 16384]).tobytes()
+        mono = onsets.pcm_to_mono(data, 2, 2)
+        assert list(mono) == [0.0, 0.5]
+        data = bytes(bytearray([0, 0, 0x40, 0xff, 0xff, 0xff]))
+        mono = onsets.pcm_to_mono(data, 1, 3)
+        assert list(mono) == [0.5, -1.0 / (1 << 23)]
+
+
+# 8th notes at 120 bpm, in an uneven rhythm so only one shift lines up
+RHYTHM = "10110010" "10010110" "11010011" "01101001"
+
+def rhythm_simfile(offset):
+    rows = ["1000" if x == "1" else "0000" for x in RHYTHM]
+    measures = [rows[i:i + 8] for i in range(0, len(rows), 8)]
+    text = ("#TITLE:Test;\n#OFFSET:%.3f;\n#BPMS:0.000=120.000;\n"
+            "#NOTES:\n     dance-single:\n     :\n     Hard:\n     9:\n     0,0,0,0,0:\n"
+            "%s\n;\n" % (offset, "\n,\n".join("\n".join(m) for m in measures)))
+    return remap_bpm.Simfile(list(remap_bpm.iter_simfile(text.split("\n"))))
+
+
+@unittest.skipIf(onsets.numpy is None, "numpy is not installed")
+class TestOffset(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, "song.wav")
+        self.times = [0.5 + 0.25 * i for i, x in enumerate(RHYTHM) if x == "1"]
+        write_clicks(self.filename, self.times, 9.0)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_find_shift(self):
+        envelope = onsets.onset_envelope(self.filename)
+        for shift in (0.13, -0.2, 0.0):
+            found, confidence = onsets.find_shift([x - shift for x in self.times], envelope)
+            assert abs(found - shift) < 0.006
+            assert confidence > 0.1
+        # a different rhythm doesn't line up anywhere in particular
+        other = [0.5 + 0.25 * i for i, x in enumerate(reversed(RHYTHM)) if x == "1"]
+        found, confidence = onsets.find_shift(other, envelope)
+        assert confidence < 0.1
+
+    def test_find_offset(self):
+        # the chart starts at time 0, the audio at 0.5
+        simfile = rhythm_simfile(0.0)
+        offset, confidence = onsets.find_offset(simfile, self.filename)
+        assert abs(offset + 0.5) < 0.006
+        offset, confidence = onsets.find_offset(simfile, self.filename, bias=onsets.ITG_BIAS)
+        # the ITG sync has an OFFSET 9 ms larger
+        assert abs(offset + 0.491) < 0.006
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,553 @@
+import copy
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+import remap_bpm
+
+def build_simfile(offset="0.000", bpms="0.000=120.000", stops=""):
+    pairs = [("TITLE", "Test"),
+             ("OFFSET", offset),
+             ("BPMS", bpms),
+             ("STOPS", stops)]
+    return remap_bpm.Simfile(pairs)
+
+def walk_time(offset, bpms, stops, beat):
+    """
+    Straightforward beat -> time conversion used to check the tables
+    """
+    if beat <= 0:
+        return -offset + beat * 60.0 / bpms[0][1]
+    time = -offset
+    for idx, (start, bpm) in enumerate(bpms):
+        start = 0.0 if idx == 0 else start
+        end = bpms[idx + 1][0] if idx + 1 < len(bpms) else beat
+        end = min(end, beat)
+        if end > start:
+            time = time + (end - start) * 60.0 / bpm
+    for stop_beat, length in stops:
+        if stop_beat < beat:
+            time = time + length
+    return time
+
+
+class TestTime(unittest.TestCase):
+    def test_constant_bpm(self):
+        simfile = build_simfile(offset="0.500")
+        assert simfile.time(0) == -0.5
+        assert abs(simfile.time(4) - 1.5) < 1e-9
+        assert abs(simfile.time(-2) - -1.5) < 1e-9
+
+    def test_bpm_changes(self):
+        simfile = build_simfile(bpms="0.000=120.000,4.000=240.000")
+        assert abs(simfile.time(4) - 2.0) < 1e-9
+        assert abs(simfile.time(8) - 3.0) < 1e-9
+        assert abs(simfile.time(2) - 1.0) < 1e-9
+
+    def test_stops(self):
+        simfile = build_simfile(stops="4.000=1.000")
+        # the stop happens after the note on beat 4
+        assert abs(simfile.time(4) - 2.0) < 1e-9
+        assert abs(simfile.time(4.5) - 3.25) < 1e-9
+
+    def test_random_timing(self):
+        rng = random.Random(1234)
+        for _ in range(20):
+            bpms = [(0.0, rng.uniform(60, 300))]
+            for _ in range(rng.randint(0, 30)):
+                bpms.append((bpms[-1][0] + rng.randint(1, 16) / 2.0, rng.uniform(60, 300)))
+            stops = [(rng.randint(1, 200) / 4.0, rng.uniform(0.01, 1.0))
+                     for _ in range(rng.randint(0, 10))]
+            stops.sort()
+            offset = rng.uniform(-1, 1)
+
+            bpm_text = ",".join("%r=%r" % x for x in bpms)
+            stop_text = ",".join("%r=%r" % x for x in stops)
+            simfile = build_simfile(repr(offset), bpm_text, stop_text)
+
+            beats = [rng.uniform(-4, 250) for _ in range(200)]
+            beats.extend(x[0] for x in bpms)
+            beats.extend(x[0] for x in stops)
+            expected = [walk_time(offset, bpms, stops, beat) for beat in beats]
+            single = [simfile.time(beat) for beat in beats]
+            batch = simfile.times(beats)
+            for x, y, z in zip(expected, single, batch):
+                assert abs(x - y) < 1e-9
+                assert abs(x - z) < 1e-9
+
+
+class TestBeat(unittest.TestCase):
+    def test_constant_bpm(self):
+        simfile = build_simfile(offset="0.500")
+        assert simfile.beat(-0.5) == 0.0
+        assert abs(simfile.beat(1.5) - 4.0) < 1e-9
+        assert abs(simfile.beat(-1.5) - -2.0) < 1e-9
+
+    def test_bpm_changes(self):
+        simfile = build_simfile(bpms="0.000=120.000,4.000=240.000")
+        assert abs(simfile.beat(2.0) - 4.0) < 1e-9
+        assert abs(simfile.beat(3.0) - 8.0) < 1e-9
+
+    def test_stops(self):
+        simfile = build_simfile(stops="4.000=1.000")
+        # anywhere during the stop is on the stop's beat
+        assert abs(simfile.beat(2.0) - 4.0) < 1e-9
+        assert abs(simfile.beat(2.7) - 4.0) < 1e-9
+        assert abs(simfile.beat(3.0) - 4.0) < 1e-9
+        assert abs(simfile.beat(3.25) - 4.5) < 1e-9
+
+    def test_negative_stops(self):
+        simfile = build_simfile(stops="4.000=-1.000")
+        # still fine going forward
+        assert abs(simfile.time(8.0) - 3.0) < 1e-9
+        self.assertRaises(RuntimeError, simfile.beat, 1.0)
+
+    def test_round_trip(self):
+        rng = random.Random(5678)
+        for _ in range(20):
+            bpms = [(0.0, rng.uniform(60, 300))]
+            for _ in range(rng.randint(0, 30)):
+                bpms.append((bpms[-1][0] + rng.randint(1, 16) / 2.0, rng.uniform(60, 300)))
+            stops = [(rng.randint(0, 200) / 4.0, rng.uniform(0.01, 1.0))
+                     for _ in range(rng.randint(0, 10))]
+            offset = rng.uniform(-1, 1)
+
+            bpm_text = ",".join("%r=%r" % x for x in bpms)
+            stop_text = ",".join("%r=%r" % x for x in stops)
+            simfile = build_simfile(repr(offset), bpm_text, stop_text)
+
+            beats = [rng.uniform(-4, 250) for _ in range(200)]
+            beats.extend(x[0] for x in bpms)
+            beats.extend(x[0] for x in stops)
+            times = simfile.times(beats)
+            single = [simfile.beat(time) for time in times]
+            batch = simfile.beats(times)
+            for x, y, z in zip(beats, single, batch):
+                assert abs(x - y) < 1e-6
+                assert abs(x - z) < 1e-6
+
+
+class TestChartNotes(unittest.TestCase):
+    def test_chart_notes(self):
+        note_data = "1000\n0000\n0100\n0000\n,\n0010\n0000\n0000\n0000\n0000\n0000\n0000\n0001\n"
+        beats, rows, width = remap_bpm.chart_notes(note_data)
+        assert list(beats) == [0.0, 2.0, 4.0, 7.5]
+        assert [remap_bpm.decode_row(x, width) for x in rows] == ["1000", "0100", "0010", "0001"]
+        assert width == 4
+
+    def test_chart_ticks(self):
+        note_data = "1000\n0000\n0100\n0000\n,\n" + "0010\n" + "0000\n" * 19
+        ticks, rows, width = remap_bpm.chart_ticks(note_data)
+        assert list(ticks) == [0, 96, 192]
+        # 20 rows in a measure doesn't land on whole ticks
+        ticks, rows, width = remap_bpm.chart_ticks(note_data.replace("0010\n0000", "0000\n0010"))
+        assert ticks == [0, 96, 192 + remap_bpm.Fraction(192, 20)]
+
+    def test_round_ratio(self):
+        assert [remap_bpm.round_ratio(x, 4) for x in range(-6, 7)] == [int(round(x / 4.0)) for x in range(-6, 7)]
+
+    def test_linear_rows(self):
+        # at 125 bpm, a 192nd of a measure is exactly 0.01 seconds
+        old_timing = remap_bpm.TimingTable(0.0, [(0.0, 125.0)], [])
+        new_timing = remap_bpm.TimingTable(0.01, [(0.0, 125.0)], [(10.0, 0.0)])
+        ticks = list(range(0, 192 * 1000, 7))
+        rows = remap_bpm.linear_rows(ticks, old_timing, new_timing, 192)
+        assert list(rows) == [x + 1 for x in ticks]
+        rows = remap_bpm.linear_rows(ticks + [remap_bpm.Fraction(1, 3)], new_timing, old_timing, 48)
+        assert list(rows) == [remap_bpm.round_ratio(x - 1, 4) for x in ticks] + [0]
+
+        # tempo changes go through seconds instead
+        changing = remap_bpm.TimingTable(0.0, [(0.0, 125.0), (4.0, 150.0)], [])
+        assert remap_bpm.linear_rows(ticks, changing, new_timing, 192) is None
+        stopping = remap_bpm.TimingTable(0.0, [(0.0, 125.0)], [(4.0, 0.5)])
+        assert remap_bpm.linear_rows(ticks, old_timing, stopping, 192) is None
+
+    def test_snap_beats(self):
+        rows = remap_bpm.snap_beats([0.0, 0.26, 3.99, 4.1], 16)
+        assert list(rows) == [0, 1, 16, 16]
+
+
+class TestRows(unittest.TestCase):
+    def test_encode_decode(self):
+        for text in ("0000", "1000", "0M0L", "24300000", "FK01"):
+            row = remap_bpm.encode_row(text)
+            assert remap_bpm.decode_row(row, len(text)) == text
+        assert not remap_bpm.encode_row("00000000")
+        self.assertRaises(RuntimeError, remap_bpm.encode_row, "00X0")
+
+    def test_set_note(self):
+        row = remap_bpm.encode_row("0210")
+        row = remap_bpm.set_row_note(row, 1, remap_bpm.NOTE_TAP)
+        assert remap_bpm.decode_row(row, 4) == "0110"
+        assert remap_bpm.row_note(row, 2) == remap_bpm.NOTE_TAP
+        row = remap_bpm.set_row_note(row, 2, remap_bpm.NOTE_EMPTY)
+        assert remap_bpm.decode_row(row, 4) == "0100"
+
+    def test_combine(self):
+        A = remap_bpm.encode_row("1000")
+        B = remap_bpm.encode_row("00M0")
+        C = remap_bpm.encode_row("2000")
+        D = remap_bpm.encode_row("3000")
+        combined = remap_bpm.combine_steps(A, B, 4, "dance-single", "Hard", 0, 0)
+        assert remap_bpm.decode_row(combined, 4) == "10M0"
+        combined = remap_bpm.combine_steps(C, D, 4, "dance-single", "Hard", 0, 0)
+        assert remap_bpm.decode_row(combined, 4) == "1000"
+        self.assertRaises(RuntimeError, remap_bpm.combine_steps, A, C, 4, "dance-single", "Hard", 0, 0)
+
+
+class TestSmallHolds(unittest.TestCase):
+    def build_notes(self, rows):
+        rows = [remap_bpm.encode_row(x) for x in rows]
+        return dict((i, x) for i, x in enumerate(rows) if x)
+
+    def decode_notes(self, notes, num_rows):
+        return [remap_bpm.decode_row(notes.get(i, 0), 4) for i in range(num_rows)]
+
+    def test_remove_small_holds(self):
+        rows = ["2000", "3400", "0000", "0000", "0300", "0000", "0000", "0002",
+                "0000", "0000", "0000", "0000", "0000", "0000", "0000", "0003"]
+        notes = self.build_notes(rows)
+        remap_bpm.remove_small_holds_from_stepchart(notes, 8, 1.0, "dance-single", "Hard")
+        # rows are half a beat, so the hold on panel 0 is one beat
+        # including the tail row, and it goes.  the roll on panel 1 is
+        # two beats and the hold on panel 3 is four and a half, so
+        # they stay
+        expected = ["1000", "0400", "0000", "0000", "0300", "0000", "0000", "0002",
+                    "0000", "0000", "0000", "0000", "0000", "0000", "0000", "0003"]
+        assert self.decode_notes(notes, 16) == expected
+
+        remap_bpm.remove_small_holds_from_stepchart(notes, 8, 2.0, "dance-single", "Hard")
+        expected[1] = "0100"
+        expected[4] = "0000"
+        assert self.decode_notes(notes, 16) == expected
+
+
+class TestSparseMeasures(unittest.TestCase):
+    def test_measure_division(self):
+        assert remap_bpm.measure_division([], 192) == 4
+        assert remap_bpm.measure_division([0, 48, 96], 192) == 4
+        assert remap_bpm.measure_division([0, 24], 192) == 8
+        assert remap_bpm.measure_division([64], 192) == 12
+        assert remap_bpm.measure_division([1], 192) == 192
+        assert remap_bpm.measure_division([3], 48) == 16
+        # not a division StepMania normally uses
+        assert remap_bpm.measure_division([1], 20) == 20
+
+    def test_sparse_measures_text(self):
+        tap = remap_bpm.encode_row("1000")
+        mine = remap_bpm.encode_row("000M")
+        # measure 0 needs 8ths, measure 1 is empty, measure 2 needs 12ths
+        notes = {0: tap, 24: mine, 2 * 192 + 64: tap, 2 * 192 + 100: 0}
+        text = remap_bpm.sparse_measures_text(notes, 192, 4)
+        measures = [x.strip().split("\n") for x in text.split(",")]
+        assert [len(x) for x in measures] == [8, 4, 12]
+        assert measures[0][0] == "1000"
+        assert measures[0][1] == "000M"
+        assert measures[1] == ["0000"] * 4
+        assert measures[2][4] == "1000"
+
+    def test_before_first_beat(self):
+        tap = remap_bpm.encode_row("1000")
+        # beats -2 and -1 can't be written, so nothing is dropped quietly
+        notes = {-96: tap, -48: tap, 0: tap}
+        self.assertRaises(RuntimeError, remap_bpm.sparse_measures_text, notes, 192, 4)
+        self.assertRaises(RuntimeError, remap_bpm.sparse_measures_text, {-96: tap}, 192, 4)
+        # an empty row there is fine
+        assert remap_bpm.sparse_measures_text({-96: 0, 0: tap}, 192, 4).startswith("1000\n")
+
+
+SSC_TEXT = """#VERSION:0.83;
+#TITLE:Test;  #ARTIST:Nobody; // a comment
+#OFFSET:0.000;
+#BPMS:0.000=120.000;
+#STOPS:;
+#NOTEDATA:;
+#STEPSTYPE:dance-single;
+#DIFFICULTY:Hard;
+#BPMS:0.000=240.000;
+#NOTES:
+1000
+0100
+,
+0010
+0001
+;
+#NOTEDATA:;
+#STEPSTYPE:dance-single;
+#DIFFICULTY:Easy;
+#NOTES:
+1000
+;
+"""
+
+class TestReadSimfile(unittest.TestCase):
+    def test_iter_simfile(self):
+        pairs = list(remap_bpm.iter_simfile(SSC_TEXT.split("\n")))
+        assert pairs[:3] == [("VERSION", "0.83"), ("TITLE", "Test"), ("ARTIST", "Nobody")]
+        notes = [value for key, value in pairs if key == "NOTES"]
+        # the last line of a value is not run into the line before it
+        assert notes[0] == "\n1000\n0100\n,\n0010\n0001\n"
+        assert notes[1] == "\n1000\n"
+
+    def test_bad_key(self):
+        self.assertRaises(RuntimeError, list, remap_bpm.iter_simfile(["#:foo;"]))
+        self.assertRaises(RuntimeError, list, remap_bpm.iter_simfile(["#TITLE", ":foo;"]))
+
+    def test_ssc_charts(self):
+        pairs = list(remap_bpm.iter_simfile(SSC_TEXT.split("\n")))
+        header, charts = remap_bpm.ssc_charts(pairs)
+        assert [x[0] for x in header] == ["VERSION", "TITLE", "ARTIST", "OFFSET", "BPMS", "STOPS"]
+        assert len(charts) == 2
+        assert charts[0][0][0] == "NOTEDATA"
+
+        # the song's timing comes from the header, not the charts
+        simfile = remap_bpm.Simfile(pairs)
+        assert simfile.bpms == [(0.0, 120.0)]
+        hard = remap_bpm.chart_timing(simfile, charts[0])
+        easy = remap_bpm.chart_timing(simfile, charts[1])
+        assert abs(hard.time(4) - 1.0) < 1e-9
+        assert abs(easy.time(4) - 2.0) < 1e-9
+
+
+SM_TEXT = """#TITLE:Test;
+#offset:0.000;
+#BPMS:0.000=120.000;
+#NOTES:
+     dance-single:
+     :
+     Hard:
+     9:
+     0.1,0.2,0.3,0.4,0.5:
+1000
+0100
+0010
+0001
+;
+#NOTES:
+     dance-single:
+     :
+     Easy:
+     2:
+     0.1,0.2,0.3,0.4,0.5:
+1000
+;
+"""
+
+class TestOnsets(unittest.TestCase):
+    def test_sm_onsets(self):
+        text = SM_TEXT.replace("1000\n;", "0000\n0000\n0000\n0M00\n,\n0200\n0000\n0300\n1000\n;")
+        simfile = remap_bpm.Simfile(list(remap_bpm.iter_simfile(text.split("\n"))))
+        beats, times = remap_bpm.simfile_onsets(simfile)
+        # the mine and the tail aren't onsets, and beat 0 is only counted once
+        assert list(beats) == [0.0, 1.0, 2.0, 3.0, 4.0, 7.0]
+        assert list(times) == [0.0, 0.5, 1.0, 1.5, 2.0, 3.5]
+
+    def test_ssc_onsets(self):
+        simfile = remap_bpm.Simfile(list(remap_bpm.iter_simfile(SSC_TEXT.split("\n"))))
+        beats, times = remap_bpm.simfile_onsets(simfile)
+        # the Hard chart is at 240 bpm, the Easy at 120
+        assert list(beats) == [0.0, 2.0, 4.0, 6.0]
+        assert list(times) == [0.0, 0.5, 1.0, 1.5]
+
+
+class TestSimfileIndex(unittest.TestCase):
+    def setUp(self):
+        self.simfile = remap_bpm.Simfile(list(remap_bpm.iter_simfile(SM_TEXT.split("\n"))))
+
+    def test_get(self):
+        assert self.simfile.get("title") == "Test"
+        assert self.simfile.get("OFFSET") == "0.000"
+        assert self.simfile.get("stops") is None
+        assert self.simfile.get("stops", "") == ""
+        assert self.simfile.indices("notes") == [3, 4]
+
+    def test_set(self):
+        self.simfile.update_bpms("0.100", "0.000=150.000", "")
+        assert self.simfile.pairs[1] == ("OFFSET", "0.100")
+        assert self.simfile.get("bpms") == "0.000=150.000"
+        # STOPS wasn't there to begin with
+        assert self.simfile.get("stops") is None
+        self.assertRaises(RuntimeError, self.simfile.replace, 0, "foo", "ARTIST")
+
+    def test_lazy_charts(self):
+        hard = self.simfile.chart(3)
+        assert hard is self.simfile.chart(3)
+        assert hard._pieces is None and hard._notes is None
+        assert hard.difficulty == "Hard"
+        assert hard.meter == "9"
+        assert hard._notes is None
+        beats, rows, width = hard.notes
+        assert list(beats) == [0.0, 1.0, 2.0, 3.0]
+        assert width == 4
+        assert [x.difficulty for x in self.simfile.charts()] == ["Hard", "Easy"]
+
+        # replacing the text drops the parsed chart
+        self.simfile.replace(3, self.simfile.pairs[4][1])
+        assert self.simfile.chart(3).difficulty == "Easy"
+
+
+class TestBeatTags(unittest.TestCase):
+    def test_fix_beat_tags(self):
+        text = SM_TEXT.replace("#BPMS:0.000=120.000;\n", """#BPMS:0.000=120.000;
+#BGCHANGES:2.000=song.avi=1.000=0=0=1,
+4.000=-nosongbg-=1.000=0=0=0;
+#FGCHANGES:;
+#FAKES:1.000=2.000;
+#SPEEDS:0.000=1.000=4.000=0,8.000=2.000=1.000=1;
+#LABELS:6.000=Chorus;
+#ATTACKS:TIME=1.000:LEN=2.000:MODS=drunk;
+#WARPS:3.000=1.000;
+""")
+        old_simfile = remap_bpm.Simfile(list(remap_bpm.iter_simfile(text.split("\n"))))
+        new_simfile = copy.deepcopy(old_simfile)
+        new_simfile.update_bpms("0.500", "0.000=60.000", "")
+        remap_bpm.fix_beat_tags(old_simfile, new_simfile)
+        assert new_simfile.get("bgchanges") == "1.500=song.avi=1.000=0=0=1,\n2.500=-nosongbg-=1.000=0=0=0"
+        assert new_simfile.get("fgchanges") == ""
+        assert new_simfile.get("fakes") == "1.000=1.000"
+        # the second speed change is in seconds, so its length stays the same
+        assert new_simfile.get("speeds") == "0.500=1.000=2.000=0,\n4.500=2.000=1.000=1"
+        assert new_simfile.get("labels") == "3.500=Chorus"
+        assert new_simfile.get("attacks") == old_simfile.get("attacks")
+        assert new_simfile.get("warps") == ""
+        assert new_simfile.indices("WARPS") == old_simfile.indices("warps")
+
+
+class TestFixNotes(unittest.TestCase):
+    def remap(self, jobs):
+        old_simfile = remap_bpm.Simfile(list(remap_bpm.iter_simfile(SM_TEXT.split("\n"))))
+        new_simfile = copy.deepcopy(old_simfile)
+        new_simfile.update_bpms(None, "0.000=180.000", "")
+        remap_bpm.fix_notes(old_simfile, new_simfile, 48, 0.0, jobs=jobs)
+        return new_simfile
+
+    def test_fix_notes(self):
+        new_simfile = self.remap(jobs=1)
+        beats, rows, width = new_simfile.chart(3).notes
+        assert list(beats) == [0.0, 1.5, 3.0, 4.5]
+        assert new_simfile.chart(4).difficulty == "Easy"
+
+    def test_parallel_fix_notes(self):
+        assert self.remap(jobs=2).pairs == self.remap(jobs=1).pairs
+
+
+class TestChartCache(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def remap(self, cache, bpms="0.000=180.000"):
+        old_simfile = remap_bpm.Simfile(list(remap_bpm.iter_simfile(SM_TEXT.split("\n"))))
+        new_simfile = copy.deepcopy(old_simfile)
+        new_simfile.update_bpms(None, bpms, "")
+        remap_bpm.fix_notes(old_simfile, new_simfile, 48, 0.0, cache=cache)
+        return new_simfile
+
+    def test_hits(self):
+        cache = remap_bpm.ChartCache(self.directory)
+        first = self.remap(cache)
+        assert (cache.hits, cache.misses) == (0, 2)
+        second = self.remap(cache)
+        assert (cache.hits, cache.misses) == (2, 2)
+        assert first.pairs == second.pairs == self.remap(None).pairs
+
+        # different timing, different entries
+        self.remap(cache, "0.000=150.000")
+        assert (cache.hits, cache.misses) == (2, 4)
+
+    def test_trim(self):
+        cache = remap_bpm.ChartCache(self.directory, max_entries=3)
+        self.remap(cache)
+        # make the first entries older than the next ones
+        for filename in os.listdir(self.directory):
+            os.utime(os.path.join(self.directory, filename), (1000, 1000))
+        self.remap(cache, "0.000=150.000")
+        assert len(os.listdir(self.directory)) == 3
+        self.remap(cache, "0.000=150.000")
+        assert (cache.hits, cache.misses) == (2, 4)
+
+
+class TestBatch(unittest.TestCase):
+    def setUp(self):
+        self.input_dir = tempfile.mkdtemp()
+        self.output_dir = tempfile.mkdtemp()
+        for name in ("Song A", "Song B", "Broken"):
+            os.mkdir(os.path.join(self.input_dir, name))
+            with open(os.path.join(self.input_dir, name, "song.sm"), "w") as fout:
+                fout.write(SM_TEXT if name != "Broken" else "#TITLE:Broken;\n")
+
+    def tearDown(self):
+        shutil.rmtree(self.input_dir)
+        shutil.rmtree(self.output_dir)
+
+    def test_remap_directory(self):
+        manifest = {"Song B": {"bpms": "0.000=60.000"},
+                    "Song B/song.sm": {"offset": "0.5"}}
+        defaults = {"bpms": "0.000=240.000", "stops": "", "offset": None,
+                    "snap": 48, "remove_small_holds": 0.0}
+        results = remap_bpm.remap_directory(self.input_dir, self.output_dir,
+                                            manifest, defaults, jobs=2)
+        assert [x.path for x in results] == ["Broken/song.sm", "Song A/song.sm", "Song B/song.sm"]
+        assert "doesn't have a BPM" in results[0].error
+        assert results[1].error is None and results[2].error is None
+        assert not os.path.exists(os.path.join(self.output_dir, "Broken", "song.sm"))
+
+        song_a = remap_bpm.read_simfile(os.path.join(self.output_dir, "Song A", "song.sm"))
+        assert song_a.get("bpms") == "0.000=240.000"
+        song_b = remap_bpm.read_simfile(os.path.join(self.output_dir, "Song B", "song.sm"))
+        assert song_b.get("bpms") == "0.000=60.000"
+        assert song_b.get("offset") == "0.5"
+        assert list(song_b.chart(3).notes[0]) == [0.5, 1.0, 1.5, 2.0]
+
+        # a second run doesn't touch files which came out the same
+        results = remap_bpm.remap_directory(self.input_dir, self.output_dir,
+                                            manifest, defaults, jobs=1)
+        assert [x.written for x in results] == [False, False, False]
+
+
+    def test_read_manifest(self):
+        filename = os.path.join(self.output_dir, "manifest.json")
+        with open(filename, "w") as fout:
+            fout.write('{"Song A": {"bpms": 150, "offset": 0.009, "snap": 192}, '
+                       '"Song B": {"bpms": "0=120,64=240", "remove_small_holds": "0.5", "offset": null}}')
+        manifest = remap_bpm.read_manifest(filename)
+        assert manifest["Song A"] == {"bpms": "150", "offset": "0.009", "snap": 192}
+        assert manifest["Song B"] == {"bpms": "0=120,64=240", "remove_small_holds": 0.5, "offset": None}
+        assert remap_bpm.normalize_bpms(manifest["Song A"]["bpms"]) == "0.0=150"
+
+        for bad in ('{"Song A": {"bpms": [150]}}', '{"Song A": {"snap": "often"}}',
+                    '{"Song A": {"stops": null}}', '{"Song A": {"tempo": 150}}',
+                    '{"Song A": "150"}', '["Song A"]'):
+            with open(filename, "w") as fout:
+                fout.write(bad)
+            self.assertRaises(RuntimeError, remap_bpm.read_manifest, filename)
+
+
+class TestWriteSimfile(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, "song.sm")
+        self.simfile = remap_bpm.Simfile(list(remap_bpm.iter_simfile(SM_TEXT.split("\n"))))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_write(self):
+        assert remap_bpm.write_simfile(self.filename, self.simfile)
+        assert remap_bpm.read_simfile(self.filename).pairs == self.simfile.pairs
+        # only the simfile is left behind, no temp files
+        assert os.listdir(self.directory) == ["song.sm"]
+
+        assert not remap_bpm.write_simfile(self.filename, self.simfile, fsync=True)
+        self.simfile.set("title", "Changed")
+        assert remap_bpm.write_simfile(self.filename, self.simfile, fsync=True)
+        assert remap_bpm.read_simfile(self.filename).get("title") == "Changed"
+        assert os.listdir(self.directory) == ["song.sm"]
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,286 @@
+"""
+Finds files which are stored more than once in downloaded simfiles.
+
+Overlapping categories downloaded with scrape_category often have the
+same songs, so the same audio and graphics end up on disk several
+times under different directory names.
+
+Only files which have the same size as another file are read at all.
+Those are hashed in a pool of threads, a chunk at a time, and files
+with the same hash are reported as duplicates.  Hashes are kept in a
+pickle file along with the size and mtime of each file, so later runs
+only hash files which are new or have changed.
+
+Run with the directories to check:
+
+python dedupe.py Songs/Week1 Songs/Week2
+
+Add --link to replace duplicate audio and graphics files with hard
+links to a single copy.  Simfiles themselves are left alone, as they
+are the files people edit.
+"""
+
+# Copyright 2016 by John Bauer
+# Distributed under the Apache License 2.0
+
+# TO THE EXTENT PERMITTED BY LAW, THE SOFTWARE IS PROVIDED "AS IS",
+# WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT
+# LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE, TITLE AND NON-INFRINGEMENT. IN NO EVENT SHALL
+# THE COPYRIGHT HOLDERS OR ANYONE DISTRIBUTING THE SOFTWARE BE LIABLE
+# FOR ANY DAMAGES OR OTHER LIABILITY, WHETHER IN CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE
+# OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import argparse
+import hashlib
+import os
+import tempfile
+from collections import namedtuple
+
+# python 2.7/3.6 compatability
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+try:
+    from concurrent.futures import ThreadPoolExecutor
+except ImportError:
+    # python 2 without the futures backport.  files are hashed one at a time
+    ThreadPoolExecutor = None
+
+try:
+    replace_file = os.replace
+except AttributeError:
+    replace_file = os.rename
+
+# Files with these extensions are safe to hard link together.  They
+# are never edited in place, unlike the simfiles.
+LINKABLE_EXTENSIONS = (".ogg", ".mp3", ".wav", ".flac",
+                       ".png", ".jpg", ".jpeg", ".bmp", ".gif",
+                       ".avi", ".mp4", ".mpg", ".mpeg")
+
+CACHE_VERSION = 1
+DEFAULT_CACHE = "dedupe_hashes.pkl"
+
+FileInfo = namedtuple("FileInfo", "path size mtime")
+DuplicateGroup = namedtuple("DuplicateGroup", "size digest paths")
+DedupeResult = namedtuple("DedupeResult", "groups files hashed cached")
+
+
+def walk_files(directories):
+    """
+    Returns a FileInfo for every file under the directories.
+
+    Files which are already hard links to a file seen earlier are
+    skipped, since they don't take up any more space.
+    """
+    files = []
+    seen = set()
+    for directory in directories:
+        for root, dirs, names in os.walk(directory):
+            dirs.sort()
+            for name in sorted(names):
+                path = os.path.join(root, name)
+                if os.path.islink(path):
+                    continue
+                stat = os.stat(path)
+                if stat.st_ino:
+                    inode = (stat.st_dev, stat.st_ino)
+                    if inode in seen:
+                        continue
+                    seen.add(inode)
+                files.append(FileInfo(path, stat.st_size, stat.st_mtime))
+    return files
+
+
+def size_collisions(files):
+    """
+    Returns the files which have the same size as at least one other
+    file.  Empty files are all the same, so they are left out.
+    """
+    by_size = {}
+    for info in files:
+        if info.size > 0:
+            by_size.setdefault(info.size, []).append(info)
+    return [info for infos in by_size.values() if len(infos) > 1 for info in infos]
+
+
+def file_hash(path, chunk_size=1 << 20):
+    """
+    sha1 of a file, read a chunk at a time so large audio files don't
+    have to fit in memory
+    """
+    digest = hashlib.sha1()
+    with open(path, "rb") as fin:
+        while True:
+            chunk = fin.read(chunk_size)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def cache_key(path):
+    return os.path.normcase(os.path.abspath(path))
+
+
+def load_hash_cache(filename):
+    """
+    Reads the map from path to (size, mtime, digest).  A missing or
+    unreadable cache is treated as empty.
+    """
+    if not filename or not os.path.exists(filename):
+        return {}
+    try:
+        with open(filename, "rb") as fin:
+            version, cache = pickle.load(fin)
+    except (OSError, IOError, EOFError, ValueError, pickle.UnpicklingError):
+        print("Unable to load %s, ignoring" % filename)
+        return {}
+    if version != CACHE_VERSION:
+        return {}
+    return cache
+
+
+def save_hash_cache(filename, cache):
+    """
+    Writes the cache to a temp file and moves it into place, so an
+    interrupted run never leaves a partial cache behind.
+    """
+    directory = os.path.dirname(os.path.abspath(filename))
+    fd, temp_name = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as fout:
+            pickle.dump((CACHE_VERSION, cache), fout, pickle.HIGHEST_PROTOCOL)
+        replace_file(temp_name, filename)
+    except:
+        try:
+            os.remove(temp_name)
+        except (OSError, IOError):
+            pass
+        raise
+
+
+def find_duplicates(directories, cache=None, jobs=4):
+    """
+    Returns a DedupeResult with a DuplicateGroup for each set of files
+    under the directories which have the same contents.
+
+    cache is a map from load_hash_cache.  It is updated with the
+    hashes of every file which was read, and files under the
+    directories which no longer exist are dropped from it.  Groups are
+    sorted so the ones which waste the most space come first.
+    """
+    if cache is None:
+        cache = {}
+    files = walk_files(directories)
+    candidates = size_collisions(files)
+
+    current = set(cache_key(info.path) for info in files)
+    roots = tuple(os.path.join(cache_key(x), "") for x in directories)
+    for key in [x for x in cache if x.startswith(roots) and x not in current]:
+        del cache[key]
+
+    digests = {}
+    to_hash = []
+    for info in candidates:
+        cached = cache.get(cache_key(info.path))
+        if cached is not None and cached[:2] == (info.size, info.mtime):
+            digests[info.path] = cached[2]
+        else:
+            to_hash.append(info)
+
+    paths = [info.path for info in to_hash]
+    if jobs > 1 and len(paths) > 1 and ThreadPoolExecutor is not None:
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            hashed = list(executor.map(file_hash, paths))
+    else:
+        hashed = [file_hash(path) for path in paths]
+    for info, digest in zip(to_hash, hashed):
+        digests[info.path] = digest
+        cache[cache_key(info.path)] = (info.size, info.mtime, digest)
+
+    by_digest = {}
+    for info in candidates:
+        by_digest.setdefault((info.size, digests[info.path]), []).append(info.path)
+    groups = [DuplicateGroup(size, digest, sorted(paths))
+              for (size, digest), paths in by_digest.items() if len(paths) > 1]
+    groups.sort(key=lambda x: (-x.size * (len(x.paths) - 1), x.paths[0]))
+    return DedupeResult(groups, len(files), len(to_hash), len(candidates) - len(to_hash))
+
+
+def is_linkable(path):
+    return path.lower().endswith(LINKABLE_EXTENSIONS)
+
+
+def link_duplicates(groups):
+    """
+    Replaces every copy after the first in each group of audio or
+    graphics files with a hard link to the first.
+
+    Each link is made under a temporary name and then moved over the
+    copy, so a copy is never missing if something goes wrong.
+    Returns the number of bytes freed.
+    """
+    freed = 0
+    for group in groups:
+        paths = [x for x in group.paths if is_linkable(x)]
+        if len(paths) < 2:
+            continue
+        original = paths[0]
+        for path in paths[1:]:
+            temp_name = path + ".dedupe"
+            try:
+                os.link(original, temp_name)
+                replace_file(temp_name, path)
+            except (OSError, IOError) as e:
+                print("Unable to link %s to %s: %s" % (path, original, e))
+                if os.path.exists(temp_name):
+                    os.remove(temp_name)
+                continue
+            freed = freed + group.size
+    return freed
+
+
+def print_report(result):
+    wasted = 0
+    for group in result.groups:
+        print("%d copies of %d bytes:" % (len(group.paths), group.size))
+        for path in group.paths:
+            print("  %s" % path)
+        wasted = wasted + group.size * (len(group.paths) - 1)
+    print("%d files checked, %d hashed, %d hashes from the cache" %
+          (result.files, result.hashed, result.cached))
+    print("%d groups of duplicates, wasting %d bytes" % (len(result.groups), wasted))
+
+
+def build_argparser():
+    argparser = argparse.ArgumentParser(description='Find files which are stored more than once in downloaded simfiles.')
+    argparser.add_argument("directories", nargs="+",
+                           help="Directories to check, such as the dest of several downloads")
+    argparser.add_argument("--jobs", type=int, default=4,
+                           help="How many files to hash at once")
+    argparser.add_argument("--cache", default=os.path.join(os.path.split(__file__)[0], DEFAULT_CACHE),
+                           help="Where to keep the hashes between runs.  Default is %s in the module directory" % DEFAULT_CACHE)
+    argparser.add_argument("--no-cache", dest="cache", action="store_const", const=None,
+                           help="Don't read or write the hash cache")
+    argparser.add_argument("--link", action="store_true",
+                           help="Replace duplicate audio and graphics files with hard links to one copy")
+    return argparser
+
+
+def main():
+    args = build_argparser().parse_args()
+    cache = load_hash_cache(args.cache)
+    result = find_duplicates(args.directories, cache, args.jobs)
+    if args.cache:
+        save_hash_cache(args.cache, cache)
+    print_report(result)
+    if args.link:
+        freed = link_duplicates(result.groups)
+        print("Freed %d bytes with hard links" % freed)
+
+if __name__ == "__main__":
+    main()
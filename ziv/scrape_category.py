@@ -43,13 +43,21 @@ as they would require logging in.
 
 import argparse
 import codecs
+import cProfile
 import datetime
+import json
+import logging
 import os
+import pstats
 import re
 import sys
+import threading
 import time
 import zipfile
+import zlib
 from collections import namedtuple, OrderedDict
+from contextlib import contextmanager
+from timeit import default_timer
 
 # python 2.7/3.6 compatability
 try:
@@ -67,12 +75,116 @@ try:
 except ImportError:
     from html.parser import HTMLParser
 
+try:
+    from concurrent.futures import ThreadPoolExecutor
+except ImportError:
+    # python 2 without the futures backport.  --jobs does nothing
+    ThreadPoolExecutor = None
+
+try:
+    WindowsError
+except NameError:
+    # only defined on Windows
+    WindowsError = OSError
+
 
 CURRENT_WEEK = "[Round B]"
 DEFAULT_CATEGORY = "957"
 
 Simfile = namedtuple("Simfile", "simfileid name age")
 
+# How the files in a zip are laid out, from inspect_zip
+FLAT_ZIP = "flat"
+DIRECTORY_ZIP = "directory"
+INVALID_ZIP = "invalid"
+ZipLayout = namedtuple("ZipLayout", "names structure directory")
+# error is None if the zip could be read
+ZipCheck = namedtuple("ZipCheck", "filename layout error")
+
+logger = logging.getLogger(__name__)
+
+
+class StageTimer(object):
+    """
+    Keeps track of how long each stage of a download takes.
+
+    Stages are named by the caller, such as "fetch" or "extract".
+    Wrap the work with
+
+      with TIMINGS.span("extract"):
+          ...
+
+    and the elapsed wall clock time is recorded even if the work
+    raises an exception.  Spans can be nested, in which case the
+    outer stage includes the time of the inner stage.
+
+    summary() turns the recorded times into a dict with counts,
+    totals and a histogram for each stage, suitable for json.dumps
+    """
+    # upper bounds, in seconds, of the histogram buckets.
+    # anything slower than the last bucket goes in an overflow bucket
+    HISTOGRAM_BOUNDS = (0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0)
+
+    def __init__(self):
+        self.durations = OrderedDict()
+
+    def reset(self):
+        self.durations = OrderedDict()
+
+    def record(self, stage, seconds):
+        self.durations.setdefault(stage, []).append(seconds)
+        logger.debug("%s took %.3fs", stage, seconds)
+
+    @contextmanager
+    def span(self, stage):
+        start = default_timer()
+        try:
+            yield
+        finally:
+            self.record(stage, default_timer() - start)
+
+    def histogram(self, stage):
+        """
+        Returns an OrderedDict from bucket label to number of spans
+        in that bucket.  Label "<=0.5" means between the previous
+        bound and 0.5 seconds.
+        """
+        buckets = OrderedDict()
+        for bound in self.HISTOGRAM_BOUNDS:
+            buckets["<=%g" % bound] = 0
+        overflow = ">%g" % self.HISTOGRAM_BOUNDS[-1]
+        buckets[overflow] = 0
+        for seconds in self.durations.get(stage, []):
+            for bound in self.HISTOGRAM_BOUNDS:
+                if seconds <= bound:
+                    buckets["<=%g" % bound] += 1
+                    break
+            else:
+                buckets[overflow] += 1
+        return buckets
+
+    def summary(self):
+        summary = OrderedDict()
+        for stage, durations in self.durations.items():
+            summary[stage] = OrderedDict([
+                ("count", len(durations)),
+                ("total", sum(durations)),
+                ("mean", sum(durations) / len(durations)),
+                ("min", min(durations)),
+                ("max", max(durations)),
+                ("histogram", self.histogram(stage)),
+            ])
+        return summary
+
+    def json_summary(self):
+        return json.dumps(self.summary(), indent=2)
+
+
+# Module level timer used by the download pipeline.  Callers such as
+# main() can reset it, or read it after a run to see where the time
+# went.
+TIMINGS = StageTimer()
+
 AGE_PATTERN = re.compile('^([0-9.]+) (second|minute|hour|day|week|month|year)s? ago$')
 
 AGE_INTERVALS = {
@@ -367,18 +479,19 @@ def get_content(url, split=True, force_decode=False):
     Respects encoding if possible.
     If split=True, splits the page on newlines.
     """
-    connection = urlopen(url)
-    try:
-        encoding = connection.headers.get_charset()
-    except AttributeError:
-        encoding = connection.headers.getparam('charset')
-    if encoding is not None:
-        content = connection.read().decode(encoding)
-    else:
-        content = connection.read()
-        if force_decode:
-            content = content.decode('utf-8')
-    connection.close()
+    with TIMINGS.span("fetch"):
+        connection = urlopen(url)
+        try:
+            encoding = connection.headers.get_charset()
+        except AttributeError:
+            encoding = connection.headers.getparam('charset')
+        if encoding is not None:
+            content = connection.read().decode(encoding)
+        else:
+            content = connection.read()
+            if force_decode:
+                content = content.decode('utf-8')
+        connection.close()
 
     if split:
         content = content.split("\n")
@@ -399,7 +512,8 @@ def scrape_platforms(url=ZIV_SIMFILE_CATEGORIES):
 
     content = get_content(url, split=False, force_decode=True)
     parser = SimfileHomepageHTMLParser()
-    parser.feed(content)
+    with TIMINGS.span("parse"):
+        parser.feed(content)
     return parser.platforms
 
 
@@ -459,7 +573,8 @@ def get_category_from_ziv(category, url=ZIV_CATEGORY):
 
     content = get_content(url, split=False, force_decode=True)
     parser = CategoryHTMLParser()
-    parser.feed(content)
+    with TIMINGS.span("parse"):
+        parser.feed(content)
     results = parser.simfiles
 
     print("Found %d simfiles" % len(results))
@@ -474,16 +589,18 @@ def get_file_link_from_ziv(simfileid, url=ZIV_SIMFILE):
     Gets the page for this particular simfile, extracts the link to
     the largest zip file on that link
     """
-    url = url % simfileid
-    content = get_content(url, split=True, force_decode=True)
-    zip_lines = [x for x in content if "ZIP" in x]
-
-    results = []
-    for i in zip_lines:
-        parser = DownloadHTMLParser()
-        parser.feed(i)
-        if parser.link is not None:
-            results.append((parser.link, parser.size))
+    with TIMINGS.span("link"):
+        url = url % simfileid
+        content = get_content(url, split=True, force_decode=True)
+        zip_lines = [x for x in content if "ZIP" in x]
+
+        results = []
+        with TIMINGS.span("parse"):
+            for i in zip_lines:
+                parser = DownloadHTMLParser()
+                parser.feed(i)
+                if parser.link is not None:
+                    results.append((parser.link, parser.size))
 
     # sort by size, so we download the largest and presumably the most
     # interesting
@@ -530,7 +647,7 @@ def simfile_already_downloaded(simfile, dest, check_zip=True, verbose=True):
         return True
 
     if check_zip:
-        filename = os.path.join(dest, "sim%s.zip" % simfile.simfileid)
+        filename = get_zip_filename(simfile, dest)
         if os.path.exists(filename):
             if verbose:
                 print("Zip file already exists: %s" % filename)
@@ -560,10 +677,21 @@ def valid_zipfile_directory_structure(filename):
             simzip.close()
 
 
-def valid_directory_structure(simzip):
+def inspect_zip(simzip):
+    """
+    Reads the names in the zip once and works out how it is laid out.
+
+    Returns a ZipLayout with the names, minus mac system files, and
+    the structure, which is one of
+      FLAT_ZIP: only files, no directories
+      DIRECTORY_ZIP: everything is in one top level directory
+      INVALID_ZIP: anything else, including an empty zip
+    directory is the sanitized top level directory of the first name,
+    which is where a DIRECTORY_ZIP should be extracted.
+    """
     names = filter_mac_files(simzip.namelist())
     if len(names) == 0:
-        return False
+        return ZipLayout(names, INVALID_ZIP, None)
     # In most cases, a directory containing the files is zipped into
     # the archive.  However, that's not necessarily the case.  What
     # does happen, though, is that even the directories have a "/" in
@@ -572,16 +700,35 @@ def valid_directory_structure(simzip):
     # files share that name, then we have a valid directory structure.
     # TODO: this doesn't actually check for music files, simfiles, etc
     # in the first directory, but that's okay
-    if any(x.find("/") < 0 for x in names):
-        return False
-    dirs = [x.split("/")[0] for x in names]
-    dirs.sort(key=len)
-    directory = dirs[0] + "/"
-    # All files have to be in the same subdirectory directory.
-    # Obviously the subdirectory itself satisfies startswith(itself)
-    if any(not x.startswith(directory) for x in names):
-        return False
-    return True
+    top = names[0].split("/")[0]
+    flat = True
+    single_directory = True
+    for name in names:
+        slash = name.find("/")
+        if slash < 0:
+            single_directory = False
+        else:
+            flat = False
+            if name[:slash] != top:
+                single_directory = False
+    if flat:
+        structure = FLAT_ZIP
+    elif single_directory:
+        structure = DIRECTORY_ZIP
+    else:
+        structure = INVALID_ZIP
+    return ZipLayout(names, structure, sanitize_name(top.strip()))
+
+
+def valid_directory_structure(simzip, layout=None):
+    """
+    Returns True if everything in the zip is in one directory.
+
+    layout can be passed in if inspect_zip was already called.
+    """
+    if layout is None:
+        layout = inspect_zip(simzip)
+    return layout.structure == DIRECTORY_ZIP
 
 
 def filter_mac_files(names):
@@ -592,7 +739,7 @@ def filter_mac_files(names):
             if not x.startswith("__MAC") and x.find("/__MAC") < 0]
 
 
-def flat_directory_structure(simzip):
+def flat_directory_structure(simzip, layout=None):
     """
     Returns True if the zip does not actually contain any directories,
     but is instead just a bunch of files.
@@ -600,27 +747,23 @@ def flat_directory_structure(simzip):
     but some people do submit zip files that way anyway, so it is
     good to compensate.
     """
-    names = filter_mac_files(simzip.namelist())
-    if len(names) == 0:
-        return False
-    for name in names:
-        if name.find("/") >= 0:
-            return False
-    return True
+    if layout is None:
+        layout = inspect_zip(simzip)
+    return layout.structure == FLAT_ZIP
 
 
-def get_directory(simzip):
+def get_directory(simzip, layout=None):
     """
     Assumes the directory structure inside the zip is valid,
     so it assumes there is exactly one directory and returns that.
     Eg, call valid_directory_structure before calling this function.
     """
-    names = filter_mac_files(simzip.namelist())
-    inner_directory = names[0].split("/")[0].strip()
-    return sanitize_name(inner_directory)
+    if layout is None:
+        layout = inspect_zip(simzip)
+    return layout.directory
 
 
-def extract_zip(simzip, dest, inner_directory):
+def extract_zip(simzip, dest, inner_directory, layout=None):
     """
     Unfortunately, some files have spaces at the end of their
     directory names, and on Windows that screws everything up.  This
@@ -632,7 +775,9 @@ def extract_zip(simzip, dest, inner_directory):
     os.mkdir(directory)
 
     # skip files that have _MAC in them
-    namelist = filter_mac_files(simzip.namelist())
+    if layout is None:
+        layout = inspect_zip(simzip)
+    namelist = list(layout.names)
     # sort so that we always create subdirectories first if needed
     namelist.sort(key=len)
 
@@ -668,7 +813,7 @@ def sanitize_name(name):
     return name
 
 
-def extract_simfile(simfile, dest):
+def extract_simfile(simfile, dest, layout=None):
     """
     Given an (id, name) tuple and the destination arg,
     extract the simfile to the appropriate location.
@@ -679,29 +824,34 @@ def extract_simfile(simfile, dest):
     If the simfile's name has trailing or leading spaces, this
     causes IOErrors on Windows, but that is also fixable.
 
+    layout can be passed in if the zip was already inspected, such as
+    by check_zip.
+
     Return value is the directory extracted to.
     """
-    filename = os.path.join(dest, "sim%s.zip" % simfile.simfileid)
+    filename = get_zip_filename(simfile, dest)
 
     simzip = None
     extracted_directory = None
     try:
         simzip = zipfile.ZipFile(filename)
-        if flat_directory_structure(simzip):
+        if layout is None:
+            layout = inspect_zip(simzip)
+        if flat_directory_structure(simzip, layout):
             # There is no inner directory, but we will treat the
             # directory we create as the location for the files
             extracted_directory = sanitize_name(simfile.name)
-            extract_zip(simzip, dest, extracted_directory)
-        elif not valid_directory_structure(simzip):
+            extract_zip(simzip, dest, extracted_directory, layout)
+        elif not valid_directory_structure(simzip, layout):
             print("Invalid directory structure in %s" % filename)
         else:
             # This will check for spaces at the start or end of the
             # filenames, which are not okay in Windows
             # Another reason we can't use extractall because we want
             # to eliminate files such as _MACOSX
-            extracted_directory = get_directory(simzip)
+            extracted_directory = get_directory(simzip, layout)
             extracted_directory = sanitize_name(extracted_directory)
-            extract_zip(simzip, dest, extracted_directory)
+            extract_zip(simzip, dest, extracted_directory, layout)
     except (zipfile.BadZipfile, IOError, WindowsError):
         print("Unable to extract %s" % filename)
         if (extracted_directory is not None and
@@ -715,13 +865,88 @@ def extract_simfile(simfile, dest):
     return extracted_directory
 
 
+def get_zip_filename(simfile, dest):
+    return os.path.join(dest, "sim%s.zip" % simfile.simfileid)
+
+
+def check_zip(filename, crc=False):
+    """
+    Reads the central directory of a downloaded zip and inspects its
+    layout.  If crc is set, every file in the zip is also
+    decompressed and checked against its CRC, which finds downloads
+    that were cut off or corrupted in the middle.
+
+    Returns a ZipCheck.  A zip with an invalid layout is not an error
+    here, as downloading it again won't help.
+    """
+    try:
+        with zipfile.ZipFile(filename) as simzip:
+            layout = inspect_zip(simzip)
+            if crc:
+                bad_name = simzip.testzip()
+                if bad_name is not None:
+                    return ZipCheck(filename, layout, "Bad CRC for %s" % bad_name)
+            return ZipCheck(filename, layout, None)
+    except (zipfile.BadZipfile, zipfile.LargeZipFile, zlib.error,
+            IOError, OSError, EOFError, RuntimeError, NotImplementedError) as e:
+        return ZipCheck(filename, None, "%s: %s" % (type(e).__name__, e))
+
+
+def get_quarantine_dir(dest):
+    return os.path.join(dest, "quarantine")
+
+
+def quarantine_zip(simfile, dest, error):
+    """
+    Moves a zip which couldn't be read into the quarantine directory,
+    so it isn't mistaken for a finished download.  It will be
+    downloaded again on the next run.
+    """
+    filename = get_zip_filename(simfile, dest)
+    quarantine_dir = get_quarantine_dir(dest)
+    try:
+        os.makedirs(quarantine_dir)
+    except OSError:
+        # another worker may have just made it
+        if not os.path.isdir(quarantine_dir):
+            raise
+    quarantined = os.path.join(quarantine_dir, os.path.basename(filename))
+    if os.path.exists(quarantined):
+        os.remove(quarantined)
+    os.rename(filename, quarantined)
+    print('Unable to use "%s" (%s), moved to %s' % (simfile.name, error, quarantined))
+
+
+def validate_download(simfile, dest, link, verify=False, retries=1):
+    """
+    Checks a downloaded zip with check_zip, downloading it up to
+    retries more times if it can't be read.  If it still can't be
+    read, it is quarantined.
+
+    Returns the last ZipCheck.
+    """
+    filename = get_zip_filename(simfile, dest)
+    for attempt in range(retries + 1):
+        if attempt > 0:
+            print('Downloading "%s" again (retry %d of %d)' % (simfile.name, attempt, retries))
+            get_simfile_from_ziv(simfile, link, dest)
+        with TIMINGS.span("verify"):
+            check = check_zip(filename, crc=verify)
+        if check.error is None:
+            return check
+        print("Problem with %s: %s" % (filename, check.error))
+    quarantine_zip(simfile, dest, check.error)
+    return check
+
+
 def get_simfile_from_ziv(simfile, link, dest):
-    filename = os.path.join(dest, "sim%s.zip" % simfile.simfileid)
+    filename = get_zip_filename(simfile, dest)
     print('Downloading "%s" from %s to %s' % (simfile.name, link, filename))
-    content = get_content(link, split=False)
-    fout = open(filename, "wb")
-    fout.write(content)
-    fout.close()
+    with TIMINGS.span("download"):
+        content = get_content(link, split=False)
+        fout = open(filename, "wb")
+        fout.write(content)
+        fout.close()
 
 
 def unlink_zip(simfile, dest):
@@ -729,12 +954,16 @@ def unlink_zip(simfile, dest):
     If we successfully download and extract a zip, we will probably
     want to clean up after ourselves
     """
-    filename = os.path.join(dest, "sim%s.zip" % simfile.simfileid)
-    os.unlink(filename)
+    filename = get_zip_filename(simfile, dest)
+    with TIMINGS.span("tidy"):
+        os.unlink(filename)
 
 
 LOG_PATTERN = re.compile('^(.*) extracted to "(.*)" instead of "(.*)"$')
 
+# zips can be extracted by several threads at once, see download_simfiles
+LOG_LOCK = threading.Lock()
+
 def get_log_filename(dest):
     return os.path.join(dest, "download_log.txt")
 
@@ -744,10 +973,11 @@ def renaming_message(simfile, actual):
 def log_renaming_message(simfile, actual, dest):
     message = renaming_message(simfile, actual)
     log_filename = get_log_filename(dest)
-    with codecs.open(log_filename, "a", encoding="utf-8") as fout:
-        fout.write(message)
-        fout.write("\n")
-        fout.close()
+    with LOG_LOCK:
+        with codecs.open(log_filename, "a", encoding="utf-8") as fout:
+            fout.write(message)
+            fout.write("\n")
+            fout.close()
 
 
 def update_records_from_log(records, dest):
@@ -802,21 +1032,54 @@ def build_argparser():
                            help="Don't use download_log.txt")
     argparser.set_defaults(use_logfile=True)
 
+    argparser.add_argument("--verify", dest="verify", action="store_true",
+                           help="Check the CRC of every file in each zip before extracting it")
+    argparser.add_argument("--no-verify", dest="verify", action="store_false",
+                           help="Only check that each zip can be opened before extracting it")
+    argparser.set_defaults(verify=False)
+    argparser.add_argument("--retries", type=int, default=1,
+                           help="How many times to download a broken zip again before moving it to the quarantine directory")
+    argparser.add_argument("--jobs", type=int, default=1,
+                           help="Check and extract this many zips at once while the next ones download")
+
     argparser.add_argument("--since", default="",
                            help="Only download files updated since this date.  Setting this argument will re-download existing simfiles.")
 
+    argparser.add_argument("--timing-summary", dest="timing_summary",
+                           default=None,
+                           help="Write a JSON summary of how long each stage of the download took to this file.  By default, the summary is printed at the end of the run.")
+    argparser.add_argument("--profile", default=None,
+                           help="Run the whole download under cProfile and dump the stats to this file.  The slowest calls are also printed.")
+
     return argparser
 
 
-def download_simfile(simfile, dest, tidy, use_logfile, extract, link=None):
+def download_simfile(simfile, dest, tidy, use_logfile, extract, link=None,
+                     verify=False, retries=1):
     """
     Given a single simfile record, download that simfile to the dest directory.
     """
     if link is None:
         link = get_file_link_from_ziv(simfile.simfileid)
     get_simfile_from_ziv(simfile, link, dest)
+    finish_download(simfile, dest, tidy, use_logfile, extract, link, verify, retries)
+
+
+def finish_download(simfile, dest, tidy, use_logfile, extract, link,
+                    verify=False, retries=1):
+    """
+    Everything after the zip is downloaded: checking it, extracting
+    it, and cleaning up.  A zip which can't be read is downloaded
+    again or quarantined by validate_download.
+    """
+    if not extract and not verify:
+        return
+    check = validate_download(simfile, dest, link, verify, retries)
+    if check.error is not None:
+        return
     if extract:
-        extracted_directory = extract_simfile(simfile, dest)
+        with TIMINGS.span("extract"):
+            extracted_directory = extract_simfile(simfile, dest, check.layout)
         if (extracted_directory is not None and
             extracted_directory != simfile.name):
             if use_logfile:
@@ -833,7 +1096,8 @@ def download_simfile(simfile, dest, tidy, use_logfile, extract, link=None):
             unlink_zip(simfile, dest)
 
 
-def download_simfiles(records, dest, tidy, use_logfile, extract):
+def download_simfiles(records, dest, tidy, use_logfile, extract,
+                      verify=False, retries=1, jobs=1):
     """
     Downloads the simfiles and returns how many zips were actually downloaded.
 
@@ -841,12 +1105,35 @@ def download_simfiles(records, dest, tidy, use_logfile, extract):
     dest : directory to send the simfiles (and logs)
     tidy : clean up zips if the simfiles are successfully extracted
     use_logfile : write a log to that directory
+    verify : check the CRCs of the zips before extracting
+    retries : how many times to download a broken zip again
+    jobs : if more than 1, zips are checked and extracted in a pool
+      of threads while the next zips download
     """
     count = 0
-    for simfile in records.values():
-        if not simfile_already_downloaded(simfile, dest):
-            download_simfile(simfile, dest, tidy, use_logfile, extract)
+    if jobs > 1 and ThreadPoolExecutor is not None:
+        executor = ThreadPoolExecutor(max_workers=jobs)
+    else:
+        executor = None
+    futures = []
+    try:
+        for simfile in records.values():
+            if simfile_already_downloaded(simfile, dest):
+                continue
+            link = get_file_link_from_ziv(simfile.simfileid)
+            get_simfile_from_ziv(simfile, link, dest)
+            args = (simfile, dest, tidy, use_logfile, extract, link, verify, retries)
+            if executor is None:
+                finish_download(*args)
+            else:
+                futures.append(executor.submit(finish_download, *args))
             count = count + 1
+    finally:
+        if executor is not None:
+            executor.shutdown(wait=True)
+    for future in futures:
+        # raise any errors from the workers
+        future.result()
     return count
 
 
@@ -878,7 +1165,10 @@ def download_category(category, dest,
                       since="",
                       use_logfile=True,
                       extract=True,
-                      tidy=True):
+                      tidy=True,
+                      verify=False,
+                      retries=1,
+                      jobs=1):
     records = get_filtered_records_from_ziv(category=category,
                                             dest=dest,
                                             prefix=prefix,
@@ -890,7 +1180,10 @@ def download_category(category, dest,
                               dest=dest,
                               tidy=tidy,
                               use_logfile=use_logfile,
-                              extract=extract)
+                              extract=extract,
+                              verify=verify,
+                              retries=retries,
+                              jobs=jobs)
     print("Downloaded %d simfiles" % count)
 
 
@@ -912,8 +1205,9 @@ def main():
     # Some files such as 29506 include mac-specific subdirectories.
     # Those get filtered when the zip is extracted.
     #
-    # TODO: 
-    # 29287 from Midspeed does not unzip correctly, zipfile.BadZipfile
+    # Zips which can't be read, such as 29287 from Midspeed, are
+    # downloaded again --retries times and then moved to the
+    # quarantine directory.  --verify also checks the CRCs.
     #
     # TODO features:
     # Added a --since flag, but --before would be nice too.
@@ -926,7 +1220,7 @@ def main():
     #
     # TODO other stuff:
     # write unit tests
-    # use the logging library
+    # use the logging library for the rest of the messages
     try:
         sys.stdout = codecs.getwriter("utf-8")(sys.stdout.buffer)
     except AttributeError:
@@ -935,14 +1229,37 @@ def main():
     argparser = build_argparser()
     args = argparser.parse_args()
 
-    download_category(category=args.category,
-                      dest=args.dest,
-                      prefix=args.prefix,
-                      regex=args.regex,
-                      since=args.since,
-                      use_logfile=args.use_logfile,
-                      extract=args.extract,
-                      tidy=args.tidy)
+    TIMINGS.reset()
+    profiler = None
+    if args.profile:
+        profiler = cProfile.Profile()
+        profiler.enable()
+    try:
+        download_category(category=args.category,
+                          dest=args.dest,
+                          prefix=args.prefix,
+                          regex=args.regex,
+                          since=args.since,
+                          use_logfile=args.use_logfile,
+                          extract=args.extract,
+                          tidy=args.tidy,
+                          verify=args.verify,
+                          retries=args.retries,
+                          jobs=args.jobs)
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(args.profile)
+            print("Profile written to %s" % args.profile)
+            pstats.Stats(profiler, stream=sys.stdout).sort_stats("cumulative").print_stats(20)
+
+    if args.timing_summary:
+        with open(args.timing_summary, "w") as fout:
+            fout.write(TIMINGS.json_summary())
+            fout.write("\n")
+    else:
+        print("Time spent in each stage:")
+        print(TIMINGS.json_summary())
 
 if __name__ == "__main__":
     main()
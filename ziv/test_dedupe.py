@@ -0,0 +1,81 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import dedupe
+
+class TestDedupe(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.week1 = os.path.join(self.directory, "Week1")
+        self.week2 = os.path.join(self.directory, "Week2")
+        self.write("Week1/Song/song.ogg", b"music" * 100)
+        self.write("Week1/Song/song.sm", b"#TITLE:Song;")
+        self.write("Week1/Song/bg.png", b"picture")
+        self.write("Week2/Song copy/song.ogg", b"music" * 100)
+        self.write("Week2/Song copy/song.sm", b"#TITLE:Song;")
+        # same size as the picture, different contents
+        self.write("Week2/Song copy/bn.png", b"PICTURE")
+        self.write("Week2/Other/empty.txt", b"")
+        self.write("Week2/Other/empty2.txt", b"")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, path, data):
+        filename = os.path.join(self.directory, *path.split("/"))
+        if not os.path.exists(os.path.dirname(filename)):
+            os.makedirs(os.path.dirname(filename))
+        with open(filename, "wb") as fout:
+            fout.write(data)
+
+    def test_find_duplicates(self):
+        result = dedupe.find_duplicates([self.week1, self.week2], jobs=2)
+        assert result.files == 8
+        # the empty files aren't hashed and the simfiles don't collide with anything
+        assert result.hashed == 6
+        groups = [[os.path.relpath(x, self.directory).replace(os.sep, "/") for x in group.paths]
+                  for group in result.groups]
+        # the biggest waste comes first
+        assert groups == [["Week1/Song/song.ogg", "Week2/Song copy/song.ogg"],
+                          ["Week1/Song/song.sm", "Week2/Song copy/song.sm"]]
+
+    def test_cache(self):
+        cache_file = os.path.join(self.directory, "hashes.pkl")
+        cache = dedupe.load_hash_cache(cache_file)
+        assert cache == {}
+        dedupe.find_duplicates([self.week1, self.week2], cache)
+        dedupe.save_hash_cache(cache_file, cache)
+
+        # same size as before, so only the mtime shows it changed
+        self.write("Week2/Song copy/bn.png", b"picture")
+        banner = os.path.join(self.week2, "Song copy", "bn.png")
+        mtime = os.stat(banner).st_mtime + 10
+        os.utime(banner, (mtime, mtime))
+        os.remove(os.path.join(self.week2, "Song copy", "song.sm"))
+        cache = dedupe.load_hash_cache(cache_file)
+        result = dedupe.find_duplicates([self.week1, self.week2], cache)
+        # only the changed file is read again
+        assert (result.hashed, result.cached) == (1, 3)
+        assert len(result.groups) == 2
+        assert dedupe.cache_key(os.path.join(self.week2, "Song copy", "song.sm")) not in cache
+        assert dedupe.cache_key(os.path.join(self.week1, "Song", "song.sm")) in cache
+
+    @unittest.skipIf(not hasattr(os, "link"), "no hard links on this platform")
+    def test_link(self):
+        result = dedupe.find_duplicates([self.week1, self.week2])
+        freed = dedupe.link_duplicates(result.groups)
+        assert freed == 500
+        assert os.path.samefile(os.path.join(self.week1, "Song", "song.ogg"),
+                                os.path.join(self.week2, "Song copy", "song.ogg"))
+        # simfiles are not linked
+        assert not os.path.samefile(os.path.join(self.week1, "Song", "song.sm"),
+                                    os.path.join(self.week2, "Song copy", "song.sm"))
+        # linked files are no longer reported
+        result = dedupe.find_duplicates([self.week1, self.week2])
+        assert len(result.groups) == 1
+
+
+if __name__ == '__main__':
+    unittest.main()
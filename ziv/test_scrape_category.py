@@ -1,4 +1,5 @@
 import glob
+import json
 import os
 import shutil
 import tempfile
@@ -292,6 +293,73 @@ class TestDirectoryStructure(unittest.TestCase):
         assert "foo" == self.get_directory("good_spaces_onefile.zip")
         assert "foo" == self.get_directory("good_illegal_char.zip")
 
+    def test_inspect_zip(self):
+        expected = {"good_basic.zip": scrape_category.DIRECTORY_ZIP,
+                    "good_macfile.zip": scrape_category.DIRECTORY_ZIP,
+                    "good_spaces_onefile.zip": scrape_category.DIRECTORY_ZIP,
+                    "flat_simfile.zip": scrape_category.FLAT_ZIP,
+                    "bad_toplevel.zip": scrape_category.INVALID_ZIP,
+                    "bad_twodirectories.zip": scrape_category.INVALID_ZIP,
+                    "bad_empty.zip": scrape_category.INVALID_ZIP}
+        for filename, structure in expected.items():
+            with zipfile.ZipFile(os.path.join(MODULE_DIR, "test/zips", filename)) as zfile:
+                layout = scrape_category.inspect_zip(zfile)
+                assert layout.structure == structure
+                # the other checks can reuse the layout
+                assert (scrape_category.valid_directory_structure(zfile, layout) ==
+                        (structure == scrape_category.DIRECTORY_ZIP))
+        with zipfile.ZipFile(os.path.join(MODULE_DIR, "test/zips", "good_macfile.zip")) as zfile:
+            layout = scrape_category.inspect_zip(zfile)
+            assert not any("__MAC" in x for x in layout.names)
+            assert layout.directory == "foo"
+
+class TestCheckZip(unittest.TestCase):
+    def setUp(self):
+        self.dest = tempfile.mkdtemp()
+        self.simfile = scrape_category.Simfile("100", "Bar", 1000)
+
+    def tearDown(self):
+        shutil.rmtree(self.dest)
+
+    def write_zip(self, filename):
+        with zipfile.ZipFile(filename, "w") as zfile:
+            zfile.writestr("foo/foo.sm", "#TITLE:foo;\n" * 20)
+        with zipfile.ZipFile(filename) as zfile:
+            info = zfile.getinfo("foo/foo.sm")
+        return info.header_offset + 30 + len(info.filename) + len(info.extra)
+
+    def test_check_zip(self):
+        filename = os.path.join(self.dest, "good.zip")
+        data_start = self.write_zip(filename)
+        check = scrape_category.check_zip(filename, crc=True)
+        assert check.error is None
+        assert check.layout.structure == scrape_category.DIRECTORY_ZIP
+
+        # a damaged file is only found by checking the CRC
+        with open(filename, "r+b") as fout:
+            fout.seek(data_start + 5)
+            fout.write(b"X")
+        assert scrape_category.check_zip(filename).error is None
+        assert "foo/foo.sm" in scrape_category.check_zip(filename, crc=True).error
+
+        # a cut off download doesn't even have a central directory
+        with open(filename, "r+b") as fout:
+            fout.truncate(data_start + 10)
+        check = scrape_category.check_zip(filename)
+        assert check.error is not None and check.layout is None
+
+    def test_quarantine(self):
+        broken = os.path.join(self.dest, "broken.zip")
+        with open(broken, "wb") as fout:
+            fout.write(b"not a zip")
+        link = "file:///" + broken.replace("\\", "/")
+        scrape_category.download_simfile(self.simfile, self.dest,
+                                         tidy=True, use_logfile=True,
+                                         extract=True, link=link, retries=2)
+        assert not os.path.exists(os.path.join(self.dest, "sim100.zip"))
+        assert os.path.exists(os.path.join(scrape_category.get_quarantine_dir(self.dest), "sim100.zip"))
+        assert not os.path.exists(os.path.join(self.dest, "Bar"))
+
 class TestExtract(unittest.TestCase):
     def setUp(self):
         self.dest = tempfile.mkdtemp()
@@ -439,6 +507,52 @@ class TestDownload(unittest.TestCase):
 
         self.check_saved_files(log=False, unzipped=False, zipped=True)
 
+class TestStageTimer(unittest.TestCase):
+    def test_record_and_summary(self):
+        timer = scrape_category.StageTimer()
+        timer.record("fetch", 0.02)
+        timer.record("fetch", 0.2)
+        timer.record("extract", 100.0)
+
+        summary = timer.summary()
+        assert list(summary.keys()) == ["fetch", "extract"]
+        assert summary["fetch"]["count"] == 2
+        assert abs(summary["fetch"]["total"] - 0.22) < 1e-9
+        assert summary["fetch"]["max"] == 0.2
+        assert summary["fetch"]["histogram"]["<=0.05"] == 1
+        assert summary["fetch"]["histogram"]["<=0.5"] == 1
+        assert summary["extract"]["histogram"][">60"] == 1
+        # the summary is meant to be dumped as json
+        assert json.loads(timer.json_summary())["extract"]["count"] == 1
+
+    def test_span_records_exceptions(self):
+        timer = scrape_category.StageTimer()
+        try:
+            with timer.span("parse"):
+                raise ValueError("broken page")
+        except ValueError:
+            pass
+        assert len(timer.durations["parse"]) == 1
+
+    def test_pipeline_stages(self):
+        """
+        The module level timer should pick up the stages used when
+        downloading a simfile
+        """
+        dest = tempfile.mkdtemp()
+        try:
+            scrape_category.TIMINGS.reset()
+            simfile = scrape_category.Simfile("100", "Bar", 1000)
+            link = "file:///" + MODULE_DIR + "/test/zips/good_basic.zip"
+            scrape_category.download_simfile(simfile, dest, tidy=True,
+                                             use_logfile=True, extract=True,
+                                             link=link)
+            stages = set(scrape_category.TIMINGS.durations.keys())
+            assert stages == set(["fetch", "download", "verify", "extract", "tidy"])
+        finally:
+            scrape_category.TIMINGS.reset()
+            shutil.rmtree(dest)
+
 # TODO test:
 # log files:
 #   renaming_message